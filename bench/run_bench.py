@@ -0,0 +1,236 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.join(script_dir, '..')
+sys.path.append(project_root)
+
+import pandas as pd
+
+from bench.workbook import WorkbookShape, write_workbook
+from src.device import Device, DeviceCollection, normalise_dataframe
+from src.layout import render_definition, render_description
+from src.reader import ExcelReader, COLUMNS_INDEX
+from src.tcgvl import render_tcgvl
+from src.version import get_version
+
+# The measured stages, in pipeline order. No work is timed in two stages,
+# so the stages add up to the time of a run.
+STAGES = [
+    'open',               # opening the workbook
+    'read',               # parsing the sheets
+    'process',            # the reader's fill and filter chain
+    'normalise',          # normalise_dataframe
+    'build_devices',      # the devices of the collection, from the normalised frame
+    'layout',             # the memory map of every unit
+    'build_definition',   # the GVL declaration lines
+    'build_description',  # the astDevices array
+    'render_xml',         # the TcGVL files around the declaration lines
+    'to_st_cmd',          # iocsh files
+    'to_opi',             # mid files
+]
+
+
+class StageTimer:
+    """
+    Sums the wall time spent in each stage of one run.
+    """
+
+    def __init__(self) -> None:
+        self.seconds: Dict[str, float] = defaultdict(float)
+
+    @contextmanager
+    def __call__(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] += time.perf_counter() - started
+
+
+def run_once(path: str, sheet_indices: Optional[List[int]] = None, ioc_ip: str = '10.0.0.1',
+             plc_ip: str = '10.0.0.2') -> Dict:
+    """
+    Runs every stage over the sheets of a workbook once, without the sheet cache.
+
+    :param path: The path of the workbook.
+    :param sheet_indices: The sheets to run, all sheets if None.
+    :param ioc_ip: The IOC address rendered into the st.cmd files.
+    :param plc_ip: The PLC address rendered into the st.cmd files.
+    :return: The seconds spent per stage and the counters of the run.
+    """
+    timer = StageTimer()
+    counts = defaultdict(int)
+
+    with ExcelReader(path) as reader:
+        with timer('open'):
+            sheet_names = reader.sheet_names
+        if sheet_indices is None:
+            sheet_indices = list(range(len(sheet_names)))
+
+        for sheet_index in sheet_indices:
+            with timer('read'):
+                sheet, instrument_name = reader._parse_sheet(sheet_index)
+            with timer('process'):
+                df = reader._process_sheet(sheet, COLUMNS_INDEX)
+            with timer('normalise'):
+                normalised = normalise_dataframe(df)
+            with timer('build_devices'):
+                # DeviceCollection.from_dataframe without normalising again
+                device_collection = DeviceCollection(instrument_name)
+                for fields in normalised.itertuples(index=False, name=None):
+                    device_collection.add_device(Device(*fields))
+
+            counts['sheets'] += 1
+            counts['rows'] += len(sheet)
+            counts['devices'] += len(df)
+            for mc_unit in device_collection.devices_by_unit:
+                with timer('layout'):
+                    slots = device_collection.layout(mc_unit)
+                with timer('build_definition'):
+                    definition = render_definition(slots)
+                with timer('build_description'):
+                    description = render_description(slots)
+                with timer('render_xml'):
+                    # DeviceCollection.render_xml from the timed lines
+                    xml = render_tcgvl(device_collection.declaration_header(mc_unit) + definition + description)
+                counts['units'] += 1
+                counts['slots'] += len(slots)
+                counts['xml_bytes'] += len(xml.encode('utf-8'))
+
+            with timer('to_st_cmd'):
+                st_cmds = device_collection.render_st_cmds(ioc_ip, plc_ip)
+            counts['st_cmd_bytes'] += sum(len(st_cmd.encode('utf-8')) for st_cmd in st_cmds.values())
+
+            with timer('to_opi'):
+                opis = [device_collection.render_opi(mc_unit) for mc_unit in device_collection.devices_by_unit]
+            counts['opi_bytes'] += sum(len(opi.encode('utf-8')) for opi in opis)
+
+    return {'seconds': dict(timer.seconds), 'counts': dict(counts)}
+
+
+def summarise(runs: List[Dict]) -> Dict:
+    """
+    Summarises repeated runs: min, median and mean seconds of every stage.
+    """
+    stages = {}
+    for stage in STAGES:
+        samples = [run['seconds'].get(stage, 0.0) for run in runs]
+        stages[stage] = {
+            'min': min(samples),
+            'median': statistics.median(samples),
+            'mean': statistics.fmean(samples),
+        }
+    totals = [sum(run['seconds'].values()) for run in runs]
+    stages['total'] = {'min': min(totals), 'median': statistics.median(totals), 'mean': statistics.fmean(totals)}
+    return stages
+
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[str]:
+    """
+    Lists the stages whose median got slower than the baseline by more than threshold.
+
+    :param results: The results of this run.
+    :param baseline: The results of an earlier run, as written by this script.
+    :param threshold: The tolerated slowdown, e.g. 0.2 for 20 %.
+    :return: One line per regressed stage.
+    """
+    regressions = []
+    for stage, timing in results['stages'].items():
+        before = baseline.get('stages', {}).get(stage, {}).get('median')
+        if before and timing['median'] > before * (1 + threshold):
+            regressions.append(f"{stage}: {before * 1000:.1f} ms -> {timing['median'] * 1000:.1f} ms "
+                               f"(+{(timing['median'] / before - 1) * 100:.0f} %)")
+    return regressions
+
+
+def print_table(results: Dict) -> None:
+    print(f"{'stage':<18} {'min ms':>10} {'median ms':>10} {'mean ms':>10}")
+    for stage, timing in results['stages'].items():
+        print(f"{stage:<18} {timing['min'] * 1000:>10.2f} {timing['median'] * 1000:>10.2f} "
+              f"{timing['mean'] * 1000:>10.2f}")
+    print(', '.join(f"{name}: {value}" for name, value in results['counts'].items()))
+
+
+def main():
+    defaults = WorkbookShape()
+    parser = argparse.ArgumentParser(description="Time every stage of the generator on a synthetic workbook.")
+    parser.add_argument("--sheets", type=int, default=defaults.sheets, help="Instrument sheets in the workbook.")
+    parser.add_argument("--units", type=int, default=defaults.units, help="Motion control units per sheet.")
+    parser.add_argument("--axes", type=int, default=defaults.axes, help="Electrical axes per unit.")
+    parser.add_argument("--pneumatics", type=int, default=defaults.pneumatics, help="Pneumatic axes per unit.")
+    parser.add_argument("--sensors", type=int, default=defaults.sensors,
+                        help="Stand-alone temperature sensors per unit.")
+    parser.add_argument("--temp-every", type=int, default=defaults.temp_every,
+                        help="Every n-th axis has a temperature sensor (0 for none).")
+    parser.add_argument("--extra-every", type=int, default=defaults.extra_every,
+                        help="Every n-th electrical axis has an extra PILS device (0 for none).")
+    parser.add_argument("--spare-every", type=int, default=defaults.spare_every,
+                        help="Every n-th axis is a spare (0 for none).")
+    parser.add_argument("-w", "--workbook", help="Time an existing workbook instead of a synthetic one.")
+    parser.add_argument("--keep-workbook", help="Also save the synthetic workbook to this path.")
+    parser.add_argument("-r", "--repeat", type=int, default=5, help="Number of timed runs.")
+    parser.add_argument("-o", "--output", help="Write the results to this JSON file.")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare against.")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Slowdown of a stage median over the baseline that counts as a regression.")
+    args = parser.parse_args()
+
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.workbook:
+            path = args.workbook
+            shape = None
+        else:
+            shape = WorkbookShape(args.sheets, args.units, args.axes, args.pneumatics, args.sensors,
+                                  args.temp_every, args.extra_every, args.spare_every)
+            path = args.keep_workbook or os.path.join(tmp_dir, 'bench.xlsx')
+            write_workbook(path, shape)
+
+        # One untimed run, so imports and template loading are not measured
+        run_once(path)
+        runs = [run_once(path) for _ in range(args.repeat)]
+
+    results = {
+        'meta': {
+            'generator_version': get_version(),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'platform': platform.platform(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        },
+        'workbook': os.path.basename(args.workbook) if args.workbook else None,
+        'shape': shape._asdict() if shape else None,
+        'repeat': args.repeat,
+        'stages': summarise(runs),
+        'counts': runs[0]['counts'],
+    }
+
+    print_table(results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(results, file, indent=2)
+            file.write('\n')
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for line in regressions:
+            print(f"Regression: {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+from typing import List, NamedTuple
+
+import openpyxl
+
+from src.reader import COLUMN_INFO
+
+# Number of columns of a motion sheet, up to the last one the reader uses
+SHEET_WIDTH = COLUMN_INFO[-1][0] + 1
+
+COLUMN_POSITIONS = {name: index for index, name in COLUMN_INFO}
+
+# The cabinet type column, not read by the generator
+CABINET_COLUMN = 5
+
+# Extra PILS device types the synthetic axes cycle through
+EXTRA_TYPES = (1201, 1302, '1A04', 1202)
+
+# The rows between the header and the first device, dropped by the reader
+# but still part of its fill-down, as in the instrument workbooks
+PREAMBLE = [
+    (None, 'ToM CHESS Revision', 'rev 3 released'),
+    ('INSTRUMENT SYSTEM', None, None, None, 'CABINET', None, None, None, 'Axes', None, 'PILS', None, None, None,
+     'Extra PILS devices'),
+    ('Old ToM#', 'ToM Axis Description', 'ESS name\n(EPICS PV)', 'Sub-System\n(FBS Description)', 'MC Unit',
+     'Cabinet Type', 'PV root', 'PTP', 'Axis ID', 'Actuator type', 'PILS name\n(max. 15 char.)', 'PILS unit',
+     'Temperature sensor', 'Temperature unit', 'Extra PILS devices', 'variable name', 'extra PILS device type',
+     'Extra PILS device descitpion'),
+    (0, 'Attention: This is an Example line!!', 'ColChg:MC-LinY-01', 'Collimation System', '1',
+     'MCU 5001a (1.6 kW)', 'MCS1::', 'yes\nno', 1, 'Electrical\nPneumatic', 'Shutter', 'mm\ndegree', 'x-if yes',
+     'c-Celsius\nk-Kelvin', 'x-if yes', 'stTempVacuum', 1302, 'temp#1Vacuum'),
+    (),
+]
+
+
+class WorkbookShape(NamedTuple):
+    """
+    The size of a synthetic instrument workbook.
+    """
+    sheets: int = 1
+    units: int = 4
+    axes: int = 16           # electrical axes per unit
+    pneumatics: int = 4      # pneumatic axes per unit
+    sensors: int = 2         # stand-alone temperature sensors per unit
+    temp_every: int = 2      # every n-th axis has a temperature sensor, 0 for none
+    extra_every: int = 4     # every n-th electrical axis has an extra device, 0 for none
+    spare_every: int = 8     # every n-th axis is a spare without PV name, 0 for none
+
+    @property
+    def devices_per_sheet(self) -> int:
+        return self.units * (self.axes + self.pneumatics + self.sensors)
+
+
+def _row(**values) -> List:
+    row = [None] * SHEET_WIDTH
+    for name, value in values.items():
+        row[COLUMN_POSITIONS[name]] = value
+    return row
+
+
+def _every(n: int, i: int) -> bool:
+    return n > 0 and i % n == 0
+
+
+def unit_rows(shape: WorkbookShape, instrument: str, mc_unit: int) -> List[List]:
+    """
+    Builds the spreadsheet rows of one motion control unit.
+
+    :param shape: The size of the workbook.
+    :param instrument: The instrument name, part of the PV names.
+    :param mc_unit: The motion control unit.
+    :return: The rows, in the COLUMN_INFO layout.
+    """
+    rows = []
+    axis_count = shape.axes + shape.pneumatics
+    for i in range(1, axis_count + 1):
+        electrical = i <= shape.axes
+        axis = i if electrical else i - shape.axes
+        kind = 'Mtr' if electrical else 'Pne'
+        values = dict(
+            axis_description=f"{instrument} unit {mc_unit} axis {i}",
+            pv_name=0 if _every(shape.spare_every, i) else f"U{mc_unit}:MC-{kind}-{axis:02d}",
+            fbs_description=f"Subsystem {mc_unit}",
+            axis_index=axis,
+            actuator_type='Electrical' if electrical else 'Pneumatic',
+            pils_name=f"U{mc_unit}{'M' if electrical else 'P'}{axis}",
+        )
+        if electrical:
+            values['pils_unit'] = 'degree' if i % 3 == 0 else 'mm'
+        if _every(shape.temp_every, i):
+            values.update(has_temp='x', temp_units='k' if i % 5 == 0 else 'c')
+        if electrical and _every(shape.extra_every, i):
+            values.update(extra_dev='x', extra_name=f"stMotorM{axis}Extra",
+                          extra_type=EXTRA_TYPES[(i // shape.extra_every) % len(EXTRA_TYPES)],
+                          extra_desc=f"Extra#{axis}")
+        rows.append(_row(**values))
+
+    for i in range(1, shape.sensors + 1):
+        rows.append(_row(axis_description=f"PT100 sensor {i}", pv_name=f"U{mc_unit}:MC-Temp-{i:02d}",
+                         fbs_description='PT100 sensor', axis_index=axis_count + i, actuator_type=0,
+                         pils_name=f"U{mc_unit}T{i}", has_temp='x', temp_units='c', extra_dev='x',
+                         extra_name=f"stTemp{i}", extra_type=1302, extra_desc=f"Temp#{i}Sensor"))
+
+    # The unit's settings are only given on its first row and filled down by the reader
+    first = rows[0]
+    first[COLUMN_POSITIONS['mc_unit']] = mc_unit
+    first[CABINET_COLUMN] = 'MCU5001a'
+    first[COLUMN_POSITIONS['pv_root']] = f"MCS{mc_unit}::"
+    first[COLUMN_POSITIONS['ptp']] = 'yes' if mc_unit % 2 else 'no'
+    return rows
+
+
+def write_workbook(path: str, shape: WorkbookShape = WorkbookShape()) -> List[str]:
+    """
+    Writes a synthetic instrument workbook.
+
+    :param path: The path of the .xlsx file.
+    :param shape: The size of the workbook.
+    :return: The instrument name of every sheet.
+    """
+    book = openpyxl.Workbook(write_only=True)
+    instruments = []
+    for sheet_number in range(1, shape.sheets + 1):
+        instrument = f"BENCH{sheet_number}"
+        instruments.append(instrument)
+        sheet = book.create_sheet(f"{instrument.lower()}_motion")
+        sheet.append([None, 'Instrument', instrument])
+        for row in PREAMBLE:
+            sheet.append(list(row))
+        for mc_unit in range(1, shape.units + 1):
+            for row in unit_rows(shape, instrument, mc_unit):
+                sheet.append(row)
+    book.save(path)
+    return instruments
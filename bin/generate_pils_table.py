@@ -1,28 +1,119 @@
 import argparse
+import cProfile
 import os
 import sys
+from typing import List, Optional
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 project_root = os.path.join(script_dir, '..')
 sys.path.append(project_root)
 
-from src.device import DeviceCollection
-from src.reader import ExcelReader
-from src.reader import COLUMNS_INDEX
+from src import timing
+from src.allocation import ALLOCATION_FILE_NAME, AllocationOptions, read_allocation_file
+from src.cache import SheetCache
+from src.layout import INDEX_ORDERS, LayoutOptions
+from src.memory_map import MEMORY_MAP_FORMATS
+from src.pipeline import generate_outputs, generate_sheets, read_collection
+from src.poll_budget import DEFAULT_BANDWIDTH, DEFAULT_POLL_PERIOD, DEFAULT_REQUESTS, POLL_LOAD_FILE_NAME, PollBudget
+from src.read_blocks import DEFAULT_MAX_BLOCK, DEFAULT_MAX_GAP, ReadBlockOptions
+from src.reader import COLUMNS_INDEX, ExcelReader
+from src.sinks import is_directory_spec, open_sink
+from src.version import set_version
+from src.watch import DEFAULT_INTERVAL, WorkbookWatcher
 
 
 def main():
     # Set up argument parsing
     parser = argparse.ArgumentParser(description="Generate XML configuration for devices from an Excel file.")
     parser.add_argument("-p", "--path", help="Path to the Excel file containing device data.", required=True)
-    parser.add_argument("-s", "--sheet", help="Sheet index to read from the Excel file.", type=int, required=True)
+
+    sheet_group = parser.add_mutually_exclusive_group(required=True)
+    sheet_group.add_argument("-s", "--sheet", help="Sheet index to read from the Excel file.", type=int)
+    sheet_group.add_argument("--sheets", nargs="+", metavar="SHEET",
+                             help="Sheet indices, names or glob patterns to generate in one run.")
+    sheet_group.add_argument("--all-sheets", action="store_true",
+                             help="Generate every instrument sheet of the Excel file, skipping the other sheets.")
+    parser.add_argument("-o", "--output-dir", default=".",
+                        help="Directory to write to, or an archive (.zip, .tar, .tar.gz, .tgz, .tar.bz2, .tar.xz) "
+                             "or - for standard output. With --sheets/--all-sheets every instrument "
+                             "gets its own sub-directory.")
+
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="Number of worker processes to spread sheets and units over (0 uses every core).")
+
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only regenerate the units whose devices or options changed since the last run.")
+
+    parser.add_argument("--watch", action="store_true",
+                        help="Keep running and regenerate the units that changed whenever the workbook is saved.")
+    parser.add_argument("--watch-interval", type=float, default=DEFAULT_INTERVAL,
+                        help=f"Seconds between two checks of the workbook in --watch mode (default: {DEFAULT_INTERVAL}).")
+
+    parser.add_argument("--pack", action="store_true",
+                        help="Place the PILS devices of a unit by alignment instead of in spreadsheet order, so "
+                             "the process image has no padding, and print the bytes saved per unit.")
+    parser.add_argument("--index-order", choices=INDEX_ORDERS, default='spreadsheet',
+                        help="Number the PILS devices in spreadsheet order (default) or in memory order.")
+
+    parser.add_argument("--stable-offsets", action="store_true",
+                        help="Keep the %%MB offsets and PILS indices of the previous generation, read from "
+                             f"{ALLOCATION_FILE_NAME} or the PILS tables in the output directory, so adding "
+                             "a device allows an online change. New devices go into free space or at the end.")
+    parser.add_argument("--allocation-file", metavar="PATH",
+                        help=f"Read the previous allocation from this {ALLOCATION_FILE_NAME} instead, and "
+                             "merge the new one back into it; a missing file is created.")
+    parser.add_argument("--headroom", action="append", default=[], metavar="[UNIT=]BYTES",
+                        help="Bytes kept free for new devices before the system block when it is first "
+                             "allocated, for every unit or for UNIT only. A system block kept from a previous "
+                             "generation does not move, so its headroom is ignored with a warning. "
+                             "May be given more than once.")
+
+    parser.add_argument("--stream", action="store_true",
+                        help="Read the sheets row by row, keeping memory use flat for large sheets. "
+                             "Does not use the parsed-sheet cache.")
+
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always parse the workbook instead of using the parsed-sheet cache.")
+    parser.add_argument("--cache-dir", help="Directory of the parsed-sheet cache "
+                                            "(default: $PILS_GENERATOR_CACHE_DIR or ~/.cache/pils-epics-generator).")
 
     parser.add_argument("--pils", help="Boolean flag if you want to generate PILS tables")
     parser.add_argument("--ioc", help="Boolean flag if you want to generate IOC st.cmd")
     parser.add_argument("--opi", help="Boolean flag if you want to generate OPI css")
+    parser.add_argument("--memory-map", action="append", default=[], choices=sorted(MEMORY_MAP_FORMATS),
+                        help="Also write the memory map of every unit in this format: packed records (.pilsmap), "
+                             "Parquet or the Arrow IPC file format. May be given more than once.")
+    parser.add_argument("--read-blocks", action="store_true",
+                        help="Plan the ADS read blocks of every unit per poll class, write them next to the "
+                             "st.cmd and set them as its ECM_READBLOCKS_* variables.")
+    parser.add_argument("--max-block", type=int, default=DEFAULT_MAX_BLOCK, metavar="BYTES",
+                        help=f"Largest ADS read block planned (default: {DEFAULT_MAX_BLOCK}).")
+    parser.add_argument("--max-gap", type=int, default=DEFAULT_MAX_GAP, metavar="BYTES",
+                        help=f"Largest gap read along to merge two blocks (default: {DEFAULT_MAX_GAP}).")
+    parser.add_argument("--poll-budget", action="store_true",
+                        help="Pick the poll periods of every unit for the latency targets within the load an IOC "
+                             f"host may put on its PLCs, and write the load per PLC and IOC to {POLL_LOAD_FILE_NAME}.")
+    parser.add_argument("--poll-latency", action="append", default=[], metavar="[UNIT=]MS",
+                        help="Longest a moving axis may go unpolled, for every unit or for UNIT only "
+                             f"(default: {DEFAULT_POLL_PERIOD}). May be given more than once.")
+    parser.add_argument("--idle-poll-latency", type=int, default=DEFAULT_POLL_PERIOD, metavar="MS",
+                        help=f"Longest the other devices may go unpolled (default: {DEFAULT_POLL_PERIOD}).")
+    parser.add_argument("--max-bandwidth", type=int, default=DEFAULT_BANDWIDTH, metavar="BYTES",
+                        help=f"Bytes per second an IOC host may read from its PLCs (default: {DEFAULT_BANDWIDTH}).")
+    parser.add_argument("--max-requests", type=int, default=DEFAULT_REQUESTS, metavar="N",
+                        help=f"ADS requests per second an IOC host may issue (default: {DEFAULT_REQUESTS}).")
+    parser.add_argument("--version-stamp",
+                        help="Version written into the PILS tables instead of the generator's git hash.")
     parser.add_argument("--ioc-ip", help="IP address of the IOC")
     parser.add_argument("--plc-ip", help="IP address of the PLC")
 
+    parser.add_argument("-v", "--verbose", action="count", default=0, help="Print every sheet read.")
+    parser.add_argument("--timings", action="store_true",
+                        help="Print the time spent per stage, the counters and the bytes per unit to stderr.")
+    parser.add_argument("--timings-json", metavar="PATH",
+                        help="Write the timings as JSON to this file ('-' for stdout).")
+    parser.add_argument("--profile", metavar="PATH", help="Profile the run and write the cProfile stats to this file.")
+
     # Parse arguments from the command line
     args = parser.parse_args()
 
@@ -30,25 +121,166 @@ def main():
     if args.ioc and (args.ioc_ip is None or args.plc_ip is None):
         parser.error("--ioc requires --ioc-ip and --plc-ip")
 
-    # Read devices from the Excel file
-    excel_reader = ExcelReader(args.path)
-    df, instrument_name = excel_reader.read_sheet_by_index(args.sheet, COLUMNS_INDEX)
+    if args.jobs < 0:
+        parser.error("--jobs must not be negative")
+
+    if args.incremental and not is_directory_spec(args.output_dir):
+        parser.error("--incremental requires --output-dir to be a directory")
+
+    if args.watch and not is_directory_spec(args.output_dir):
+        parser.error("--watch requires --output-dir to be a directory")
+
+    allocation = None
+    if args.stable_offsets:
+        if not args.allocation_file and not is_directory_spec(args.output_dir):
+            parser.error("--stable-offsets requires --output-dir to be a directory or --allocation-file")
+        if args.watch:
+            parser.error("--stable-offsets cannot be combined with --watch")
+        try:
+            allocation = allocation_options(args.headroom, args.allocation_file)
+        except ValueError:
+            parser.error("--headroom takes BYTES or UNIT=BYTES")
+        if args.allocation_file:
+            # Checked up front, the file is only written back after every output
+            if not os.path.isdir(os.path.dirname(os.path.abspath(args.allocation_file))):
+                parser.error(f"--allocation-file: the directory of {args.allocation_file} does not exist")
+            try:
+                read_allocation_file(args.allocation_file)
+            except (ValueError, OSError) as e:
+                parser.error(f"--allocation-file: {e}")
+    elif args.allocation_file or args.headroom:
+        parser.error("--allocation-file and --headroom require --stable-offsets")
+
+    layout = None
+    if args.pack or args.index_order != 'spreadsheet':
+        layout = LayoutOptions(pack=args.pack, index_order=args.index_order, report=args.pack)
+        if args.watch:
+            parser.error("--pack and --index-order cannot be combined with --watch")
+
+    poll_budget = None
+    if args.poll_budget:
+        if args.watch:
+            parser.error("--poll-budget cannot be combined with --watch")
+        try:
+            poll_budget = poll_budget_options(args.poll_latency, args.idle_poll_latency, args.max_bandwidth,
+                                              args.max_requests)
+        except ValueError:
+            parser.error("--poll-latency takes MS or UNIT=MS, and the latencies and limits must be positive")
+    elif args.poll_latency:
+        parser.error("--poll-latency requires --poll-budget")
+
+    if args.timings_json == '-' and args.output_dir == '-':
+        parser.error("--timings-json and --output-dir cannot both write to standard output")
+
+    if args.version_stamp:
+        set_version(args.version_stamp)
+
+    outputs = dict(pils=args.pils, ioc=args.ioc, opi=args.opi, ioc_ip=args.ioc_ip, plc_ip=args.plc_ip)
+    # Only passed when asked for, so the fingerprints of existing manifests stay valid
+    if args.memory_map:
+        outputs['memory_maps'] = list(dict.fromkeys(args.memory_map))
+    if args.read_blocks:
+        if args.max_block <= 0 or args.max_gap < 0:
+            parser.error("--max-block must be positive and --max-gap must not be negative")
+        outputs['read_blocks'] = ReadBlockOptions(args.max_block, args.max_gap)
+
+    cache = None if args.no_cache else SheetCache(args.cache_dir)
+
+    timings = timing.enable() if args.timings or args.timings_json else None
+    profiler = cProfile.Profile() if args.profile else None
+
+    if profiler is not None:
+        profiler.enable()
+    try:
+        with timing.stage('total'):
+            generate(args, parser, cache, outputs, layout, allocation, poll_budget)
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(args.profile)
+
+    if timings is not None:
+        if args.timings:
+            sys.stderr.write(timings.format_table())
+        if args.timings_json == '-':
+            sys.stdout.write(timings.to_json())
+        elif args.timings_json:
+            with open(args.timings_json, 'w', encoding='utf-8') as file:
+                file.write(timings.to_json())
+
+
+def allocation_options(headroom: List[str], allocation_file: Optional[str]) -> AllocationOptions:
+    """
+    Builds the allocation options from the --headroom values.
+    """
+    default = 0
+    unit_headroom = {}
+    for value in headroom:
+        mc_unit, _, size = value.rpartition('=')
+        if mc_unit:
+            unit_headroom[mc_unit] = int(size)
+        else:
+            default = int(size)
+    if default < 0 or any(size < 0 for size in unit_headroom.values()):
+        raise ValueError("negative headroom")
+    return AllocationOptions(default, unit_headroom, allocation_file)
+
+
+def poll_budget_options(poll_latency: List[str], idle_latency: int, bandwidth: int, requests: int) -> PollBudget:
+    """
+    Builds the poll budget from the --poll-latency values and the limits.
+    """
+    latency = DEFAULT_POLL_PERIOD
+    unit_latency = {}
+    for value in poll_latency:
+        mc_unit, _, period = value.rpartition('=')
+        if mc_unit:
+            unit_latency[mc_unit] = int(period)
+        else:
+            latency = int(period)
+    if min([latency, idle_latency, bandwidth, requests, *unit_latency.values()]) <= 0:
+        raise ValueError("latencies and limits must be positive")
+    return PollBudget(latency, idle_latency, unit_latency, bandwidth, requests, report=True)
 
-    # Create a DeviceCollection and populate it from the DataFrame
-    device_collection = DeviceCollection(instrument_name)
-    device_collection.from_dataframe(df)
 
-    if args.pils:
-        # Generate PILS tables from the device collection
-        device_collection.to_xml()
+def generate(args, parser, cache, outputs, layout=None, allocation=None, poll_budget=None):
+    """
+    Reads the selected sheets and writes their outputs, or watches the workbook.
+    """
+    with ExcelReader(args.path, cache=cache, verbose=args.verbose) as excel_reader:
+        if args.all_sheets:
+            sheet_indices = excel_reader.instrument_sheets(list(range(len(excel_reader.sheet_names))), COLUMNS_INDEX)
+            if not sheet_indices:
+                parser.error("The Excel file has no instrument sheet")
+        elif args.sheets:
+            try:
+                sheet_indices = excel_reader.select_sheets(args.sheets)
+            except ValueError as e:
+                parser.error(str(e))
 
-    if args.ioc:
-        # Generate IOC st.cmd from the device collection
-        device_collection.to_st_cmd(ioc_ip=args.ioc_ip, plc_ip=args.plc_ip)
+        if args.watch:
+            # The watcher opens the workbook itself on every change
+            excel_reader.close()
+            if args.sheet is not None:
+                sheet_indices = [args.sheet]
+            watcher = WorkbookWatcher(args.path, sheet_indices, output_dir=args.output_dir,
+                                      per_instrument=args.sheet is None, cache=cache,
+                                      incremental=args.incremental, jobs=args.jobs,
+                                      interval=args.watch_interval, **outputs)
+            watcher.run()
+            return
 
-    if args.opi:
-        # Generate OPI css from the device collection
-        device_collection.to_opi()
+        with open_sink(args.output_dir) as sink:
+            if args.sheet is not None:
+                # Read the devices from the Excel file and generate the requested files
+                device_collection = read_collection(excel_reader, args.sheet, stream=args.stream)
+                generate_outputs(device_collection, jobs=args.jobs, incremental=args.incremental,
+                                 sink=sink, layout=layout, allocation=allocation, poll_budget=poll_budget,
+                                 **outputs)
+            else:
+                generate_sheets(excel_reader, sheet_indices, jobs=args.jobs, incremental=args.incremental,
+                                sink=sink, stream=args.stream, layout=layout, allocation=allocation,
+                                poll_budget=poll_budget, **outputs)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,40 @@
+import argparse
+import os
+import sys
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.join(script_dir, '..')
+sys.path.append(project_root)
+
+from src.cache import SheetCache
+from src.server import DEFAULT_HOST, DEFAULT_PORT, serve
+from src.version import set_version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve generated PILS tables, st.cmd and OPI files over HTTP, "
+                                                 "keeping parsed workbooks in memory between requests.")
+    parser.add_argument("-r", "--root", default=".", help="Directory the workbooks are served from.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Port to listen on.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Always parse workbooks instead of using the parsed-sheet cache.")
+    parser.add_argument("--cache-dir", help="Directory of the parsed-sheet cache "
+                                            "(default: $PILS_GENERATOR_CACHE_DIR or ~/.cache/pils-epics-generator).")
+    parser.add_argument("--version-stamp",
+                        help="Version written into the PILS tables instead of the generator's git hash.")
+
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        parser.error(f"--root {args.root} is not a directory")
+
+    if args.version_stamp:
+        set_version(args.version_stamp)
+
+    cache = None if args.no_cache else SheetCache(args.cache_dir)
+    serve(args.root, args.host, args.port, cache)
+
+
+if __name__ == "__main__":
+    main()
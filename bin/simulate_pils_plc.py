@@ -0,0 +1,67 @@
+import argparse
+import os
+import sys
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.join(script_dir, '..')
+sys.path.append(project_root)
+
+from src.pipeline import read_collection
+from src.reader import ExcelReader
+from src.simulator import (
+    DEFAULT_HOST, DEFAULT_PORT, DEFAULT_SHUTTER_TIME, DEFAULT_VELOCITY, LOCALHOST, AdsStats, SimulatedPlc,
+    device_infos, parse_device_table, simulate
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate the PLC of one motion control unit: serve its generated "
+                                                 "PILS memory map over ADS/TCP with moving axes and shutters.")
+    source_group = parser.add_mutually_exclusive_group(required=True)
+    source_group.add_argument("-p", "--path", help="Path to the Excel file containing device data.")
+    source_group.add_argument("--tcgvl", metavar="PATH", help="Serve the astDevices table of a generated PILS table.")
+    parser.add_argument("-s", "--sheet", type=int, default=0, help="Sheet index to read from the Excel file.")
+    parser.add_argument("-u", "--unit", default="1", help="Motion control unit to simulate.")
+    parser.add_argument("--st-cmd", metavar="PATH",
+                        help="Write the st.cmd of the unit, pointing at the simulator on localhost, to this file.")
+    parser.add_argument("--host", default=DEFAULT_HOST, help="Address to listen on.")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT,
+                        help=f"Port to listen on (default: {DEFAULT_PORT}, the port the st.cmd uses).")
+    parser.add_argument("--velocity", type=float, default=DEFAULT_VELOCITY,
+                        help=f"Velocity of the simulated axes in units/s (default: {DEFAULT_VELOCITY}).")
+    parser.add_argument("--shutter-time", type=float, default=DEFAULT_SHUTTER_TIME,
+                        help=f"Seconds a simulated shutter takes to open or close (default: {DEFAULT_SHUTTER_TIME}).")
+    parser.add_argument("--stats", action="store_true",
+                        help="Print the ADS requests and bytes served per second to stderr on exit.")
+
+    args = parser.parse_args()
+
+    if args.tcgvl and args.st_cmd:
+        parser.error("--st-cmd requires --path, the PILS table does not hold the PV names")
+    if args.velocity <= 0 or args.shutter_time < 0:
+        parser.error("--velocity must be positive and --shutter-time must not be negative")
+
+    if args.tcgvl:
+        with open(args.tcgvl, 'r', encoding='utf-8') as file:
+            devices = parse_device_table(file.read())
+        plc_name = os.path.splitext(os.path.basename(args.tcgvl))[0]
+    else:
+        with ExcelReader(args.path) as excel_reader:
+            device_collection = read_collection(excel_reader, args.sheet)
+        mc_unit = next((unit for unit in device_collection.devices_by_unit if str(unit) == args.unit), None)
+        if mc_unit is None:
+            parser.error(f"Instrument {device_collection.instrument} has no unit {args.unit}")
+        devices = device_infos(device_collection.layout(mc_unit))
+        plc_name = f"{device_collection.instrument.lower()}-mcs{mc_unit}"
+        if args.st_cmd:
+            with open(args.st_cmd, 'w', encoding='utf-8') as file:
+                file.write(device_collection.render_st_cmd(mc_unit, LOCALHOST, LOCALHOST))
+
+    stats = AdsStats() if args.stats else None
+    simulate(SimulatedPlc(devices, plc_name, args.velocity, args.shutter_time), args.host, args.port, stats)
+    if stats is not None:
+        sys.stderr.write(stats.format_table())
+
+
+if __name__ == "__main__":
+    main()
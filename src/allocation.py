@@ -0,0 +1,285 @@
+import json
+import os
+import re
+from typing import Dict, List, NamedTuple, Optional
+
+from src.layout import PILS_START_OFFSET, SYSTEM_KINDS, Slot, align_mb
+
+# The allocation of every unit, written next to the generated files
+ALLOCATION_FILE_NAME = 'pils-allocation.json'
+ALLOCATION_VERSION = 1
+
+_DECLARATION = re.compile(r"^\s*(\w+) AT %MB(\d+): ST_(\w+);", re.MULTILINE)
+_DEVICE_INFO = re.compile(r"\(nTypCode := 16#(\w+), sName := '[^']*', nOffset := (\d+)")
+
+
+class Placement(NamedTuple):
+    """
+    Where one GVL variable lives in a previous generation.
+    """
+    device_type: str
+    offset: int
+    index: int
+
+
+# The previous placements of the slots of one unit, by GVL variable name
+UnitAllocation = Dict[str, Placement]
+
+
+class AllocationOptions(NamedTuple):
+    """
+    How stable offsets are allocated.
+    """
+    headroom: int = 0                             # bytes kept free before the system block of a new unit
+    unit_headroom: Optional[Dict[str, int]] = None  # headroom of single units, by unit
+    allocation_file: Optional[str] = None         # allocation file to read and update instead of the output directory
+
+    def headroom_of(self, mc_unit) -> int:
+        return (self.unit_headroom or {}).get(str(mc_unit), self.headroom)
+
+
+def parse_tcgvl(content: str) -> UnitAllocation:
+    """
+    Reads the placements of the variables from a generated PILS table.
+
+    :param content: The TcGVL file content.
+    :return: The placement of every variable declared AT a %MB offset and listed in astDevices.
+    """
+    indices = {int(offset): index for index, (_, offset) in enumerate(_DEVICE_INFO.findall(content), start=1)}
+    allocation = {}
+    for variable, offset, device_type in _DECLARATION.findall(content):
+        offset = int(offset)
+        if offset in indices:
+            allocation[variable] = Placement(device_type, offset, indices[offset])
+    return allocation
+
+
+def allocate(slots: List[Slot], previous: UnitAllocation, headroom: int = 0,
+             start_offset: int = PILS_START_OFFSET) -> List[Slot]:
+    """
+    Moves the slots of a unit to where they were in a previous generation.
+
+    Slots whose variable existed before with the same type keep their
+    offset and PILS index, so adding a device allows an online change. New
+    slots go into the free space the previous generation left, e.g. its
+    headroom or the space of removed devices, or else at the end. A system
+    block placed anew, e.g. that of a new unit, goes after all devices with
+    headroom bytes kept free before it. A kept system block stays where it
+    is, so its headroom is whatever the previous generation left. Indices stay 1..n: new and displaced slots
+    take the free indices in the order of their fresh indices.
+
+    :param slots: The slots returned by build_layout, packed or not.
+    :param previous: The previous placements of the unit.
+    :param headroom: The bytes to keep free before a newly placed system block.
+    :param start_offset: The first free %MB offset.
+    :return: The slots in the same order, with their offsets and indices allocated.
+    """
+    placed: Dict[int, Slot] = {}
+    used_indices = set()
+    occupied = []
+    for position, slot in enumerate(slots):
+        placement = previous.get(slot.variable)
+        if placement is None or placement.device_type != slot.device_type:
+            continue
+        start, end = placement.offset, placement.offset + slot.length
+        if start < start_offset or any(start < other_end and other_start < end for other_start, other_end in occupied):
+            continue
+        occupied.append((start, end))
+        # Index 0 marks a slot that needs a new index
+        index = placement.index
+        if 0 < index <= len(slots) and index not in used_indices:
+            used_indices.add(index)
+        else:
+            index = 0
+        placed[position] = slot._replace(offset=start, index=index)
+
+    # The free space between the kept slots, before any new slot is placed
+    holes = []
+    offset = start_offset
+    for start, end in sorted(occupied):
+        if start > offset:
+            holes.append((offset, start))
+        offset = max(offset, end)
+    end_offset = offset
+
+    # New slots are placed in memory order and numbered in index order of the fresh layout.
+    # A system block placed anew starts after the headroom, at the end.
+    reserve_headroom = headroom > 0 and not any(_in_system_block(slots[position]) for position in placed)
+    for position in sorted(range(len(slots)), key=lambda position: slots[position].offset):
+        slot = slots[position]
+        if position in placed:
+            continue
+        if reserve_headroom and _in_system_block(slot):
+            end_offset += headroom
+            reserve_headroom = False
+            holes = []
+        for i, (hole_start, hole_end) in enumerate(holes):
+            start = align_mb(hole_start, slot.device_type)
+            if start + slot.length <= hole_end:
+                # The padding before the slot stays a hole of its own
+                holes[i:i + 1] = [hole for hole in ((hole_start, start), (start + slot.length, hole_end))
+                                  if hole[0] < hole[1]]
+                break
+        else:
+            start = align_mb(end_offset, slot.device_type)
+            end_offset = start + slot.length
+        placed[position] = slot._replace(offset=start, index=0)
+
+    free_indices = iter(sorted(set(range(1, len(slots) + 1)) - used_indices))
+    for position in sorted(range(len(slots)), key=lambda position: slots[position].index):
+        if not placed[position].index:
+            placed[position] = placed[position]._replace(index=next(free_indices))
+    return [placed[position] for position in range(len(slots))]
+
+
+def _in_system_block(slot: Slot) -> bool:
+    return slot.kind in SYSTEM_KINDS or slot.kind == 'ptp'
+
+
+def headroom_ignored(slots: List[Slot], previous: UnitAllocation, headroom: int) -> bool:
+    """
+    Tells whether headroom was asked for a unit whose system block keeps
+    its previous offset, so no headroom could be reserved.
+
+    :param slots: The slots returned by allocate.
+    :param previous: The previous placements of the unit.
+    :param headroom: The headroom asked for.
+    """
+    return headroom > 0 and any(
+        _in_system_block(slot) and slot.variable in previous and previous[slot.variable].offset == slot.offset
+        for slot in slots)
+
+
+def unit_allocation(slots: List[Slot]) -> UnitAllocation:
+    """
+    Returns the placements of the slots of a unit.
+    """
+    return {slot.variable: Placement(slot.device_type, slot.offset, slot.index) for slot in slots}
+
+
+def dump_allocation(instrument: str, units: Dict[str, UnitAllocation]) -> str:
+    """
+    Serialises the allocation of the units of an instrument.
+
+    :param instrument: The instrument name.
+    :param units: The placements of every unit, by unit.
+    :return: The JSON content of an allocation file.
+    """
+    data = {
+        'version': ALLOCATION_VERSION,
+        'instruments': {
+            str(instrument): {
+                'units': {
+                    str(mc_unit): {variable: placement._asdict() for variable, placement in allocation.items()}
+                    for mc_unit, allocation in units.items()
+                },
+            },
+        },
+    }
+    return json.dumps(data, indent=2) + '\n'
+
+
+def read_allocation_file(path: str) -> Dict:
+    """
+    Reads an allocation file as written by dump_allocation or write_allocation_file.
+
+    :param path: The path of the allocation file.
+    :return: The file content; an allocation without instruments if the file does not exist.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            data = json.load(file)
+    except FileNotFoundError:
+        return {'version': ALLOCATION_VERSION, 'instruments': {}}
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or data.get('version') != ALLOCATION_VERSION:
+        raise ValueError(f"{path} is not a version {ALLOCATION_VERSION} allocation file")
+    data.setdefault('instruments', {})
+    return data
+
+
+def write_allocation_file(path: str, contents: List[str]) -> None:
+    """
+    Merges allocations into an allocation file, keeping the entries of the other instruments.
+
+    :param path: The path of the allocation file, created if missing.
+    :param contents: Allocations as rendered by dump_allocation.
+    """
+    data = read_allocation_file(path)
+    for content in contents:
+        data['instruments'].update(json.loads(content)['instruments'])
+    with open(path, 'w', encoding='utf-8') as file:
+        file.write(json.dumps(data, indent=2) + '\n')
+
+
+def load_allocation_file(path: str, instrument: str) -> Optional[Dict[str, UnitAllocation]]:
+    """
+    Reads the allocation of the units of an instrument from an allocation file.
+
+    :param path: The path of the allocation file.
+    :param instrument: The instrument name.
+    :return: The placements of every unit by unit, or None if the file has no entry for the instrument.
+    """
+    entry = read_allocation_file(path)['instruments'].get(str(instrument))
+    if entry is None:
+        return None
+    return {
+        mc_unit: {variable: Placement(**placement) for variable, placement in allocation.items()}
+        for mc_unit, allocation in entry['units'].items()
+    }
+
+
+def load_allocation(device_collection, output_dir: str, options: AllocationOptions) -> Dict[str, UnitAllocation]:
+    """
+    Finds the previous allocation of an instrument: in the allocation file
+    of the options, else in the allocation file in output_dir, else in the
+    PILS tables in output_dir.
+
+    :param device_collection: The devices of the instrument.
+    :param output_dir: The directory holding the previous output.
+    :param options: The allocation options.
+    :return: The previous placements by unit; units without any are missing.
+    """
+    instrument = device_collection.instrument
+    if options.allocation_file:
+        return load_allocation_file(options.allocation_file, instrument) or {}
+
+    path = os.path.join(output_dir, ALLOCATION_FILE_NAME)
+    if os.path.exists(path):
+        units = load_allocation_file(path, instrument)
+        if units is not None:
+            return units
+
+    units = {}
+    for mc_unit in device_collection.devices_by_unit:
+        path = os.path.join(output_dir, device_collection.xml_file_name(mc_unit))
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as file:
+                units[str(mc_unit)] = parse_tcgvl(file.read())
+    return units
+
+
+class StableAllocation:
+    """
+    The previous allocation of an instrument, applied to its layouts by DeviceCollection.layout.
+    """
+
+    def __init__(self, previous: Dict[str, UnitAllocation], options: AllocationOptions = AllocationOptions()):
+        """
+        Initializes a new instance of the StableAllocation class.
+
+        :param previous: The previous placements by unit.
+        :param options: The allocation options.
+        """
+        self.previous = previous
+        self.options = options
+
+    def allocate(self, mc_unit, slots: List[Slot]) -> List[Slot]:
+        return allocate(slots, self.previous.get(str(mc_unit), {}), self.options.headroom_of(mc_unit))
+
+    def headroom_ignored(self, mc_unit, slots: List[Slot]) -> bool:
+        """
+        Tells whether the headroom of a unit could not be reserved, see headroom_ignored.
+        """
+        return headroom_ignored(slots, self.previous.get(str(mc_unit), {}), self.options.headroom_of(mc_unit))
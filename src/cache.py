@@ -0,0 +1,182 @@
+import hashlib
+import json
+import math
+import os
+import tempfile
+from typing import List, Optional, Tuple
+
+import pandas as pd
+
+from src.version import get_version
+
+# Environment variable selecting the cache directory
+CACHE_DIR_ENV = 'PILS_GENERATOR_CACHE_DIR'
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'pils-epics-generator')
+
+# Upper bound of the total size of the cached sheets, in bytes
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+# Bumped whenever the layout of the cache files changes
+CACHE_FORMAT = 1
+
+# Key of the generator metadata in the Parquet schema
+METADATA_KEY = b'pils_generator'
+
+
+def file_digest(file_path: str) -> str:
+    """
+    Returns the SHA-256 hex digest of a file's content.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _encode_value(value) -> str:
+    if value is pd.NA or value is None:
+        return 'null'
+    if isinstance(value, float) and math.isnan(value):
+        return 'NaN'
+    return json.dumps(value)
+
+
+def _decode_value(value: str):
+    if value == 'null':
+        return pd.NA
+    return json.loads(value)
+
+
+class SheetCache:
+    """
+    An on-disk cache of post-processed sheets, stored as Parquet files.
+
+    Entries are keyed by the workbook content hash, the sheet index, the
+    column layout and the generator version, so any change to one of them
+    misses the cache. The least recently used entries are evicted once the
+    cache grows beyond max_bytes.
+    """
+
+    def __init__(self, cache_dir: Optional[str] = None, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        """
+        Initializes a new instance of the SheetCache class.
+
+        :param cache_dir: The cache directory; defaults to $PILS_GENERATOR_CACHE_DIR or ~/.cache/pils-epics-generator.
+        :param max_bytes: The size the cache is trimmed to after every store.
+        """
+        self.cache_dir = cache_dir or os.environ.get(CACHE_DIR_ENV) or DEFAULT_CACHE_DIR
+        self.max_bytes = max_bytes
+
+    def key(self, file_hash: str, sheet_index: int, columns: List[int], column_info: List) -> str:
+        """
+        Builds the cache key of one sheet.
+
+        :param file_hash: The content hash of the workbook.
+        :param sheet_index: The index of the sheet.
+        :param columns: The column indices read from the sheet.
+        :param column_info: The (index, name) pairs of the reader's column layout.
+        :return: A hex digest.
+        """
+        state = [CACHE_FORMAT, get_version(), file_hash, sheet_index, list(columns),
+                 [list(info) for info in column_info]]
+        return hashlib.sha256(json.dumps(state).encode('utf-8')).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.parquet")
+
+    def load(self, key: str) -> Optional[Tuple[pd.DataFrame, str]]:
+        """
+        Loads a cached sheet.
+
+        :param key: The cache key.
+        :return: The DataFrame and instrument name, or None on a miss.
+        """
+        import pyarrow.parquet as pq
+
+        path = self._path(key)
+        try:
+            table = pq.read_table(path)
+            # A file not written by store has no or other metadata
+            metadata = json.loads(table.schema.metadata[METADATA_KEY])
+            json_columns = metadata['json_columns']
+            instrument_name = metadata['instrument_name']
+            # Mark the entry as recently used; it may have been evicted meanwhile
+            os.utime(path)
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+        df = table.to_pandas()
+        for column in json_columns:
+            df[column] = pd.Series([_decode_value(value) for value in df[column]], index=df.index, dtype=object)
+        return df, instrument_name
+
+    def store(self, key: str, df: pd.DataFrame, instrument_name: str) -> bool:
+        """
+        Stores a sheet in the cache.
+
+        Object columns may mix types (e.g. PV names and 0 for spares), which
+        Parquet cannot hold, so their values are stored JSON encoded.
+
+        :param key: The cache key.
+        :param df: The post-processed DataFrame.
+        :param instrument_name: The instrument name of the sheet.
+        :return: True if stored, False if the sheet holds values that cannot be cached.
+        """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        encoded = df.copy()
+        json_columns = [column for column in df.columns if df[column].dtype == object]
+        try:
+            for column in json_columns:
+                encoded[column] = [_encode_value(value) for value in df[column]]
+            metadata = json.dumps({'instrument_name': instrument_name, 'json_columns': json_columns})
+        except TypeError:
+            return False
+
+        table = pa.Table.from_pandas(encoded)
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), METADATA_KEY: metadata})
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            pq.write_table(table, tmp_path)
+            os.replace(tmp_path, self._path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        self.evict()
+        return True
+
+    def evict(self) -> None:
+        """
+        Deletes the least recently used entries until the cache fits in max_bytes.
+        """
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.parquet'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self) -> None:
+        """
+        Deletes every cached sheet.
+        """
+        if os.path.isdir(self.cache_dir):
+            for entry in os.scandir(self.cache_dir):
+                if entry.name.endswith('.parquet'):
+                    os.remove(entry.path)
@@ -1,70 +1,27 @@
-import os
-
-import git
+import math
+from typing import Any, Dict, Iterable, List, Optional, TextIO, Tuple
 
+import numpy as np
 import pandas as pd
-from xml.etree.ElementTree import Element, SubElement, ElementTree
-import xml.dom.minidom
-
-VERSION = git.Repo(search_parent_directories=True).git.rev_parse("--short", "HEAD")
-
-pils_device_byte_aligments = {
-    '1201':  2,  # Simple discrete input, 16 bit signed integer
-    '1202':  4,  # Simple discrete input, 32 bit signed integer
-    '1204':  8,  # Simple discrete input, 64 bit signed integer
-    '1302':  4,  # Simple analog input, 32 bit floating point, real
-    '1304':  8,  # Simple analog input, 64 bit floating point, double
-    '1602':  2,  # Simple discrete output, 16 bit signed integer
-    '1604':  4,  # Simple discrete output, 32 bit signed integer
-    '1608':  8,  # Simple discrete output, 64 bit signed integer
-    '1704':  4,  # Simple analog output, 32 bit floating point, real
-    '1708':  8,  # Simple analog output, 64 bit floating point, double
-    '1802':  4,  # Extended status word that has 24 AUX bits
-    '1A04':  4,  # discrete input, 32 bit signed integer + extended status word
-    '1A08':  8,  # discrete input, 64 bit signed integer + extended status word + errorID
-    '1B04':  4,  # analog input, 32 bit floating point + status word
-    '1B08':  8,  # analog input, 64 bit floating point + extended status word + errorID
-    '1E04':  4,  # discrete output, 16 bit signed integer + extended status word
-    '1E06':  4,  # discrete output, 32 bit signed integer + extended status word
-    '1E0C':  8,  # discrete output, 64 bit signed integer + extended status word + errorID
-    '1F06':  4,  # analog output, 32 bit signed integer + extended status word
-    '1F0C':  8,  # analog output, 64 bit signed integer + extended status word + errorID
-    '5010':  8   # param device with 64 bit float, motor
-}
-
-pils_device_byte_lengths = {
-    '1201':  2,
-    '1202':  4,
-    '1204':  8,
-    '1302':  4,
-    '1304':  8,
-    '1602':  4,
-    '1604':  8,
-    '1608':  16,
-    '1704':  4,
-    '1708':  8,
-    '1802':  4,
-    '1A04':  8,
-    '1A08':  16,
-    '1B04':  8,
-    '1B08':  16,
-    '1E04':  8,
-    '1E06':  12,
-    '1E0C':  24,
-    '1F06':  12,
-    '1F0C':  24,
-    '5010':  32
-}
-
-pils_temp_units = {
-    'c': '16#0009',
-    'k': '16#0008'
-}
-
-pils_units = {
-    'mm': '16#FD04',
-    'degree': '16#000C',
-}
+
+from src import timing
+from src.allocation import StableAllocation
+from src.device_table import DeviceTable
+# The PILS type tables and align_mb/get_next_mb live in src.layout and are re-exported here
+from src.layout import (
+    PILS_START_OFFSET, align_mb, get_next_mb, pils_device_byte_aligments, pils_device_byte_lengths, pils_temp_units,
+    pils_units, LayoutOptions, Slot, build_layout, define_slot, describe_slot, layout_device, order_indices,
+    pack_layout, render_definition, render_description
+)
+from src.memory_map import MEMORY_MAP_FORMATS, memory_map_records, render_memory_map
+from src.opi import write_opi
+from src.poll_budget import PollCycle, poll_cycle
+from src.read_blocks import ReadBlock, ReadBlockOptions, plan_read_blocks, render_read_blocks
+from src.sinks import DirectorySink, OutputSink
+from src.st_cmd import write_st_cmd
+from src.tcgvl import render_tcgvl, write_tcgvl
+from src.template import render_to_string
+from src.version import get_version
 
 BASE_CSS = """
   <widget typeId="org.csstudio.opibuilder.widgets.ActionButton" version="2.0.0">
@@ -139,40 +96,16 @@ $(pv_value)</tooltip>
 """
 
 
-def get_next_mb(memory_offset: int, device_type: str) -> int:
-    """
-    Calculate the next memory offset for a given device type.
-
-    :param memory_offset: The current memory offset.
-    :param device_type: The type of the device.
-    :return: The next memory offset.
-    """
-
-    return memory_offset + pils_device_byte_lengths[device_type]
-
-
-def align_mb(memory_offset: int, device_type: str) -> int:
-    """
-    Aligns the memory offset based on the device's byte alignment requirements.
-
-    :param memory_offset: The current memory offset.
-    :param device_type: The type of the device.
-    :return: The aligned memory offset.
-    """
-
-    pils_device_byte_aligment = pils_device_byte_aligments[device_type]
-    misaligned = memory_offset % pils_device_byte_aligment
-    if misaligned != 0:
-        memory_offset = memory_offset - misaligned + pils_device_byte_aligment
-
-    return memory_offset
-
-
 class Device:
     """
     Represents a device with its configurations and properties.
     """
 
+    __slots__ = (
+        'description', 'pv_name', 'pv_root', 'mc_unit', 'ptp', 'mc_axis_nc', 'mc_axis_pn', 'pils_name', 'pils_unit',
+        'device_type', 'has_temp', 'temp_units', 'has_extra', 'extra_name', 'extra_type', 'extra_desc'
+    )
+
     def __init__(self, description: str, pv_name: str, pv_root : str, mc_unit: int, ptp: bool, mc_axis_nc: int, mc_axis_pn: int,
                  device_type: str, pils_name: str, pils_unit: str, has_temp: bool = False, temp_units: str = 'c',
                  has_extra: bool = False, extra_name: str = '', extra_type: str = '', extra_desc: str = '') -> None:
@@ -209,6 +142,16 @@ class Device:
         self.extra_type = extra_type
         self.extra_desc = extra_desc
 
+    def __repr__(self) -> str:
+        return f"Device({self.device_type}, unit={self.mc_unit}, nc={self.mc_axis_nc}, pn={self.mc_axis_pn}, " \
+               f"pils_name={self.pils_name!r})"
+
+    def to_dict(self) -> dict:
+        """
+        Returns the device properties as a dictionary.
+        """
+        return {name: getattr(self, name) for name in self.__slots__}
+
     @classmethod
     def from_dataframe_row(cls, row: pd.Series) -> 'Device':
         """
@@ -249,6 +192,154 @@ class Device:
         )
 
 
+# Device constructor arguments, in order, as produced by normalise_dataframe
+DEVICE_FIELDS = [
+    'description', 'pv_name', 'pv_root', 'mc_unit', 'ptp', 'mc_axis_nc', 'mc_axis_pn', 'device_type',
+    'pils_name', 'pils_unit', 'has_temp', 'temp_units', 'has_extra', 'extra_name', 'extra_type', 'extra_desc'
+]
+
+
+def _optional_int(column: pd.Series) -> pd.Series:
+    """
+    Casts a column to int, keeping missing values as None.
+    """
+    return column.astype('Int64').astype(object).where(column.notna(), None)
+
+
+def _with_default(column: pd.Series, default) -> pd.Series:
+    """
+    Replaces missing values in a column by a default value.
+    """
+    return column.astype(object).where(column.notna(), default)
+
+
+# Why a sheet row cannot become a device, see row_error
+NO_DEVICE_TYPE = "has no axis, extra device type or temperature sensor to define its device type"
+NO_MC_UNIT = "has no MC unit"
+
+
+def row_error(description, problem: str) -> ValueError:
+    """
+    Builds the error for a sheet row that cannot become a device.
+
+    :param description: The axis description of the row, naming it in the message.
+    :param problem: Why the row cannot become a device, e.g. NO_MC_UNIT.
+    :return: The ValueError to raise.
+    """
+    if description is None or pd.isna(description):
+        return ValueError(f"A row without axis description {problem}.")
+    return ValueError(f"Row '{description}' {problem}.")
+
+
+def normalise_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Normalises a sheet DataFrame into Device constructor arguments.
+
+    This is the columnar equivalent of Device.from_dataframe_row: device
+    types, defaults for missing values and the bool/int casts are computed
+    for all rows at once.
+
+    :param df: The DataFrame returned by ExcelReader.read_sheet_by_index.
+    :return: A DataFrame with the columns listed in DEVICE_FIELDS.
+    """
+    is_motor = df['mc_axis_nc'].notna()
+    is_pneumatic = df['mc_axis_pn'].notna()
+    has_extra_type = df['extra_type'].notna()
+    has_temp = df['has_temp'].notna()
+    extra_type = df['extra_type'].astype(str).where(has_extra_type, '')
+
+    device_type = pd.Series(
+        np.select(
+            [is_pneumatic, is_motor, has_extra_type, has_temp],
+            ['1E04', '5010', extra_type, '1302'],
+            default=None
+        ).astype(object),
+        index=df.index
+    )
+    undefined = device_type.isna()
+    if undefined.any():
+        raise row_error(df['axis_description'][undefined].iloc[0], NO_DEVICE_TYPE)
+    no_mc_unit = df['mc_unit'].isna()
+    if no_mc_unit.any():
+        raise row_error(df['axis_description'][no_mc_unit].iloc[0], NO_MC_UNIT)
+
+    return pd.DataFrame({
+        'description': df['axis_description'],
+        'pv_name': df['pv_name'].astype(object).where(df['pv_name'].ne(0), None),
+        'pv_root': _with_default(df['pv_root'], ''),
+        'mc_unit': df['mc_unit'].astype('int64').astype(object),
+        'ptp': df['ptp'].astype(str).str.lower().eq('yes'),
+        'mc_axis_nc': _optional_int(df['mc_axis_nc']),
+        'mc_axis_pn': _optional_int(df['mc_axis_pn']),
+        'device_type': device_type,
+        'pils_name': df['pils_name'],
+        'pils_unit': _with_default(df['pils_unit'], 'mm'),
+        'has_temp': has_temp,
+        'temp_units': _with_default(df['temp_units'], 'c'),
+        'has_extra': df['extra_dev'].notna(),
+        'extra_name': _with_default(df['extra_name'], ''),
+        'extra_type': extra_type,
+        'extra_desc': _with_default(df['extra_desc'], ''),
+    }, columns=DEVICE_FIELDS)
+
+
+def normalise_record(row: Dict[str, Any]) -> Tuple:
+    """
+    Normalises one processed sheet row into Device constructor arguments.
+
+    This is the single row equivalent of normalise_dataframe, for the rows
+    streamed by ExcelReader.read_sheet_rows, in which missing values are None.
+    Missing descriptions, PV names and PILS names become NaN, as they do in
+    the DataFrame.
+
+    :param row: A dict with the reader's column names.
+    :return: The values of DEVICE_FIELDS, in order.
+    """
+    extra_type = row['extra_type']
+    has_temp = row['has_temp'] is not None
+    if row['mc_axis_pn'] is not None:
+        device_type = '1E04'
+    elif row['mc_axis_nc'] is not None:
+        device_type = '5010'
+    elif extra_type is not None:
+        device_type = str(extra_type)
+    elif has_temp:
+        device_type = '1302'
+    else:
+        raise row_error(row['axis_description'], NO_DEVICE_TYPE)
+
+    if row['mc_unit'] is None:
+        raise row_error(row['axis_description'], NO_MC_UNIT)
+
+    pv_name = row['pv_name']
+    return (
+        _or_nan(row['axis_description']),
+        None if pv_name == 0 else _or_nan(pv_name),
+        _or_default(row['pv_root'], ''),
+        int(row['mc_unit']),
+        str(row['ptp']).lower() == 'yes',
+        None if row['mc_axis_nc'] is None else int(row['mc_axis_nc']),
+        None if row['mc_axis_pn'] is None else int(row['mc_axis_pn']),
+        device_type,
+        _or_nan(row['pils_name']),
+        _or_default(row['pils_unit'], 'mm'),
+        has_temp,
+        _or_default(row['temp_units'], 'c'),
+        row['extra_dev'] is not None,
+        _or_default(row['extra_name'], ''),
+        '' if extra_type is None else str(extra_type),
+        _or_default(row['extra_desc'], ''),
+    )
+
+
+def _or_default(value, default):
+    return default if value is None else value
+
+
+def _or_nan(value):
+    return math.nan if value is None else value
+
+
 class DeviceCollection:
     """
     Represents a collection of devices grouped by their motion control unit.
@@ -265,6 +356,14 @@ class DeviceCollection:
         self.devices_by_unit = {}
         self.instrument = instrument
 
+        # How the memory maps are laid out, and the offsets of a previous
+        # generation to keep if set, see src.allocation
+        self.layout_options = LayoutOptions()
+        self.allocation: Optional[StableAllocation] = None
+        # The moving and idle poll periods picked for each unit by a poll
+        # budget, see src.poll_budget; units missing use the default
+        self.poll_periods: Dict[str, Tuple[int, int]] = {}
+
     def add_device(self, device: Device) -> None:
         """
         Adds a device to the collection.
@@ -277,344 +376,206 @@ class DeviceCollection:
         else:
             self.devices_by_unit[device.mc_unit].append(device)
 
+    def device_table(self, mc_unit) -> DeviceTable:
+        """
+        Returns an array-backed view of the devices of one motion control unit.
+
+        :param mc_unit: The motion control unit.
+        :return: A DeviceTable with one record per device.
+        """
+        return DeviceTable.from_devices(self.devices_by_unit[mc_unit])
+
     def from_dataframe(self, df: pd.DataFrame) -> None:
         """
         Populates the device collection from a pandas DataFrame.
 
         :param df: The DataFrame containing device information.
         """
-        for _, row in df.iterrows():
-            self.add_device(Device.from_dataframe_row(row))
+        with timing.stage('normalise'):
+            normalised = normalise_dataframe(df)
+        with timing.stage('build_devices'):
+            for fields in normalised.itertuples(index=False, name=None):
+                self.add_device(Device(*fields))
+        timing.count('devices_built', len(normalised))
+
+    def from_records(self, rows: Iterable[Dict[str, Any]]) -> None:
+        """
+        Populates the device collection from processed sheet rows, one at a time.
+
+        :param rows: The rows streamed by ExcelReader.read_sheet_rows.
+        """
+        with timing.stage('build_devices'):
+            count = 0
+            for row in rows:
+                self.add_device(Device(*normalise_record(row)))
+                count += 1
+        timing.count('devices_built', count)
+
+    def _define_device(self, device, idx, current_offset):
+        slots = layout_device(device, idx, current_offset)
+        device_info = [line for slot in slots for line in define_slot(slot)]
+        return device_info, idx + len(slots), slots[-1].end, len(slots)
+
+    def _describe_device(self, device, current_offset):
+        slots = layout_device(device, 1, current_offset)
+        return [describe_slot(slot) for slot in slots], slots[-1].end
 
     def xml_define_5010(self, device, idx, current_offset):
-        device_info = []
-        num_devices = 0
-        current_offset = align_mb(current_offset, device.device_type)
-        motor_name = f"MotorM{device.mc_axis_nc}"
-        device_str = f"st{motor_name} AT %MB{current_offset}: ST_{device.device_type};"
-        fb_device_str = f"fb{motor_name}: FB_{device.device_type}_Axis := (nPILSDeviceNumber := {idx});"
-        param_device_str = f"st{motor_name}Param: ST_AxisParameters;"
-        current_offset = get_next_mb(current_offset, device.device_type)
-        device_info.append(device_str)
-        device_info.append(fb_device_str)
-        device_info.append(param_device_str)
-        idx += 1
-        num_devices += 1
-
-        if device.has_temp:
-            current_offset = align_mb(current_offset, '1302')
-            device_info.append(f"st{motor_name}Temp AT %MB{current_offset}: ST_1302;")
-            current_offset = get_next_mb(current_offset, '1302')
-            idx += 1
-            num_devices += 1
-        if device.has_extra:
-            current_offset = align_mb(current_offset, device.extra_type)
-            device_info.append(f"{device.extra_name} AT %MB{current_offset}: ST_{device.extra_type};")
-            current_offset = get_next_mb(current_offset, device.extra_type)
-            idx += 1
-            num_devices += 1
-        return device_info, idx, current_offset, num_devices
+        return self._define_device(device, idx, current_offset)
 
     def xml_describe_5010(self, device, current_offset):
-        device_info = []
-        current_offset = align_mb(current_offset, device.device_type)
-        device_info_str = f"(nTypCode := 16#{device.device_type}, sName := '{device.pils_name}', nOffset := {current_offset}, nUnit := {pils_units[device.pils_unit]}, asAUX := [(''),(''),(''),(''),(''),(''),(''),(''),(''),(''),(''),(''),(''),(''),(''),(''),(''),('InterlockFwd'),('InterlockBwd'),('localMode'),('inTargetPos'),('homeSensor'),('notHomed'),('enabled')], nFlags := 1),"
-        current_offset = get_next_mb(current_offset, device.device_type)
-        device_info.append(device_info_str)
-        if device.has_temp:
-            current_offset = align_mb(current_offset, '1302')
-            temp_info_str = f"(nTypCode := 16#1302, sName := 'Temp#{device.mc_axis_nc}', nOffset := {current_offset}, nUnit := {pils_temp_units[device.temp_units]}),"
-            current_offset = get_next_mb(current_offset, '1302')
-            device_info.append(temp_info_str)
-        if device.has_extra:
-            current_offset = align_mb(current_offset, device.extra_type)
-            extra_info_str = f"(nTypCode := 16#{device.extra_type}, sName := '{device.extra_desc}', nOffset := {current_offset}),"
-            current_offset = get_next_mb(current_offset, device.extra_type)
-            device_info.append(extra_info_str)
-        return device_info, current_offset
+        return self._describe_device(device, current_offset)
 
     def xml_define_1E04(self, device, idx, current_offset):
-        device_info = []
-        num_devices = 0
-        current_offset = align_mb(current_offset, device.device_type)
-        motor_name = f"PneumaticP{device.mc_axis_pn}"
-        device_str = f"st{motor_name} AT %MB{current_offset}: ST_{device.device_type};"
-        fb_device_str = f"fb{motor_name}: FB_{device.device_type}_Pneumatic := (nPILSDeviceNumber := {idx});"
-        current_offset = get_next_mb(current_offset, device.device_type)
-        device_info.append(device_str)
-        device_info.append(fb_device_str)
-        idx += 1
-        num_devices += 1
-
-        if device.has_temp:
-            current_offset = align_mb(current_offset, '1302')
-            device_info.append(f"st{motor_name}Temp AT %MB{current_offset}: ST_1302;")
-            current_offset = get_next_mb(current_offset, '1302')
-            idx += 1
-            num_devices += 1
-
-        return device_info, idx, current_offset, num_devices
+        return self._define_device(device, idx, current_offset)
 
     def xml_describe_1E04(self, device, current_offset):
-        device_info = []
-        current_offset = align_mb(current_offset, device.device_type)
-        device_info_str = f"(nTypCode := 16#{device.device_type}, sName := '{device.pils_name}', nOffset := {current_offset}, asAux := [('Closed'),('Closing'),('Opening'),('Opened'),('InTheMiddle'),(''),(''),(''),(''),(''),(''),(''),(''),(''),('Interlocked'),('PSSPermitDenied'),('SolenoidActive'),('Retracted'),('Extended'),('Retracting'),('Extending'),(''),(''),('')]),"
-        current_offset = get_next_mb(current_offset, device.device_type)
-        device_info.append(device_info_str)
-        if device.has_temp:
-            current_offset = align_mb(current_offset, '1302')
-            temp_info_str = f"(nTypCode := 16#1302, sName := 'Temp#{device.mc_axis_pn}', nOffset := {current_offset}, nUnit := {pils_temp_units[device.temp_units]}),"
-            current_offset = get_next_mb(current_offset, '1302')
-            device_info.append(temp_info_str)
-        return device_info, current_offset
+        return self._describe_device(device, current_offset)
 
     def xml_define_1302(self, device, idx, current_offset):
-        current_offset = align_mb(current_offset, '1302')
-        device_info = f"{device.extra_name} AT %MB{current_offset}: ST_1302;"
-        current_offset = get_next_mb(current_offset, '1302')
-        idx += 1
-        return [device_info], idx, current_offset, 1
+        return self._define_device(device, idx, current_offset)
 
     def xml_describe_1302(self, device, current_offset):
-        current_offset = align_mb(current_offset, '1302')
-        device_info = f"(nTypCode := 16#1302, sName := '{device.extra_desc}', nOffset := {current_offset}, nUnit := {pils_temp_units[device.temp_units]}),"
-        current_offset = get_next_mb(current_offset, '1302')
-        return [device_info], current_offset
-
-    def xml_define_1A04(self, name, idx, current_offset):
-        current_offset = align_mb(current_offset, '1A04')
-        device_info = f"{name} AT %MB{current_offset}: ST_1A04;"
-        current_offset = get_next_mb(current_offset, '1A04')
-        idx += 1
-        return [device_info], idx, current_offset, 1
-
-    def xml_describe_1A04(self, name, current_offset, asAux=''):
-        current_offset = align_mb(current_offset, '1A04')
-        if asAux:
-            device_info = f"(nTypCode := 16#1A04, sName := '{name}', nOffset := {current_offset}, asAux := {asAux}),"
-        else:
-            device_info = f"(nTypCode := 16#1A04, sName := '{name}', nOffset := {current_offset}),"
-        current_offset = get_next_mb(current_offset, '1A04')
-        return [device_info], current_offset
-
-    def xml_define_1201(self, name, idx, current_offset):
-        current_offset = align_mb(current_offset, '1201')
-        device_info = f"{name} AT %MB{current_offset}: ST_1201;"
-        current_offset = get_next_mb(current_offset, '1201')
-        idx += 1
-        return [device_info], idx, current_offset, 1
-
-    def xml_describe_1201(self, name, current_offset):
-        current_offset = align_mb(current_offset, '1201')
-        device_info = f"(nTypCode := 16#1201, sName := '{name}', nOffset := {current_offset}),"
-        current_offset = get_next_mb(current_offset, '1201')
-        return [device_info], current_offset
-
-    def xml_define_1204(self, name, idx, current_offset):
-        current_offset = align_mb(current_offset, '1204')
-        device_info = f"{name} AT %MB{current_offset}: ST_1204;"
-        current_offset = get_next_mb(current_offset, '1204')
-        idx += 1
-        return [device_info], idx, current_offset, 1
-
-    def xml_describe_1204(self, name, current_offset):
-        current_offset = align_mb(current_offset, '1204')
-        device_info = f"(nTypCode := 16#1204, sName := '{name}', nOffset := {current_offset}, nUnit := 16#F711),"
-        current_offset = get_next_mb(current_offset, '1204')
-        return [device_info], current_offset
-
-    def xml_define_1B08(self, current_offset):
-        current_offset = align_mb(current_offset, '1B08')
-        device_info = f"stPressureSensor AT %MB{current_offset}: ST_1B08;\n"
-        current_offset = get_next_mb(current_offset, '1B08')
-        return device_info, current_offset, 1
-
-    def xml_describe_1B08(self, current_offset):
-        current_offset = align_mb(current_offset, '1B08')
-        device_info = f"(nTypCode := 16#1B08, sName := 'SysPressureValue', nOffset := {current_offset}),"
-        current_offset = get_next_mb(current_offset, '1B08')
-        return device_info, current_offset
-
-    def xml_define_1802(self, current_offset):
-        current_offset = align_mb(current_offset, '1802')
-        device_info = f"stCabinetStatus AT %MB{current_offset}: ST_1802;\n"
-        current_offset = get_next_mb(current_offset, '1802')
-        return device_info, current_offset, 1
-
-    def xml_describe_1802(self, current_offset, is_last=False):
-        current_offset = align_mb(current_offset, '1802')
-        device_info = f"(nTypCode := 16#1802, sName := 'Cabinet#0', nOffset := {current_offset}, asAux := [('24VPSFailed'), ('48VPSFailed'), ('MCBError'), ('SPDError'), ('DoorOpen'), ('TempHigh'), ('FuseTripped'), ('EStop'), ('ECMasterError'), ('SlaveNotOP'), ('SlaveMissing'), ('CPULoadHigh'),(''), (''), (''), (''), (''), (''), (''),(''), (''), (''), (''), ('')])"
-        if is_last:
-            device_info += "];"
-        current_offset = get_next_mb(current_offset, '1802')
-        return device_info, current_offset
+        return self._describe_device(device, current_offset)
 
     def xml_define_extra(self, device, index, current_offset):
-        if device.device_type == '1302':
-            return self.xml_define_1302(device, index, current_offset)
-        else:
-            raise NotImplementedError
+        return self._define_device(device, index, current_offset)
 
     def xml_describe_extra(self, device, current_offset):
-        if device.device_type == '1302':
-            return self.xml_describe_1302(device, current_offset)
-        else:
-            raise NotImplementedError
-
-    def build_ptp_define(self, idx, current_offset):
-        device_info = []
-        ptp_offset, idx, current_offset, num_new_devices = self.xml_define_1A04("stPTPOffset", idx, current_offset)
-        ptp_state, idx, current_offset, num_new_devices = self.xml_define_1A04("stPTPState", idx, current_offset)
-        ptp_sync, idx, current_offset, num_new_devices = self.xml_define_1201("stPTPSyncSeqNum", idx, current_offset)
-        ptp_error, idx, current_offset, num_new_devices = self.xml_define_1A04("stPTPErrorStatus", idx, current_offset)
-        sys_time, idx, current_offset, num_new_devices = self.xml_define_1204("stSystemUTCtime", idx, current_offset)
-        device_info.extend([ptp_offset[0], ptp_state[0], ptp_sync[0], ptp_error[0], sys_time[0], ""])
-        return device_info, idx, current_offset
-
-    def build_ptp_describe(self, current_offset):
-        device_info = []
-        ptp_offset, current_offset = self.xml_describe_1A04("PTPOffset#0", current_offset)
-        ptp_state, current_offset = self.xml_describe_1A04("PTPState#0", current_offset)
-        ptp_sync, current_offset = self.xml_describe_1201("PTPSyncSeqNum#0", current_offset)
-        ptp_error, current_offset = self.xml_describe_1A04("PTPErrorStatus#0", current_offset,
-            asAux="[(''), (''), (''), (''), (''), (''), (''), (''), (''), (''), ('NotFullySynched'), ('NotSynchronized'),('NotPTPslave'), ('NotPTPv2'), ('RdDiagError'), ('CableNotConnected_PTPnotStarted'), (''), (''), (''),(''), (''), (''), (''), ('')]"
-        )
-        sys_time, current_offset = self.xml_describe_1204("SystemUTCtime#0", current_offset)
-        device_info.extend([ptp_offset[0], ptp_state[0], ptp_sync[0], ptp_error[0], sys_time[0]])
-        return device_info, current_offset
+        return self._describe_device(device, current_offset)
 
     def build_definition(self, devices):
-        device_definitions = []
-        idx = 1
-        num_devices = 0
-        curr_offset = 128
-        pneumatic_exists = False
-        for device in devices:
-            if device.mc_axis_nc is not None:
-                device_info, new_idx, curr_offset, num_new_devices = self.xml_define_5010(device, idx, curr_offset)
-            elif device.mc_axis_pn is not None:
-                device_info, new_idx, curr_offset, num_new_devices = self.xml_define_1E04(device, idx, curr_offset)
-                pneumatic_exists = True
-            elif device.mc_axis_pn is None and device.mc_axis_nc is None:
-                device_info, new_idx, curr_offset, num_new_devices = self.xml_define_extra(device, idx, curr_offset)
-            else:
-                raise ValueError("undefined device")
-            idx = new_idx
-            num_devices += num_new_devices
-            device_definitions.extend(device_info + [""])
-
-        if pneumatic_exists:
-            device_info, curr_offset, num_new_devices = self.xml_define_1B08(curr_offset)
-            num_devices += num_new_devices
-            device_definitions.append(device_info)
-
-        if devices[0].ptp:
-            ptp_info, new_idx, curr_offset = self.build_ptp_define(idx, curr_offset)
-            idx = new_idx
-            num_devices += 5
-            device_definitions.extend(ptp_info)
-
-        device_info, curr_offset, num_new_devices = self.xml_define_1802(curr_offset)
-        num_devices += num_new_devices
-        device_definitions.append(device_info)
-
-        return device_definitions, num_devices, pneumatic_exists
+        slots = build_layout(devices)
+        pneumatic_exists = any(slot.kind == 'pneumatic' for slot in slots)
+        return render_definition(slots), len(slots), pneumatic_exists
 
     def build_description(self, devices, num_devices, pneumatic_exists):
-        # Add the devices array part
-        device_description = []
-        device_description.append("// Array of Devices")
-        device_array_str = f"astDevices: ARRAY [1..{num_devices}] OF ST_DeviceInfo :=["
-        device_description.append(device_array_str)
-
-        curr_offset = 128
-        for device in devices:
-            if device.mc_axis_nc is not None:
-                device_info, curr_offset = self.xml_describe_5010(device, curr_offset)
-                device_description.extend(device_info)
-            elif device.mc_axis_pn is not None:
-                device_info, curr_offset = self.xml_describe_1E04(device, curr_offset)
-                device_description.extend(device_info)
-            elif device.mc_axis_pn is None and device.mc_axis_nc is None:
-                device_info, curr_offset = self.xml_describe_extra(device, curr_offset)
-                device_description.extend(device_info)
-            else:
-                raise ValueError("mc_axis_nc or mc_axis_pn must be set")
-
-        if pneumatic_exists:
-            device_info, curr_offset = self.xml_describe_1B08(curr_offset)
-            device_description.append(device_info)
-
-        if devices[0].ptp:
-            ptp_info, curr_offset = self.build_ptp_describe(curr_offset)
-            device_description.extend(ptp_info)
-
-        device_info, curr_offset = self.xml_describe_1802(curr_offset, is_last=True)
-        device_description.append(device_info)
-
-        device_description[-1] = device_description[-1].rstrip(',')  # Remove the comma from the last device entry
-        return device_description
-
-    def get_xml_start(self, mc_unit):
-        root = Element('TcPlcObject')
-        root.set('Version', '1.1.0.1')
-        root.set('ProductVersion', '3.1.4024.5')
-
-        gvl = SubElement(root, 'GVL')
-        gvl.set('Name', 'GVL_PILS')
-        gvl.set('Id', '{ace53d5e-03a7-4e79-9a33-72de579eb8fd}')
-
-        declaration = SubElement(gvl, 'Declaration')
-        cdata_content = [
+        return render_description(build_layout(devices))
+
+    def declaration_header(self, mc_unit) -> List[str]:
+        """
+        Returns the lines of the GVL declaration of one motion control unit that precede its memory map.
+
+        :param mc_unit: The motion control unit.
+        :return: The VAR_GLOBAL line and the PLC identification.
+        """
+        return [
             'VAR_GLOBAL',
             f"sPLCName: STRING[34] := '{self.instrument.lower()}-mcs{mc_unit}';",  # TODO: Replace with actual PLC name
-            f"sPLCVersion: STRING[34] := '{VERSION}';",
+            f"sPLCVersion: STRING[34] := '{get_version()}';",
             "sPLCAuthor1: STRING[34] := 'https://github.com/';",
             "sPLCAuthor2: STRING[34] := 'ess-dmsc/pils-epics-generator';\n",
         ]
-        return root, declaration, cdata_content
 
-    def add_xml_end(self, declaration, cdata_content):
-        declaration.text = "<![CDATA[" + "\n\t".join(cdata_content)
-        declaration.text += "\nEND_VAR\n"
-        declaration.text += "]]>"
+    def declaration_lines(self, mc_unit) -> List[str]:
+        """
+        Returns the GVL declaration of one motion control unit, line by line.
+
+        :param mc_unit: The motion control unit.
+        :return: The declaration lines, from VAR_GLOBAL up to but not including END_VAR.
+        """
+        lines = self.declaration_header(mc_unit)
 
-    def finish_xml(self, root, declaration, cdata_content):
-        self.add_xml_end(declaration, cdata_content)
+        # The memory map is computed once and rendered twice
+        slots = self.layout(mc_unit)
+        lines.extend(render_definition(slots))
+        lines.extend(render_description(slots))
+        return lines
 
-        # Generate rough string with ElementTree
-        rough_string = xml.etree.ElementTree.tostring(root, encoding='UTF-8')
+    def xml_file_name(self, mc_unit) -> str:
+        return f"mc_unit_{mc_unit}.TcGVL"
 
-        # Pretty print with minidom
-        reparsed = xml.dom.minidom.parseString(rough_string)
-        pretty_xml_str = reparsed.toprettyxml(indent="  ")
+    def st_cmd_file_name(self, mc_unit) -> str:
+        return f"st.{self.instrument.lower()}-mcs{mc_unit}.iocsh"
 
-        # Manually prepend the desired XML declaration
-        xml_declaration = '<?xml version="1.0" encoding="utf-8"?>'
-        pretty_xml_str = pretty_xml_str.replace('<?xml version="1.0" ?>', xml_declaration)
-        pretty_xml_str = pretty_xml_str.replace("&lt;", "<")
-        pretty_xml_str = pretty_xml_str.replace("&gt;", ">").strip()
-        return pretty_xml_str
+    def opi_file_name(self, mc_unit) -> str:
+        return f"IOC-{self.instrument.upper()}-MCS{mc_unit}.mid"
 
-    def to_xml(self) -> None:
+    def layout(self, mc_unit) -> List[Slot]:
         """
-        Generates an XML file per motion control unit from the device collection.
+        Computes the PILS memory map of one motion control unit.
+
+        Packed or with a stable allocation the slots are no longer in memory
+        order, see layout_options and allocation.
+
+        :param mc_unit: The motion control unit.
+        :return: The slots of the unit, in spreadsheet order.
         """
-        for mc_unit, devices in self.devices_by_unit.items():
-            xml_file_path = f"mc_unit_{mc_unit}.TcGVL"
-            root, declaration, cdata_content = self.get_xml_start(mc_unit)
+        slots = build_layout(self.devices_by_unit[mc_unit], PILS_START_OFFSET)
+        if self.layout_options.pack:
+            slots = pack_layout(slots, PILS_START_OFFSET)
+        if self.layout_options.index_order != 'spreadsheet':
+            slots = order_indices(slots, self.layout_options.index_order)
+        if self.allocation is not None:
+            slots = self.allocation.allocate(mc_unit, slots)
+        return slots
+
+    def memory_map(self, mc_unit) -> np.ndarray:
+        """
+        Exports the PILS memory map of one motion control unit as fixed-width records.
+
+        :param mc_unit: The motion control unit.
+        :return: A structured array of MEMORY_MAP_DTYPE, in PILS index order.
+        """
+        return memory_map_records(self.layout(mc_unit), mc_unit)
+
+    def memory_map_file_name(self, mc_unit, memory_map_format: str) -> str:
+        if memory_map_format not in MEMORY_MAP_FORMATS:
+            raise ValueError(f"Unknown memory map format {memory_map_format}")
+        return f"mc_unit_{mc_unit}.{MEMORY_MAP_FORMATS[memory_map_format]}"
 
-            device_definitions, num_devices, pneumatic_exists = self.build_definition(devices)
-            cdata_content.extend(device_definitions)
+    def render_memory_map(self, mc_unit, memory_map_format: str) -> bytes:
+        """
+        Renders the memory map of one motion control unit.
 
-            device_description = self.build_description(devices, num_devices, pneumatic_exists)
-            cdata_content.extend(device_description)
+        :param mc_unit: The motion control unit to render.
+        :param memory_map_format: 'records', 'parquet' or 'arrow'.
+        :return: The file content.
+        """
+        return render_memory_map(self.memory_map(mc_unit), memory_map_format)
 
-            pretty_xml_str = self.finish_xml(root, declaration, cdata_content)
+    def to_memory_map(self, memory_map_format: str = 'records', output_dir: str = '.',
+                      sink: Optional[OutputSink] = None) -> None:
+        """
+        Generates a memory map file per motion control unit.
 
-            # Ensure UTF-8 encoding is preserved by writing as bytes
-            with open(xml_file_path, 'w', encoding='utf-8') as file:
-                file.write(pretty_xml_str)
+        :param memory_map_format: 'records', 'parquet' or 'arrow'.
+        :param output_dir: The directory the files are written to.
+        :param sink: The sink the files are written to instead of output_dir.
+        """
+        sink = sink or DirectorySink(output_dir)
+        for mc_unit in self.devices_by_unit:
+            sink.write(self.memory_map_file_name(mc_unit, memory_map_format),
+                       self.render_memory_map(mc_unit, memory_map_format))
+
+    def render_xml(self, mc_unit) -> str:
+        """
+        Renders the PILS table (TcGVL) of one motion control unit.
+
+        :param mc_unit: The motion control unit to render.
+        :return: The TcGVL file content.
+        """
+        return render_tcgvl(self.declaration_lines(mc_unit))
+
+    def write_xml(self, mc_unit, file: TextIO) -> None:
+        """
+        Streams the PILS table (TcGVL) of one motion control unit to a file handle.
+
+        :param mc_unit: The motion control unit to render.
+        :param file: The text file handle to write to.
+        """
+        write_tcgvl(file, self.declaration_lines(mc_unit))
+
+    def to_xml(self, output_dir: str = '.', sink: Optional[OutputSink] = None) -> None:
+        """
+        Generates an XML file per motion control unit from the device collection.
+
+        :param output_dir: The directory the files are written to.
+        :param sink: The sink the files are written to instead of output_dir.
+        """
+        sink = sink or DirectorySink(output_dir)
+        for mc_unit in self.devices_by_unit:
+            sink.write(self.xml_file_name(mc_unit), self.render_xml(mc_unit))
 
     def format_spare_motor(self, mc_unit, idx):
         if idx < 10:
@@ -626,165 +587,95 @@ class DeviceCollection:
             return f"MC-Spare-0{idx}"
         return f"MC-Spare-{idx}"
 
-    def to_st_cmd(self, ioc_ip, plc_ip, return_it=False):
-        for mc_unit, devices in self.devices_by_unit.items():
-            st_cmd_file_path = f"st.{self.instrument.lower()}-mcs{mc_unit}.iocsh"
-
-
-            # Use a list to collect command lines
-            commands = []
-
-            # Filter devices with pv_name and mc_axis_nc not None
-            # devices = [device for device in devices if device.pv_name is not None and device.mc_axis_nc is not None]
-            num_devices = len(devices)
-
-            # find the maximum number of devices per axis type
-            # pn_devs = [device for device in devices if device.mc_axis_pn is not None]
-            # nc_devs = [device for device in devices if device.mc_axis_nc is not None]
-            #
-            # num_devices = max(len(pn_devs), len(nc_devs))
-
-
-            # Add commands for EPICS environment setup
-            commands.extend([
-                'require essioc',
-                'require calc',
-                'require ethercatmc',
-                '',
-                'iocshLoad("$(essioc_DIR)/common_config.iocsh")',
-                '',
-                f'epicsEnvSet("MOTOR_PORT",    "MCU1")',
-                f'epicsEnvSet("IPADDR",        "{plc_ip}")',
-                f'epicsEnvSet("IPPORT",        "48898")',
-                f'epicsEnvSet("AMSNETIDIOC",   "{ioc_ip}.1.1")',
-                f'epicsEnvSet("ASYN_PORT",     "MC_CPU1")',
-                # '# prefix for all, system in ESS naming convention',
-                f'epicsEnvSet("P",             "{self.instrument.upper()}-")',
-                # '# prefix for all MCU-ish records like PTP',
-                f'epicsEnvSet("R",             "MCS{mc_unit}:MC-MCU-0{mc_unit}:")',
-                'epicsEnvSet("PREC",          "3")',
-                f'epicsEnvSet("ECM_NUMAXES",   "{num_devices}")',
-                f'epicsEnvSet("ECM_OPTIONS",   "adsPort=852;amsNetIdRemote={plc_ip}.1.1;amsNetIdLocal=$(AMSNETIDIOC)")',
-                '',
-                'epicsEnvSet("ECM_MOVINGPOLLPERIOD", "0")',
-                'epicsEnvSet("ECM_IDLEPOLLPERIOD",   "0")',
-                '',
-                # '< ethercatmcController.iocsh',
-                'iocshLoad("$(ethercatmc_DIR)ethercatmcController.iocsh")',
-                ''
-            ])
-
-            # Add the cabinet status
-            commands.extend([
-                '#',
-                '# Cabinet status',
-                '#',
-                'epicsEnvSet("AXIS_NO",         "0")',
-                'epicsEnvSet("R",               "Cabinet")',
-                'epicsEnvSet("DESC",            "Cabinet")',
-                'epicsEnvSet("EGU",             "Cabinet")',
-                # '< ethercatmcCabinet.iocsh',
-                'iocshLoad("$(ethercatmc_DIR)ethercatmcCabinet.iocsh")',
-                ''
-            ])
-
-            # Add commands for each device
-            spare_nc_idx = 1
-            spare_pn_idx = 1
-            idx = 1
-            for device in devices:
-                if device.mc_axis_nc is not None:
-                    commands.extend([
-                        '#',
-                        f'# AXIS {idx}',
-                        '#',
-                        'epicsEnvSet("AXISCONFIG",      "")',
-                        f'epicsEnvSet("R",               "{device.pv_name if device.pv_name is not None else self.format_spare_motor(mc_unit, spare_nc_idx)}:Mtr")',
-                        f'epicsEnvSet("AXIS_NO",         "{idx}")',
-                        'epicsEnvSet("RAWENCSTEP_ADEL", "0")',
-                        'epicsEnvSet("RAWENCSTEP_MDEL", "0")',
-                        # '< ethercatmcIndexerAxis.iocsh',
-                        # '< ethercatmcAxisdebug.iocsh',
-                        'iocshLoad("$(ethercatmc_DIR)ethercatmcIndexerAxis.iocsh")',
-                        'iocshLoad("$(ethercatmc_DIR)ethercatmcAxisdebug.iocsh")',
-                        ''
-                    ])
-                    idx += 1
-                    if device.pv_name is None:
-                        spare_nc_idx += 1
-                elif device.mc_axis_pn is not None:
-                    commands.extend([
-                        '#',
-                        f'# AXIS {idx}',
-                        '#',
-                        'epicsEnvSet("AXISCONFIG",      "")',
-                        f'epicsEnvSet("R",               "{device.pv_name if device.pv_name is not None else self.format_spare_pneumatic(mc_unit, spare_pn_idx)}:Sht")',
-                        f'epicsEnvSet("AXIS_NO",         "{idx}")',
-                        # '< ethercatmcShutter.iocsh',
-                        'iocshLoad("$(ethercatmc_DIR)ethercatmcShutter.iocsh")',
-                        ''
-                    ])
-                    idx += 1
-                    if device.pv_name is None:
-                        spare_pn_idx += 1
-
-            # Add commands to start the poller
-            commands.extend([
-                'epicsEnvSet("MOVINGPOLLPERIOD", "200")',
-                'epicsEnvSet("IDLEPOLLPERIOD",   "200")',
-                'ethercatmcStartPoller("$(MOTOR_PORT)", "$(MOVINGPOLLPERIOD)", "$(IDLEPOLLPERIOD)")',
-                '',
-                'iocInit()',
-                ''
-            ])
-
-            # Join the command lines with newline characters and write to file
-            command_string = "\n".join(commands)
-
-            if return_it:
-                return command_string
-
-            with open(st_cmd_file_path, 'w') as file:
-                file.write(command_string)
-
-    def to_opi(self):
-        for mc_unit, devices in self.devices_by_unit.items():
-            devices = [device for device in devices if device.mc_axis_nc is not None]
-            num_devices = len(devices)
-
-            file_name = 'base_motor.mid'
-            file_path = os.path.join(os.path.dirname(__file__), file_name)
-
-            macros = [
-                f'<PREFIX>{self.instrument.upper()}-MCS{mc_unit}:MC-MCU-0{mc_unit}:</PREFIX>',
-                f'<P>YMIR-</P>'
-            ]
-            for idx, device in enumerate(devices, start=1):
-                name = f"{device.pv_name}:Mtr" if device.pv_name is not None else f"{self.format_spare_motor(mc_unit, idx)}:Mtr"
-                macros.append(f'<M{idx}>{name}</M{idx}>')
-            for idx, device in enumerate(devices, start=1):
-                name = f"{device.pv_name}:Mtr" if device.pv_name is not None else f"{self.format_spare_motor(mc_unit, idx)}:Mtr"
-                macros.append(f'<R{idx}>{name}-</R{idx}>')
-
-            with open(file_path, 'r') as file:
-                content = file.readlines()
-
-            for i, line in enumerate(content):
-                indent_length = len(line) - len(line.lstrip())
-                if "$MACROS$" in line:
-                    line = line.lstrip()
-                    line = line.replace("$MACROS$", "\n".join([f"{' '*indent_length}{macro}" for macro in macros]))
-                    content[i] = line
-
-                if "$NUM_DEVS$" in line:
-                    line = line.replace("$NUM_DEVS$", str(num_devices))
-                    content[i] = line
-
-                if "$MCU_NAME$" in line:
-                    line = line.replace("$MCU_NAME$", f"{self.instrument.upper()}-MCS{mc_unit}")
-                    content[i] = line
-
-            final_string = "".join(content)
-
-            with open(f"IOC-{self.instrument.upper()}-MCS{mc_unit}.mid", 'w') as file:
-                file.write(final_string)
+    def render_st_cmd(self, mc_unit, ioc_ip, plc_ip, read_blocks: Optional[ReadBlockOptions] = None) -> str:
+        """
+        Renders the IOC st.cmd (iocsh) of one motion control unit.
+
+        :param mc_unit: The motion control unit to render.
+        :param ioc_ip: IP address of the IOC.
+        :param plc_ip: IP address of the PLC.
+        :param read_blocks: Set the ADS read plan planned with these limits as environment variables.
+        :return: The iocsh file content.
+        """
+        blocks = self.read_blocks(mc_unit, read_blocks) if read_blocks is not None else None
+        kwargs = {}
+        if str(mc_unit) in self.poll_periods:
+            kwargs['poll_periods'] = self.poll_periods[str(mc_unit)]
+        return render_to_string(write_st_cmd, self, mc_unit, ioc_ip, plc_ip, read_blocks=blocks, **kwargs)
+
+    def read_blocks(self, mc_unit, options: ReadBlockOptions = ReadBlockOptions()) -> List[ReadBlock]:
+        """
+        Plans the ADS read blocks of one motion control unit, per poll class.
+
+        :param mc_unit: The motion control unit.
+        :param options: The block limits.
+        :return: The blocks returned by plan_read_blocks.
+        """
+        return plan_read_blocks(self.layout(mc_unit), options)
+
+    def read_blocks_file_name(self, mc_unit) -> str:
+        return f"st.{self.instrument.lower()}-mcs{mc_unit}.blocks.json"
+
+    def render_read_blocks(self, mc_unit, options: ReadBlockOptions = ReadBlockOptions()) -> str:
+        """
+        Renders the ADS read plan of one motion control unit as JSON.
+        """
+        return render_read_blocks(self.instrument, mc_unit, self.read_blocks(mc_unit, options), options)
+
+    def poll_cycle(self, mc_unit, read_blocks: Optional[ReadBlockOptions] = None) -> PollCycle:
+        """
+        Counts the ADS reads of one poll of a motion control unit.
+
+        :param mc_unit: The motion control unit.
+        :param read_blocks: The limits of the read plan, if the IOC uses one.
+        :return: The cycle returned by poll_cycle.
+        """
+        return poll_cycle(self.layout(mc_unit), read_blocks)
+
+    def render_st_cmds(self, ioc_ip, plc_ip) -> Dict[int, str]:
+        """
+        Renders the IOC st.cmd (iocsh) of every motion control unit in memory.
+
+        :param ioc_ip: IP address of the IOC.
+        :param plc_ip: IP address of the PLC.
+        :return: The iocsh file content by motion control unit.
+        """
+        return {mc_unit: self.render_st_cmd(mc_unit, ioc_ip, plc_ip) for mc_unit in self.devices_by_unit}
+
+    def to_st_cmd(self, ioc_ip, plc_ip, return_it=False, output_dir='.', sink: Optional[OutputSink] = None):
+        """
+        Generates an IOC st.cmd file per motion control unit.
+
+        :param ioc_ip: IP address of the IOC.
+        :param plc_ip: IP address of the PLC.
+        :param return_it: Return the files of all units by motion control unit instead of writing them.
+        :param output_dir: The directory the files are written to.
+        :param sink: The sink the files are written to instead of output_dir.
+        """
+        st_cmds = self.render_st_cmds(ioc_ip, plc_ip)
+        if return_it:
+            return st_cmds
+
+        sink = sink or DirectorySink(output_dir)
+        for mc_unit, st_cmd in st_cmds.items():
+            sink.write(self.st_cmd_file_name(mc_unit), st_cmd)
+
+    def render_opi(self, mc_unit) -> str:
+        """
+        Renders the OPI css (mid) of one motion control unit.
+
+        :param mc_unit: The motion control unit to render.
+        :return: The mid file content.
+        """
+        return render_to_string(write_opi, self, mc_unit)
+
+    def to_opi(self, output_dir='.', sink: Optional[OutputSink] = None):
+        """
+        Generates an OPI css file per motion control unit.
+
+        :param output_dir: The directory the files are written to.
+        :param sink: The sink the files are written to instead of output_dir.
+        """
+        sink = sink or DirectorySink(output_dir)
+        for mc_unit in self.devices_by_unit:
+            sink.write(self.opi_file_name(mc_unit), self.render_opi(mc_unit))
@@ -0,0 +1,96 @@
+from typing import List, Sequence
+
+import numpy as np
+
+# Temperature unit codes, as used in the PILS device descriptions
+TEMP_UNIT_CODES = {
+    'c': 0x0009,
+    'k': 0x0008
+}
+
+# Axis numbers of devices without an NC or pneumatic axis
+NO_AXIS = -1
+
+DEVICE_TABLE_DTYPE = np.dtype([
+    ('mc_unit', np.int32),
+    ('type_code', np.uint16),
+    ('mc_axis_nc', np.int32),
+    ('mc_axis_pn', np.int32),
+    ('ptp', np.bool_),
+    ('has_temp', np.bool_),
+    ('temp_unit_code', np.uint16),
+    ('has_extra', np.bool_),
+    ('extra_type_code', np.uint16),
+    ('is_spare', np.bool_),
+])
+
+
+def type_code(device_type: str) -> int:
+    """
+    Converts a PILS device type such as '5010' or '1A04' to its numeric type code.
+
+    :param device_type: The PILS device type, as a hex string.
+    :return: The type code, 0 for an empty device type.
+    """
+    return int(device_type, 16) if device_type else 0
+
+
+class DeviceTable:
+    """
+    A compact, array-backed view of the devices of one motion control unit.
+
+    The numeric properties are held in a numpy structured array with one
+    record per device (see DEVICE_TABLE_DTYPE); the names are kept in plain
+    lists next to it.
+    """
+
+    def __init__(self, records: np.ndarray, pils_names: List[str], pv_names: List[str]) -> None:
+        """
+        Initializes a new instance of the DeviceTable class.
+
+        :param records: A structured array of dtype DEVICE_TABLE_DTYPE.
+        :param pils_names: The PILS name of each device.
+        :param pv_names: The PV name of each device, None for spares.
+        """
+        self.records = records
+        self.pils_names = pils_names
+        self.pv_names = pv_names
+
+    @classmethod
+    def from_devices(cls, devices: Sequence) -> 'DeviceTable':
+        """
+        Builds a table from a list of Device instances.
+
+        :param devices: The devices, in spreadsheet order.
+        :return: A DeviceTable instance.
+        """
+        records = np.array([
+            (
+                device.mc_unit,
+                type_code(device.device_type),
+                NO_AXIS if device.mc_axis_nc is None else device.mc_axis_nc,
+                NO_AXIS if device.mc_axis_pn is None else device.mc_axis_pn,
+                device.ptp,
+                device.has_temp,
+                TEMP_UNIT_CODES.get(device.temp_units, 0) if device.has_temp else 0,
+                device.has_extra,
+                type_code(device.extra_type) if device.has_extra else 0,
+                device.pv_name is None,
+            )
+            for device in devices
+        ], dtype=DEVICE_TABLE_DTYPE)
+        return cls(records, [device.pils_name for device in devices], [device.pv_name for device in devices])
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        return self.records[field]
+
+    @property
+    def is_motor(self) -> np.ndarray:
+        return self.records['mc_axis_nc'] != NO_AXIS
+
+    @property
+    def is_pneumatic(self) -> np.ndarray:
+        return (self.records['mc_axis_nc'] == NO_AXIS) & (self.records['mc_axis_pn'] != NO_AXIS)
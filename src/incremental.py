@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import tempfile
+from typing import Dict, List, Optional, Tuple, Union
+
+from src.version import get_version
+
+# File kept next to the generated files, recording what each unit was generated from
+MANIFEST_FILE_NAME = '.pils-manifest.json'
+
+
+def file_mode(file_path: str) -> int:
+    """
+    Returns the permission bits a replacement for a file should get: those of
+    the existing file, or what open() would create under the current umask.
+
+    tempfile.mkstemp always creates files readable by their owner only, so
+    files written through a temporary file have to be given this mode.
+    """
+    try:
+        return os.stat(file_path).st_mode & 0o7777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def write_if_changed(file_path: str, content: Union[str, bytes]) -> bool:
+    """
+    Atomically writes a text file, unless it already has exactly this content.
+
+    The content goes to a temporary file in the same directory, which then
+    replaces the target, so readers never see a partially written file.
+
+    :param file_path: The path of the file.
+    :param content: The content to write; text is encoded as UTF-8.
+    :return: True if the file was written, False if it was unchanged.
+    """
+    data = content.encode('utf-8') if isinstance(content, str) else content
+    try:
+        with open(file_path, 'rb') as file:
+            if file.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+
+    directory = os.path.dirname(file_path) or '.'
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(file_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.write(data)
+        os.chmod(tmp_path, file_mode(file_path))
+        os.replace(tmp_path, file_path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return True
+
+
+def unit_fingerprint(device_collection, mc_unit, options: Dict) -> str:
+    """
+    Fingerprints everything the files of one unit are generated from: the
+    normalised device rows, the instrument, the generator version and the
+    output options.
+
+    :param device_collection: The devices of the instrument.
+    :param mc_unit: The motion control unit.
+    :param options: The output options, e.g. pils/ioc/opi and the IP addresses.
+    :return: A hex digest.
+    """
+    state = {
+        'generator_version': get_version(),
+        'instrument': str(device_collection.instrument),
+        'mc_unit': str(mc_unit),
+        'options': options,
+        'devices': [device.to_dict() for device in device_collection.devices_by_unit[mc_unit]],
+    }
+    encoded = json.dumps(state, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def load_manifest(output_dir: str) -> Dict:
+    """
+    Loads the manifest of an output directory, empty if there is none or it is unreadable.
+    """
+    try:
+        with open(os.path.join(output_dir, MANIFEST_FILE_NAME), 'r', encoding='utf-8') as file:
+            manifest = json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {'units': {}}
+    if not isinstance(manifest.get('units'), dict):
+        return {'units': {}}
+    return manifest
+
+
+def dump_manifest(manifest: Dict) -> str:
+    """
+    Serialises a manifest, as stored in MANIFEST_FILE_NAME.
+    """
+    return json.dumps(manifest, indent=2, sort_keys=True) + '\n'
+
+
+def plan_units(device_collection, output_dir: str, unit_files: Dict, options: Dict,
+               previous: Optional[Dict] = None) -> Tuple[List, Dict]:
+    """
+    Works out which units need to be rendered again.
+
+    A unit is rendered if its fingerprint differs from the manifest or one of
+    its files is missing from the output directory.
+
+    :param device_collection: The devices of the instrument.
+    :param output_dir: The directory holding the previous output and manifest.
+    :param unit_files: The file names each unit produces, by unit.
+    :param options: The output options, part of the fingerprint.
+    :param previous: The manifest to compare with instead of the one in output_dir.
+    :return: The units to render and the manifest to save after writing them.
+    """
+    previous = (previous if previous is not None else load_manifest(output_dir))['units']
+    manifest = {'units': {}}
+    units = []
+    for mc_unit, file_names in unit_files.items():
+        fingerprint = unit_fingerprint(device_collection, mc_unit, options)
+        manifest['units'][str(mc_unit)] = {'fingerprint': fingerprint, 'files': list(file_names)}
+
+        entry = previous.get(str(mc_unit), {})
+        up_to_date = entry.get('fingerprint') == fingerprint and all(
+            os.path.exists(os.path.join(output_dir, file_name)) for file_name in file_names
+        )
+        if not up_to_date:
+            units.append(mc_unit)
+
+    return units, manifest
@@ -0,0 +1,459 @@
+from functools import lru_cache
+from typing import Iterable, List, NamedTuple, Tuple
+
+pils_device_byte_aligments = {
+    '1201':  2,  # Simple discrete input, 16 bit signed integer
+    '1202':  4,  # Simple discrete input, 32 bit signed integer
+    '1204':  8,  # Simple discrete input, 64 bit signed integer
+    '1302':  4,  # Simple analog input, 32 bit floating point, real
+    '1304':  8,  # Simple analog input, 64 bit floating point, double
+    '1602':  2,  # Simple discrete output, 16 bit signed integer
+    '1604':  4,  # Simple discrete output, 32 bit signed integer
+    '1608':  8,  # Simple discrete output, 64 bit signed integer
+    '1704':  4,  # Simple analog output, 32 bit floating point, real
+    '1708':  8,  # Simple analog output, 64 bit floating point, double
+    '1802':  4,  # Extended status word that has 24 AUX bits
+    '1A04':  4,  # discrete input, 32 bit signed integer + extended status word
+    '1A08':  8,  # discrete input, 64 bit signed integer + extended status word + errorID
+    '1B04':  4,  # analog input, 32 bit floating point + status word
+    '1B08':  8,  # analog input, 64 bit floating point + extended status word + errorID
+    '1E04':  4,  # discrete output, 16 bit signed integer + extended status word
+    '1E06':  4,  # discrete output, 32 bit signed integer + extended status word
+    '1E0C':  8,  # discrete output, 64 bit signed integer + extended status word + errorID
+    '1F06':  4,  # analog output, 32 bit signed integer + extended status word
+    '1F0C':  8,  # analog output, 64 bit signed integer + extended status word + errorID
+    '5010':  8   # param device with 64 bit float, motor
+}
+
+pils_device_byte_lengths = {
+    '1201':  2,
+    '1202':  4,
+    '1204':  8,
+    '1302':  4,
+    '1304':  8,
+    '1602':  4,
+    '1604':  8,
+    '1608':  16,
+    '1704':  4,
+    '1708':  8,
+    '1802':  4,
+    '1A04':  8,
+    '1A08':  16,
+    '1B04':  8,
+    '1B08':  16,
+    '1E04':  8,
+    '1E06':  12,
+    '1E0C':  24,
+    '1F06':  12,
+    '1F0C':  24,
+    '5010':  32
+}
+
+pils_temp_units = {
+    'c': '16#0009',
+    'k': '16#0008'
+}
+
+pils_units = {
+    'mm': '16#FD04',
+    'degree': '16#000C',
+}
+
+
+def get_next_mb(memory_offset: int, device_type: str) -> int:
+    """
+    Calculate the next memory offset for a given device type.
+
+    :param memory_offset: The current memory offset.
+    :param device_type: The type of the device.
+    :return: The next memory offset.
+    """
+
+    return memory_offset + pils_device_byte_lengths[device_type]
+
+
+def align_mb(memory_offset: int, device_type: str) -> int:
+    """
+    Aligns the memory offset based on the device's byte alignment requirements.
+
+    :param memory_offset: The current memory offset.
+    :param device_type: The type of the device.
+    :return: The aligned memory offset.
+    """
+
+    pils_device_byte_aligment = pils_device_byte_aligments[device_type]
+    misaligned = memory_offset % pils_device_byte_aligment
+    if misaligned != 0:
+        memory_offset = memory_offset - misaligned + pils_device_byte_aligment
+
+    return memory_offset
+
+
+# The first %MB offset of the PILS process image available to devices
+PILS_START_OFFSET = 128
+
+AXIS_AUX = "[(''),(''),(''),(''),(''),(''),(''),(''),(''),(''),(''),(''),(''),(''),(''),(''),(''),('InterlockFwd'),('InterlockBwd'),('localMode'),('inTargetPos'),('homeSensor'),('notHomed'),('enabled')]"
+SHUTTER_AUX = "[('Closed'),('Closing'),('Opening'),('Opened'),('InTheMiddle'),(''),(''),(''),(''),(''),(''),(''),(''),(''),('Interlocked'),('PSSPermitDenied'),('SolenoidActive'),('Retracted'),('Extended'),('Retracting'),('Extending'),(''),(''),('')]"
+PTP_ERROR_AUX = "[(''), (''), (''), (''), (''), (''), (''), (''), (''), (''), ('NotFullySynched'), ('NotSynchronized'),('NotPTPslave'), ('NotPTPv2'), ('RdDiagError'), ('CableNotConnected_PTPnotStarted'), (''), (''), (''),(''), (''), (''), (''), ('')]"
+CABINET_AUX = "[('24VPSFailed'), ('48VPSFailed'), ('MCBError'), ('SPDError'), ('DoorOpen'), ('TempHigh'), ('FuseTripped'), ('EStop'), ('ECMasterError'), ('SlaveNotOP'), ('SlaveMissing'), ('CPULoadHigh'),(''), (''), (''), (''), (''), (''), (''),(''), (''), (''), (''), ('')]"
+
+# Slot kinds that are declared on a line of their own, followed by an empty line
+SYSTEM_KINDS = ('pressure', 'cabinet')
+
+
+class Slot(NamedTuple):
+    """
+    One PILS device in the memory map of a motion control unit.
+    """
+    kind: str         # motor, pneumatic, temp, extra, sensor, pressure, ptp or cabinet
+    device_type: str  # PILS type code, e.g. '5010'
+    variable: str     # name of the GVL variable
+    name: str         # sName in the astDevices array
+    offset: int       # %MB offset
+    length: int       # size in bytes
+    alignment: int    # byte alignment
+    index: int        # PILS device number, i.e. the position in astDevices
+    fields: Tuple[Tuple[str, str], ...] = ()  # further ST_DeviceInfo fields, e.g. (('nUnit', '16#FD04'),)
+    group_end: bool = False  # last slot of a spreadsheet row or of a system block
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.length
+
+
+def make_slot(kind: str, device_type: str, variable: str, name: str, index: int, offset: int,
+              fields: Tuple[Tuple[str, str], ...] = (), group_end: bool = False) -> Slot:
+    """
+    Creates a slot at the next aligned offset.
+
+    :param offset: The current memory offset, aligned for the device type.
+    :return: The new slot; its end is the next free offset.
+    """
+    return Slot(kind, device_type, variable, name, align_mb(offset, device_type),
+                pils_device_byte_lengths[device_type], pils_device_byte_aligments[device_type],
+                index, fields, group_end)
+
+
+# The PILS type codes of the slots of a device or system block, in memory order
+Shape = Tuple[str, ...]
+
+# The slots of a device or system block before placement:
+# (kind, device_type, variable, name, fields, group_end)
+SlotEntry = Tuple[str, str, str, str, Tuple[Tuple[str, str], ...], bool]
+
+
+class PlacedSlot(NamedTuple):
+    """
+    One slot of a compiled shape, at an offset relative to the shape's base offset.
+    """
+    offset: int
+    length: int
+    alignment: int
+
+
+class ShapePattern(NamedTuple):
+    """
+    The compiled layout of a shape for one phase of its base offset.
+    """
+    slots: Tuple[PlacedSlot, ...]
+    size: int  # relative offset of the first byte after the last slot
+
+
+@lru_cache(maxsize=None)
+def shape_alignment(shape: Shape) -> int:
+    """
+    The largest alignment of the slots of a shape. All alignments are powers
+    of two, so the layout of a shape only depends on its base offset modulo
+    this value.
+    """
+    return max(pils_device_byte_aligments[device_type] for device_type in shape)
+
+
+@lru_cache(maxsize=None)
+def compile_shape(shape: Shape, phase: int) -> ShapePattern:
+    """
+    Lays out the slots of a shape once for a base offset phase.
+
+    :param shape: The PILS type codes of the slots, in memory order.
+    :param phase: The base offset modulo shape_alignment(shape).
+    :return: The slots at offsets relative to any base offset with that phase.
+    """
+    slots = []
+    offset = phase
+    for device_type in shape:
+        aligned = align_mb(offset, device_type)
+        length = pils_device_byte_lengths[device_type]
+        slots.append(PlacedSlot(aligned - phase, length, pils_device_byte_aligments[device_type]))
+        offset = aligned + length
+    return ShapePattern(tuple(slots), offset - phase)
+
+
+def shape_pattern(shape: Shape, offset: int) -> ShapePattern:
+    """
+    Looks up the compiled layout of a shape placed at an offset.
+
+    :param shape: The PILS type codes of the slots, in memory order.
+    :param offset: The current memory offset, the base of the shape.
+    :return: The pattern; add offset to its relative offsets.
+    """
+    return compile_shape(shape, offset % shape_alignment(shape))
+
+
+def layout_shapes(shapes: Iterable[Shape], start_offset: int = PILS_START_OFFSET) -> List[Tuple[int, ...]]:
+    """
+    Places a sequence of shapes one after the other, as build_layout places
+    the devices of a unit. For tools that need PILS offsets without building
+    devices.
+
+    :param shapes: The shapes, in memory order.
+    :param start_offset: The first free %MB offset.
+    :return: The %MB offsets of the slots of every shape.
+    """
+    offsets = []
+    offset = start_offset
+    for shape in shapes:
+        pattern = shape_pattern(shape, offset)
+        offsets.append(tuple(offset + slot.offset for slot in pattern.slots))
+        offset += pattern.size
+    return offsets
+
+
+def stamp_entries(entries: List[SlotEntry], index: int, offset: int) -> List[Slot]:
+    """
+    Places the slots of a device or system block using the compiled layout of its shape.
+
+    :param entries: The slots before placement.
+    :param index: The PILS device number of the first slot.
+    :param offset: The current memory offset.
+    :return: The slots, in memory order.
+    """
+    pattern = shape_pattern(tuple([entry[1] for entry in entries]), offset)
+    slots = []
+    for (kind, device_type, variable, name, fields, group_end), (relative, length, alignment) \
+            in zip(entries, pattern.slots):
+        slots.append(Slot(kind, device_type, variable, name, offset + relative, length, alignment, index, fields,
+                          group_end))
+        index += 1
+    return slots
+
+
+def device_entries(device) -> List[SlotEntry]:
+    """
+    Lists the slots of one spreadsheet device before placement: the device
+    itself and its temperature sensor and extra device, if any.
+    """
+    if device.mc_axis_nc is not None:
+        axis = device.mc_axis_nc
+        variable = f"stMotorM{axis}"
+        entries = [('motor', device.device_type, variable, device.pils_name,
+                    (('nUnit', pils_units[device.pils_unit]), ('asAUX', AXIS_AUX), ('nFlags', '1')), False)]
+        has_extra = device.has_extra
+    elif device.mc_axis_pn is not None:
+        axis = device.mc_axis_pn
+        variable = f"stPneumaticP{axis}"
+        entries = [('pneumatic', device.device_type, variable, device.pils_name, (('asAux', SHUTTER_AUX),), False)]
+        has_extra = False
+    elif device.device_type == '1302':
+        return [('sensor', '1302', device.extra_name, device.extra_desc,
+                 (('nUnit', pils_temp_units[device.temp_units]),), True)]
+    else:
+        raise NotImplementedError
+
+    if device.has_temp:
+        entries.append(('temp', '1302', f"{variable}Temp", f"Temp#{axis}",
+                        (('nUnit', pils_temp_units[device.temp_units]),), False))
+    if has_extra:
+        entries.append(('extra', device.extra_type, device.extra_name, device.extra_desc, (), False))
+
+    entries[-1] = entries[-1][:5] + (True,)
+    return entries
+
+
+def device_shape(device) -> Shape:
+    """
+    The shape of one spreadsheet device, e.g. ('5010', '1302') for a motor
+    with a temperature sensor.
+    """
+    return tuple(entry[1] for entry in device_entries(device))
+
+
+def layout_device(device, index: int, offset: int) -> List[Slot]:
+    """
+    Lays out the slots of one spreadsheet device: the device itself and its
+    temperature sensor and extra device, if any.
+
+    :param device: The device to lay out.
+    :param index: The PILS device number of the first slot.
+    :param offset: The current memory offset.
+    :return: The slots of the device, in memory order.
+    """
+    return stamp_entries(device_entries(device), index, offset)
+
+
+def system_entries(pneumatic_exists: bool, ptp: bool) -> List[SlotEntry]:
+    """
+    Lists the slots every unit has after its devices, before placement.
+    """
+    entries = []
+    if pneumatic_exists:
+        entries.append(('pressure', '1B08', "stPressureSensor", 'SysPressureValue', (), True))
+    if ptp:
+        entries.extend([
+            ('ptp', '1A04', "stPTPOffset", 'PTPOffset#0', (), False),
+            ('ptp', '1A04', "stPTPState", 'PTPState#0', (), False),
+            ('ptp', '1201', "stPTPSyncSeqNum", 'PTPSyncSeqNum#0', (), False),
+            ('ptp', '1A04', "stPTPErrorStatus", 'PTPErrorStatus#0', (('asAux', PTP_ERROR_AUX),), False),
+            ('ptp', '1204', "stSystemUTCtime", 'SystemUTCtime#0', (('nUnit', '16#F711'),), True),
+        ])
+    entries.append(('cabinet', '1802', "stCabinetStatus", 'Cabinet#0', (('asAux', CABINET_AUX),), True))
+    return entries
+
+
+def layout_system(pneumatic_exists: bool, ptp: bool, index: int, offset: int) -> List[Slot]:
+    """
+    Lays out the slots every unit has after its devices: the pressure sensor
+    if there are pneumatic axes, the PTP block if enabled and the cabinet status.
+
+    :param index: The PILS device number of the first slot.
+    :param offset: The current memory offset.
+    :return: The system slots, in memory order.
+    """
+    return stamp_entries(system_entries(pneumatic_exists, ptp), index, offset)
+
+
+def build_layout(devices, start_offset: int = PILS_START_OFFSET) -> List[Slot]:
+    """
+    Computes the memory map of one motion control unit in a single pass.
+
+    Devices are placed in spreadsheet order from start_offset, each aligned
+    to its type, followed by the system slots. Both the GVL declaration and
+    the astDevices array are rendered from the result.
+
+    :param devices: The devices of the unit, in spreadsheet order.
+    :param start_offset: The first free %MB offset.
+    :return: The slots of the unit, in memory order.
+    """
+    slots = []
+    offset = start_offset
+    for device in devices:
+        device_slots = layout_device(device, len(slots) + 1, offset)
+        slots.extend(device_slots)
+        offset = device_slots[-1].end
+
+    pneumatic_exists = any(slot.kind == 'pneumatic' for slot in slots)
+    slots.extend(layout_system(pneumatic_exists, devices[0].ptp, len(slots) + 1, offset))
+    return slots
+
+
+# The orders the PILS device indices can follow: the spreadsheet rows, or the %MB offsets
+INDEX_ORDERS = ('spreadsheet', 'memory')
+
+
+class LayoutOptions(NamedTuple):
+    """
+    How the memory map of a unit is laid out.
+    """
+    pack: bool = False                # group the slots by alignment so there is no padding between them
+    index_order: str = 'spreadsheet'  # one of INDEX_ORDERS
+    report: bool = False              # print the bytes saved by packing per unit
+
+
+def image_size(slots: List[Slot], start_offset: int = PILS_START_OFFSET) -> int:
+    """
+    Returns the bytes of the process image a memory map spans, padding included.
+    """
+    return max((slot.end for slot in slots), default=start_offset) - start_offset
+
+
+def pack_layout(slots: List[Slot], start_offset: int = PILS_START_OFFSET) -> List[Slot]:
+    """
+    Moves the slots of a unit so the memory map has no padding.
+
+    Every PILS type's length is a multiple of its alignment and all
+    alignments are powers of two, so placing the 8 byte aligned slots
+    first, then the 4 and then the 2 byte aligned ones, each class in
+    spreadsheet order, leaves no holes. The PILS indices are unchanged.
+
+    :param slots: The slots returned by build_layout.
+    :param start_offset: The first free %MB offset, aligned to 8 bytes.
+    :return: The slots in the same order, at their packed offsets.
+    """
+    offsets = {}
+    offset = start_offset
+    for position in sorted(range(len(slots)), key=lambda position: -slots[position].alignment):
+        slot = slots[position]
+        offsets[position] = align_mb(offset, slot.device_type)
+        offset = offsets[position] + slot.length
+    return [slot._replace(offset=offsets[position]) for position, slot in enumerate(slots)]
+
+
+def order_indices(slots: List[Slot], index_order: str = 'spreadsheet') -> List[Slot]:
+    """
+    Renumbers the PILS indices of a unit.
+
+    :param slots: The slots of the unit, in spreadsheet order.
+    :param index_order: 'spreadsheet' to number the slots in list order, 'memory' to number them by offset.
+    :return: The slots in the same order, renumbered from 1.
+    """
+    if index_order == 'spreadsheet':
+        order = range(len(slots))
+    elif index_order == 'memory':
+        order = sorted(range(len(slots)), key=lambda position: slots[position].offset)
+    else:
+        raise ValueError(f"Unknown index order {index_order}")
+    indices = {position: index for index, position in enumerate(order, start=1)}
+    return [slot._replace(index=indices[position]) for position, slot in enumerate(slots)]
+
+
+def define_slot(slot: Slot) -> List[str]:
+    """
+    Renders the GVL declaration lines of one slot.
+    """
+    lines = [f"{slot.variable} AT %MB{slot.offset}: ST_{slot.device_type};"]
+    if slot.kind == 'motor':
+        base_name = slot.variable[len('st'):]
+        lines.append(f"fb{base_name}: FB_{slot.device_type}_Axis := (nPILSDeviceNumber := {slot.index});")
+        lines.append(f"{slot.variable}Param: ST_AxisParameters;")
+    elif slot.kind == 'pneumatic':
+        base_name = slot.variable[len('st'):]
+        lines.append(f"fb{base_name}: FB_{slot.device_type}_Pneumatic := (nPILSDeviceNumber := {slot.index});")
+    return lines
+
+
+def describe_slot(slot: Slot) -> str:
+    """
+    Renders the astDevices entry of one slot.
+    """
+    fields = "".join(f", {key} := {value}" for key, value in slot.fields)
+    return f"(nTypCode := 16#{slot.device_type}, sName := '{slot.name}', nOffset := {slot.offset}{fields}),"
+
+
+def render_definition(slots: List[Slot]) -> List[str]:
+    """
+    Renders the GVL declarations of a memory map.
+
+    :param slots: The slots returned by build_layout.
+    :return: The declaration lines.
+    """
+    lines = []
+    for slot in slots:
+        slot_lines = define_slot(slot)
+        if slot.kind in SYSTEM_KINDS:
+            slot_lines[-1] += "\n"
+        elif slot.group_end:
+            slot_lines.append("")
+        lines.extend(slot_lines)
+    return lines
+
+
+def render_description(slots: List[Slot]) -> List[str]:
+    """
+    Renders the astDevices array of a memory map.
+
+    :param slots: The slots returned by build_layout.
+    :return: The array lines, in PILS index order.
+    """
+    lines = ["// Array of Devices", f"astDevices: ARRAY [1..{len(slots)}] OF ST_DeviceInfo :=["]
+    lines.extend(describe_slot(slot) for slot in sorted(slots, key=lambda slot: slot.index))
+    lines[-1] = lines[-1].rstrip(',') + "];"
+    return lines
@@ -0,0 +1,137 @@
+import struct
+from typing import List
+
+import numpy as np
+
+from src.layout import Slot
+
+# One record per PILS device of a unit, packed and little endian. Records
+# are stored in PILS index order, so device n is record n - 1.
+MEMORY_MAP_DTYPE = np.dtype([
+    ('index', '<u2'),      # PILS device number, the position in astDevices
+    ('type_code', '<u2'),  # PILS type code, e.g. 0x5010
+    ('offset', '<u4'),     # %MB offset
+    ('length', '<u2'),     # size in bytes
+    ('alignment', '<u1'),  # byte alignment
+    ('unit_code', '<u2'),  # nUnit, 0 if the device has none
+    ('mc_unit', '<u2'),    # motion control unit
+    ('kind', 'S10'),       # motor, pneumatic, temp, extra, sensor, pressure, ptp or cabinet
+    ('name', 'S40'),       # sName in astDevices
+    ('variable', 'S40'),   # name of the GVL variable
+])
+
+# Header of a records file: magic, format version, record size and record count
+RECORDS_MAGIC = b'PILSMAP\0'
+RECORDS_VERSION = 1
+RECORDS_HEADER = struct.Struct('<8sHHI')
+
+# File suffix of every memory map format
+MEMORY_MAP_FORMATS = {
+    'records': 'pilsmap',
+    'parquet': 'parquet',
+    'arrow': 'arrow',
+}
+
+
+def _code(value: str) -> int:
+    # PILS codes are hexadecimal, written '1A04' or '16#FD04'
+    return int(value.split('#')[-1], 16)
+
+
+def _text(value, field: str) -> bytes:
+    # Converted like the astDevices table does, so a missing or numeric name reads 'nan' or '42' in both
+    encoded = str(value).encode('utf-8')
+    size = MEMORY_MAP_DTYPE[field].itemsize
+    if len(encoded) > size:
+        raise ValueError(f"The {field} '{value}' is longer than the {size} bytes of the memory map")
+    return encoded
+
+
+def memory_map_records(slots: List[Slot], mc_unit: int) -> np.ndarray:
+    """
+    Converts the memory map of a unit into fixed-width records.
+
+    :param slots: The slots returned by build_layout.
+    :param mc_unit: The motion control unit of the slots.
+    :return: A structured array of MEMORY_MAP_DTYPE, in PILS index order.
+    """
+    records = np.zeros(len(slots), dtype=MEMORY_MAP_DTYPE)
+    for i, slot in enumerate(sorted(slots, key=lambda slot: slot.index)):
+        unit_code = dict(slot.fields).get('nUnit')
+        records[i] = (slot.index, _code(slot.device_type), slot.offset, slot.length, slot.alignment,
+                      _code(unit_code) if unit_code else 0, mc_unit, _text(slot.kind, 'kind'),
+                      _text(slot.name, 'name'), _text(slot.variable, 'variable'))
+    return records
+
+
+def render_records(records: np.ndarray) -> bytes:
+    """
+    Renders memory map records as a records file: a RECORDS_HEADER followed by the packed records.
+    """
+    header = RECORDS_HEADER.pack(RECORDS_MAGIC, RECORDS_VERSION, MEMORY_MAP_DTYPE.itemsize, len(records))
+    return header + records.tobytes()
+
+
+def read_records(path: str) -> np.ndarray:
+    """
+    Maps a records file into memory without reading it.
+
+    Device n of the unit is record n - 1, e.g. read_records(path)[n - 1]['offset'].
+
+    :param path: The path of the records file.
+    :return: A read-only structured array of MEMORY_MAP_DTYPE.
+    """
+    with open(path, 'rb') as file:
+        header = file.read(RECORDS_HEADER.size)
+    if len(header) < RECORDS_HEADER.size:
+        raise ValueError(f"{path} is not a PILS memory map")
+    magic, version, record_size, count = RECORDS_HEADER.unpack(header)
+    if magic != RECORDS_MAGIC or version != RECORDS_VERSION or record_size != MEMORY_MAP_DTYPE.itemsize:
+        raise ValueError(f"{path} is not a version {RECORDS_VERSION} PILS memory map")
+    if count == 0:
+        return np.zeros(0, dtype=MEMORY_MAP_DTYPE)
+    return np.memmap(path, dtype=MEMORY_MAP_DTYPE, mode='r', offset=RECORDS_HEADER.size, shape=(count,))
+
+
+def memory_map_table(records: np.ndarray):
+    """
+    Converts memory map records into an Arrow table with the same columns.
+
+    :param records: The records returned by memory_map_records.
+    :return: A pyarrow Table.
+    """
+    import pyarrow as pa
+
+    columns = {}
+    for field in MEMORY_MAP_DTYPE.names:
+        if MEMORY_MAP_DTYPE[field].kind == 'S':
+            columns[field] = pa.array([value.decode('utf-8') for value in records[field]], pa.string())
+        else:
+            columns[field] = pa.array(records[field])
+    return pa.table(columns)
+
+
+def render_memory_map(records: np.ndarray, memory_map_format: str) -> bytes:
+    """
+    Renders memory map records in one of MEMORY_MAP_FORMATS.
+
+    :param records: The records returned by memory_map_records.
+    :param memory_map_format: 'records', 'parquet' or 'arrow' (the Arrow IPC file format).
+    :return: The file content.
+    """
+    if memory_map_format == 'records':
+        return render_records(records)
+
+    import pyarrow as pa
+
+    table = memory_map_table(records)
+    buffer = pa.BufferOutputStream()
+    if memory_map_format == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table, buffer)
+    elif memory_map_format == 'arrow':
+        with pa.ipc.new_file(buffer, table.schema) as writer:
+            writer.write_table(table)
+    else:
+        raise ValueError(f"Unknown memory map format {memory_map_format}")
+    return buffer.getvalue().to_pybytes()
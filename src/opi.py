@@ -0,0 +1,41 @@
+import os
+from functools import lru_cache
+from typing import TextIO
+
+from src.template import Template
+
+OPI_TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), 'base_motor.mid')
+
+
+@lru_cache(maxsize=None)
+def opi_template() -> Template:
+    """
+    Returns the motor OPI template, loaded and tokenised once per process.
+    """
+    return Template.from_file(OPI_TEMPLATE_PATH)
+
+
+def write_opi(file: TextIO, device_collection, mc_unit) -> None:
+    """
+    Streams the OPI css (mid) of one motion control unit to a file handle.
+
+    :param file: The file handle to write to.
+    :param device_collection: The devices of the instrument.
+    :param mc_unit: The motion control unit to render.
+    """
+    devices = [device for device in device_collection.devices_by_unit[mc_unit] if device.mc_axis_nc is not None]
+    instrument = device_collection.instrument.upper()
+
+    names = [
+        f"{device.pv_name}:Mtr" if device.pv_name is not None
+        else f"{device_collection.format_spare_motor(mc_unit, idx)}:Mtr"
+        for idx, device in enumerate(devices, start=1)
+    ]
+    macros = [
+        f'<PREFIX>{instrument}-MCS{mc_unit}:MC-MCU-0{mc_unit}:</PREFIX>',
+        f'<P>{instrument}-</P>'
+    ]
+    macros.extend(f'<M{idx}>{name}</M{idx}>' for idx, name in enumerate(names, start=1))
+    macros.extend(f'<R{idx}>{name}-</R{idx}>' for idx, name in enumerate(names, start=1))
+
+    opi_template().write(file, MACROS=macros, NUM_DEVS=len(devices), MCU_NAME=f"{instrument}-MCS{mc_unit}")
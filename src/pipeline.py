@@ -0,0 +1,506 @@
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import pandas as pd
+
+from src import timing
+from src.allocation import (
+    ALLOCATION_FILE_NAME, AllocationOptions, StableAllocation, dump_allocation, load_allocation, unit_allocation,
+    write_allocation_file
+)
+from src.cache import SheetCache
+from src.device import DeviceCollection
+from src.layout import SYSTEM_KINDS, LayoutOptions, build_layout, image_size
+from src.incremental import MANIFEST_FILE_NAME, dump_manifest, plan_units
+from src.poll_budget import POLL_LOAD_FILE_NAME, PollBudget, format_poll_load, plan_poll_periods, render_poll_load
+from src.read_blocks import ReadBlockOptions
+from src.reader import ExcelReader, COLUMNS_INDEX
+from src.sinks import DirectorySink, OutputSink
+
+# Readers opened by a worker process, so a worker handling several sheets
+# of the same workbook parses it only once.
+_worker_readers: Dict[str, ExcelReader] = {}
+
+# The instrument whose units a worker process renders, set once per worker
+# by the pool initializer instead of being pickled with every unit
+_worker_collection: Optional[DeviceCollection] = None
+
+
+def parallel_map(func: Callable, items: Iterable, jobs: int = 1, initializer: Optional[Callable] = None,
+                 initargs: Tuple = ()) -> List:
+    """
+    Maps a function over items, in a process pool if more than one job is requested.
+
+    The results are always returned in the order of the items, so the output
+    of a parallel run is identical to the serial one.
+
+    :param func: A picklable, module level function.
+    :param items: The items to map over.
+    :param jobs: The number of worker processes; 0 uses every core, 1 runs serially.
+    :param initializer: Called with initargs once in every worker process, not when running serially.
+    :param initargs: The arguments of the initializer, pickled once per worker.
+    :return: The list of results.
+    """
+    items = list(items)
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+    jobs = min(jobs, len(items))
+    if jobs <= 1:
+        return [func(item) for item in items]
+
+    timings = timing.active()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=initializer, initargs=initargs) as executor:
+        if timings is None:
+            return list(executor.map(func, items))
+
+        # Collect the timings of the workers too
+        results = []
+        for result, worker_timings in executor.map(partial(timing.call_timed, func), items):
+            timings.merge(worker_timings)
+            results.append(result)
+        return results
+
+
+def build_collection(df: pd.DataFrame, instrument_name: str) -> DeviceCollection:
+    """
+    Creates a DeviceCollection and populates it from a sheet DataFrame.
+
+    :param df: The DataFrame returned by ExcelReader.read_sheet_by_index.
+    :param instrument_name: The name of the instrument the sheet describes.
+    :return: The populated DeviceCollection.
+    """
+    device_collection = DeviceCollection(instrument_name)
+    device_collection.from_dataframe(df)
+    return device_collection
+
+
+def read_collection(excel_reader: ExcelReader, sheet_index: int, stream: bool = False) -> DeviceCollection:
+    """
+    Reads one sheet into a populated DeviceCollection.
+
+    :param excel_reader: The reader of the workbook.
+    :param sheet_index: The index of the sheet to read.
+    :param stream: Stream the rows into the collection instead of reading the
+                   sheet as a DataFrame, which bypasses the parsed-sheet cache.
+    :return: The populated DeviceCollection.
+    """
+    if not stream:
+        return build_collection(*excel_reader.read_sheet_by_index(sheet_index, COLUMNS_INDEX))
+
+    instrument_name, rows = excel_reader.read_sheet_rows(sheet_index, COLUMNS_INDEX)
+    device_collection = DeviceCollection(instrument_name)
+    device_collection.from_records(rows)
+    return device_collection
+
+
+def unit_file_names(device_collection: DeviceCollection, mc_unit: int, pils: bool = False, ioc: bool = False,
+                    opi: bool = False, memory_maps: Sequence[str] = (), read_blocks: Optional[ReadBlockOptions] = None,
+                    **_) -> List[str]:
+    """
+    Returns the names of the files one motion control unit produces.
+    """
+    file_names = []
+    if pils:
+        file_names.append(device_collection.xml_file_name(mc_unit))
+    if ioc:
+        file_names.append(device_collection.st_cmd_file_name(mc_unit))
+    if opi:
+        file_names.append(device_collection.opi_file_name(mc_unit))
+    for memory_map_format in memory_maps:
+        file_names.append(device_collection.memory_map_file_name(mc_unit, memory_map_format))
+    if read_blocks is not None:
+        file_names.append(device_collection.read_blocks_file_name(mc_unit))
+    return file_names
+
+
+def content_size(content: Union[str, bytes]) -> int:
+    """
+    Returns the size in bytes of a rendered file.
+    """
+    return len(content) if isinstance(content, bytes) else len(content.encode('utf-8'))
+
+
+def render_unit(device_collection: DeviceCollection, mc_unit: int, pils: bool = False, ioc: bool = False,
+                opi: bool = False, ioc_ip: Optional[str] = None, plc_ip: Optional[str] = None,
+                memory_maps: Sequence[str] = (),
+                read_blocks: Optional[ReadBlockOptions] = None) -> List[Tuple[str, Union[str, bytes]]]:
+    """
+    Renders the requested output files of one motion control unit.
+
+    :param device_collection: The devices of the instrument.
+    :param mc_unit: The motion control unit to render.
+    :param memory_maps: The formats of the memory map files, see MEMORY_MAP_FORMATS.
+    :param read_blocks: Plan the ADS read blocks with these limits, written next to the st.cmd and
+                        set as its environment variables.
+    :return: A list of (file name, content) tuples; memory maps are bytes.
+    """
+    files = []
+    if pils:
+        with timing.stage('render_pils'):
+            files.append((device_collection.xml_file_name(mc_unit), device_collection.render_xml(mc_unit)))
+    if ioc:
+        with timing.stage('render_ioc'):
+            files.append((device_collection.st_cmd_file_name(mc_unit),
+                          device_collection.render_st_cmd(mc_unit, ioc_ip, plc_ip, read_blocks)))
+    if opi:
+        with timing.stage('render_opi'):
+            files.append((device_collection.opi_file_name(mc_unit), device_collection.render_opi(mc_unit)))
+    if read_blocks is not None:
+        with timing.stage('render_read_blocks'):
+            files.append((device_collection.read_blocks_file_name(mc_unit),
+                          device_collection.render_read_blocks(mc_unit, read_blocks)))
+    if memory_maps:
+        with timing.stage('render_memory_map'):
+            for memory_map_format in memory_maps:
+                files.append((device_collection.memory_map_file_name(mc_unit, memory_map_format),
+                              device_collection.render_memory_map(mc_unit, memory_map_format)))
+    if timing.active() is not None:
+        timing.count_unit(device_collection.instrument, mc_unit, len(files),
+                          sum(content_size(content) for _, content in files))
+    return files
+
+
+def render_collection(device_collection: DeviceCollection, jobs: int = 1, units: Optional[List] = None,
+                      **outputs) -> List[Tuple[str, str]]:
+    """
+    Renders the requested output files of the motion control units of an instrument.
+
+    :param device_collection: The devices of the instrument.
+    :param jobs: The number of worker processes the units are spread over.
+    :param units: The units to render, all units if None.
+    :param outputs: Keyword arguments passed on to render_unit.
+    :return: A list of (file name, content) tuples, in unit order.
+    """
+    if units is None:
+        units = list(device_collection.devices_by_unit)
+    if jobs == 1 or len(units) <= 1:
+        results = [render_unit(device_collection, mc_unit, **outputs) for mc_unit in units]
+    else:
+        # The collection is sent to every worker once, only the unit numbers per task
+        results = parallel_map(partial(_render_worker_unit, **outputs), units, jobs,
+                               initializer=_set_worker_collection, initargs=(device_collection,))
+    files = []
+    for unit_files in results:
+        files.extend(unit_files)
+    return files
+
+
+def _set_worker_collection(device_collection: DeviceCollection) -> None:
+    global _worker_collection
+    _worker_collection = device_collection
+
+
+def _render_worker_unit(mc_unit, **outputs) -> List[Tuple[str, Union[str, bytes]]]:
+    return render_unit(_worker_collection, mc_unit, **outputs)
+
+
+def render_instrument(device_collection: DeviceCollection, output_dir: str = '.', jobs: int = 1,
+                      incremental: bool = False, layout: Optional[LayoutOptions] = None,
+                      allocation: Optional[AllocationOptions] = None, poll_budget: Optional[PollBudget] = None,
+                      previous_manifest: Optional[Dict] = None,
+                      **outputs) -> Tuple[List[Tuple[str, str]], Optional[Dict]]:
+    """
+    Renders the output files of one instrument.
+
+    In incremental mode only the units whose inputs changed since the
+    manifest in output_dir was written are rendered. With an allocation the
+    devices keep the offsets of the previous generation in output_dir, and
+    the allocation file is rendered as well. With a poll budget the poll
+    periods of the st.cmd files are picked for it, and the poll load file
+    is rendered as well.
+
+    :param device_collection: The devices of the instrument.
+    :param output_dir: The directory the files will be written to.
+    :param jobs: The number of worker processes the units are spread over.
+    :param incremental: Skip units that are unchanged since the last run.
+    :param layout: How the memory maps are laid out, e.g. packed.
+    :param allocation: Keep the offsets of the previous generation, see src.allocation.
+    :param poll_budget: Pick the poll periods of the units for this budget, see src.poll_budget.
+    :param previous_manifest: Plan the units against this manifest instead of the one in output_dir; implies
+                              incremental.
+    :param outputs: Keyword arguments passed on to render_unit.
+    :return: The rendered (file name, content) tuples and, in incremental mode, the new manifest.
+    """
+    options = outputs
+    if layout is not None:
+        device_collection.layout_options = layout
+        options = dict(options, layout=layout._replace(report=False)._asdict())
+    if allocation is not None:
+        device_collection.allocation = StableAllocation(load_allocation(device_collection, output_dir, allocation),
+                                                        allocation)
+        options = dict(options, allocation=allocation._asdict())
+        report_ignored_headroom(device_collection)
+    if layout is not None and layout.report:
+        report_packing(device_collection)
+    poll_plan = None
+    if poll_budget is not None:
+        cycles = {str(mc_unit): device_collection.poll_cycle(mc_unit, outputs.get('read_blocks'))
+                  for mc_unit in device_collection.devices_by_unit}
+        poll_plan = plan_poll_periods(cycles, poll_budget)
+        device_collection.poll_periods = {mc_unit: (load.moving_period, load.idle_period)
+                                          for mc_unit, load in poll_plan.items()}
+        # The periods of a unit depend on the other units, so they are part of the fingerprint
+        options = dict(options, poll_budget=poll_budget._replace(report=False)._asdict(),
+                       poll_periods=device_collection.poll_periods)
+        if poll_budget.report:
+            sys.stderr.write(format_poll_load(device_collection.instrument, poll_plan, poll_budget,
+                                              outputs.get('ioc_ip'), outputs.get('plc_ip')))
+
+    units = None
+    manifest = None
+    if incremental or previous_manifest is not None:
+        unit_files = {mc_unit: unit_file_names(device_collection, mc_unit, **outputs)
+                      for mc_unit in device_collection.devices_by_unit}
+        units, manifest = plan_units(device_collection, output_dir, unit_files, options, previous_manifest)
+    files = render_collection(device_collection, jobs=jobs, units=units, **outputs)
+
+    if allocation is not None:
+        allocations = {mc_unit: unit_allocation(device_collection.layout(mc_unit))
+                       for mc_unit in device_collection.devices_by_unit}
+        files.append((ALLOCATION_FILE_NAME, dump_allocation(device_collection.instrument, allocations)))
+    if poll_plan is not None:
+        files.append((POLL_LOAD_FILE_NAME, render_poll_load(device_collection.instrument, poll_plan, poll_budget,
+                                                            outputs.get('ioc_ip'), outputs.get('plc_ip'))))
+    return files, manifest
+
+
+def report_packing(device_collection: DeviceCollection) -> None:
+    """
+    Prints the process image size of every unit of an instrument before and
+    after packing, and the bytes of padding saved.
+    """
+    for mc_unit, devices in device_collection.devices_by_unit.items():
+        before = image_size(build_layout(devices))
+        after = image_size(device_collection.layout(mc_unit))
+        print(f"{device_collection.instrument} unit {mc_unit}: {before} -> {after} bytes, "
+              f"{before - after} bytes saved", file=sys.stderr)
+
+
+def report_ignored_headroom(device_collection: DeviceCollection) -> None:
+    """
+    Warns about the units of an instrument whose headroom could not be
+    reserved, because their system block keeps its previous offset.
+    """
+    for mc_unit in device_collection.devices_by_unit:
+        slots = device_collection.layout(mc_unit)
+        if device_collection.allocation.headroom_ignored(mc_unit, slots):
+            system_offset = min(slot.offset for slot in slots if slot.kind in ('ptp',) + SYSTEM_KINDS)
+            print(f"{device_collection.instrument} unit {mc_unit}: headroom ignored, the system block keeps "
+                  f"its previous offset %MB{system_offset}", file=sys.stderr)
+
+
+def resolve_sink(sink: Optional[OutputSink], output_dir: str, incremental: bool) -> Tuple[OutputSink, str]:
+    """
+    Picks the sink of a run, and the directory incremental runs compare against.
+
+    :param sink: The sink requested by the caller, if any.
+    :param output_dir: The directory written to when no sink is given.
+    :param incremental: Whether the run is incremental, which needs a directory.
+    :return: The sink and the output directory.
+    """
+    if sink is None:
+        sink = DirectorySink(output_dir)
+    if isinstance(sink, DirectorySink):
+        return sink, sink.path
+    if incremental:
+        raise ValueError("Incremental generation needs a directory output.")
+    return sink, output_dir
+
+
+def write_files(sink: OutputSink, files: List[Tuple[str, Union[str, bytes]]], manifest: Optional[Dict] = None,
+                directory: str = '') -> None:
+    """
+    Writes rendered files to a sink.
+
+    :param sink: The sink the files are written to.
+    :param files: A list of (file name, content) tuples.
+    :param manifest: The manifest to write after the files, if any.
+    :param directory: The sub-directory of the sink the files go to.
+    """
+    prefix = f"{directory}/" if directory else ''
+    timings = timing.active()
+    with timing.stage('write'):
+        for file_name, content in files:
+            written = sink.write(prefix + file_name, content)
+            if timings is not None:
+                if written:
+                    timings.count('files_written')
+                    timings.count('bytes_written', content_size(content))
+                else:
+                    timings.count('files_unchanged')
+        if manifest is not None:
+            sink.write(prefix + MANIFEST_FILE_NAME, dump_manifest(manifest))
+
+
+def update_allocation_file(allocation: Optional[AllocationOptions],
+                           instrument_files: Iterable[List[Tuple[str, Union[str, bytes]]]]) -> None:
+    """
+    Writes the allocations rendered by render_instrument back to the allocation file of the options, if any,
+    so the next run reads the offsets of this one.
+
+    :param allocation: The allocation options of the run.
+    :param instrument_files: The rendered files of every instrument.
+    """
+    if allocation is None or not allocation.allocation_file:
+        return
+    write_allocation_file(allocation.allocation_file, [content for files in instrument_files
+                                                       for file_name, content in files
+                                                       if file_name == ALLOCATION_FILE_NAME])
+
+
+def generate_outputs(device_collection: DeviceCollection, output_dir: str = '.', pils: bool = False,
+                     ioc: bool = False, opi: bool = False, ioc_ip: Optional[str] = None,
+                     plc_ip: Optional[str] = None, memory_maps: Sequence[str] = (),
+                     read_blocks: Optional[ReadBlockOptions] = None, jobs: int = 1,
+                     incremental: bool = False, sink: Optional[OutputSink] = None,
+                     layout: Optional[LayoutOptions] = None, allocation: Optional[AllocationOptions] = None,
+                     poll_budget: Optional[PollBudget] = None) -> None:
+    """
+    Writes the requested output files of one instrument.
+
+    :param device_collection: The devices of the instrument.
+    :param output_dir: The directory the files are written to, created if missing, unless a sink is given.
+    :param pils: Generate the PILS tables (TcGVL).
+    :param ioc: Generate the IOC st.cmd files (iocsh).
+    :param opi: Generate the OPI css files (mid).
+    :param ioc_ip: IP address of the IOC, required for ioc.
+    :param plc_ip: IP address of the PLC, required for ioc.
+    :param memory_maps: The formats of the memory map files to generate, see MEMORY_MAP_FORMATS.
+    :param read_blocks: Plan the ADS read blocks of every unit with these limits.
+    :param jobs: The number of worker processes the units are spread over.
+    :param incremental: Only regenerate units that changed since the last run.
+    :param sink: The sink the files are written to instead of output_dir.
+    :param layout: How the memory maps are laid out, e.g. packed.
+    :param allocation: Keep the offsets of the previous generation, see src.allocation.
+    :param poll_budget: Pick the poll periods of the units for this budget, see src.poll_budget.
+    """
+    sink, output_dir = resolve_sink(sink, output_dir, incremental)
+    outputs = dict(pils=pils, ioc=ioc, opi=opi, ioc_ip=ioc_ip, plc_ip=plc_ip)
+    # Only part of the options when asked for, so the fingerprints of existing manifests stay valid
+    if memory_maps:
+        outputs['memory_maps'] = list(memory_maps)
+    if read_blocks is not None:
+        outputs['read_blocks'] = read_blocks
+    files, manifest = render_instrument(device_collection, output_dir, jobs=jobs, incremental=incremental,
+                                        layout=layout, allocation=allocation, poll_budget=poll_budget,
+                                        **outputs)
+    write_files(sink, files, manifest)
+    update_allocation_file(allocation, [files])
+
+
+def instrument_directory(instrument_name: str) -> str:
+    """
+    Returns the name of the sub-directory used for one instrument in batch mode.
+    """
+    return str(instrument_name).lower()
+
+
+def instrument_output_dir(output_dir: str, instrument_name: str) -> str:
+    """
+    Returns the directory used for one instrument in batch mode.
+
+    :param output_dir: The base output directory.
+    :param instrument_name: The name of the instrument.
+    :return: The per-instrument output directory.
+    """
+    return os.path.join(output_dir, instrument_directory(instrument_name))
+
+
+def check_instrument_directories(instruments: Iterable[Tuple[int, str]]) -> None:
+    """
+    Makes sure no two sheets write into the same per-instrument directory.
+
+    :param instruments: (sheet index, instrument name) tuples.
+    """
+    used_dirs = {}
+    for sheet_index, instrument_name in instruments:
+        instrument_dir = instrument_directory(instrument_name)
+        if instrument_dir in used_dirs:
+            raise ValueError(f"Sheets {used_dirs[instrument_dir]} and {sheet_index} "
+                             f"both describe instrument '{instrument_name}'.")
+        used_dirs[instrument_dir] = sheet_index
+
+
+def render_sheet(file_path: str, sheet_index: int, output_dir: str = '.', incremental: bool = False,
+                 cache: Optional[SheetCache] = None, stream: bool = False,
+                 layout: Optional[LayoutOptions] = None, allocation: Optional[AllocationOptions] = None,
+                 poll_budget: Optional[PollBudget] = None,
+                 **outputs) -> Tuple[str, List[Tuple[str, str]], Optional[Dict]]:
+    """
+    Reads one sheet and renders its output files; the unit of work of a parallel batch run.
+
+    :param file_path: The path to the Excel file.
+    :param sheet_index: The index of the sheet to render.
+    :param output_dir: The base output directory.
+    :param incremental: Skip units that are unchanged since the last run.
+    :param cache: The sheet cache of the parent process's reader, if any.
+    :param stream: Stream the rows of the sheet instead of reading it as a DataFrame.
+    :param layout: How the memory maps are laid out, e.g. packed.
+    :param allocation: Keep the offsets of the previous generation, see src.allocation.
+    :param poll_budget: Pick the poll periods of the units for this budget, see src.poll_budget.
+    :param outputs: Keyword arguments passed on to render_unit.
+    :return: The instrument name, a list of (file name, content) tuples and the manifest.
+    """
+    if file_path not in _worker_readers:
+        _worker_readers[file_path] = ExcelReader(file_path, cache=cache)
+    device_collection = read_collection(_worker_readers[file_path], sheet_index, stream)
+    instrument_name = device_collection.instrument
+    files, manifest = render_instrument(device_collection, instrument_output_dir(output_dir, instrument_name),
+                                        incremental=incremental, layout=layout, allocation=allocation,
+                                        poll_budget=poll_budget, **outputs)
+    return instrument_name, files, manifest
+
+
+def generate_sheets(excel_reader: ExcelReader, sheet_indices: List[int], output_dir: str = '.',
+                    jobs: int = 1, incremental: bool = False, sink: Optional[OutputSink] = None,
+                    stream: bool = False, layout: Optional[LayoutOptions] = None,
+                    allocation: Optional[AllocationOptions] = None, poll_budget: Optional[PollBudget] = None,
+                    **outputs) -> List[str]:
+    """
+    Generates the outputs of several instrument sheets of one workbook.
+
+    Serially, the workbook is parsed once by the reader. With several jobs
+    the sheets are spread over worker processes, each parsing the workbook
+    at most once. Either way every sheet writes into its own per-instrument
+    directory, and the files written are identical.
+
+    :param excel_reader: The reader of the workbook.
+    :param sheet_indices: The indices of the sheets to generate.
+    :param output_dir: The base output directory.
+    :param jobs: The number of worker processes; 0 uses every core.
+    :param incremental: Only regenerate units that changed since the last run.
+    :param sink: The sink the files are written to instead of output_dir.
+    :param stream: Stream the rows of the sheets instead of reading them as DataFrames.
+    :param layout: How the memory maps are laid out, e.g. packed.
+    :param allocation: Keep the offsets of the previous generation, see src.allocation.
+    :param poll_budget: Pick the poll periods of the units for this budget, see src.poll_budget.
+    :param outputs: Keyword arguments passed on to render_unit.
+    :return: The instrument name of each sheet, in sheet order.
+    """
+    sink, output_dir = resolve_sink(sink, output_dir, incremental)
+    if jobs == 1 or len(sheet_indices) <= 1:
+        sheets = []
+        for sheet_index in sheet_indices:
+            device_collection = read_collection(excel_reader, sheet_index, stream)
+            instrument_name = device_collection.instrument
+            files, manifest = render_instrument(device_collection, instrument_output_dir(output_dir, instrument_name),
+                                                jobs=jobs, incremental=incremental, layout=layout,
+                                                allocation=allocation, poll_budget=poll_budget, **outputs)
+            sheets.append((instrument_name, files, manifest))
+    else:
+        render = partial(render_sheet, excel_reader.file_path, output_dir=output_dir, incremental=incremental,
+                         cache=excel_reader.cache, stream=stream, layout=layout, allocation=allocation,
+                         poll_budget=poll_budget, **outputs)
+        sheets = parallel_map(render, sheet_indices, jobs)
+
+    check_instrument_directories((sheet_index, instrument_name)
+                                 for sheet_index, (instrument_name, _, _) in zip(sheet_indices, sheets))
+
+    for instrument_name, files, manifest in sheets:
+        write_files(sink, files, manifest, directory=instrument_directory(instrument_name))
+    update_allocation_file(allocation, [files for _, files, _ in sheets])
+
+    return [instrument_name for instrument_name, _, _ in sheets]
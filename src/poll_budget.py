@@ -0,0 +1,190 @@
+import json
+import math
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from src.layout import Slot
+from src.read_blocks import POLL_CLASSES, ReadBlockOptions, plan_read_blocks
+
+# The poll budget of every instrument, written next to the generated files
+POLL_LOAD_FILE_NAME = 'poll-load.json'
+
+# The poll period of every unit without a budget, in ms
+DEFAULT_POLL_PERIOD = 200
+
+# Poll periods are whole multiples of this many ms
+PERIOD_STEP = 10
+
+# The load one IOC host may put on its PLCs by default
+DEFAULT_BANDWIDTH = 1000000   # bytes/s
+DEFAULT_REQUESTS = 2000       # ADS requests/s
+
+# Bytes on the wire per ADS read besides the data: the AMS/TCP (6), AMS (32)
+# and ADS read request (12) headers sent, and the AMS/TCP, AMS and ADS read
+# response (8) headers received
+REQUEST_OVERHEAD = 50 + 46
+
+
+class PollBudget(NamedTuple):
+    """
+    The latency targets and the load limits the poll periods are picked for.
+    """
+    latency: int = DEFAULT_POLL_PERIOD            # ms a moving axis may go unpolled
+    idle_latency: int = DEFAULT_POLL_PERIOD       # ms the cold slots may go unpolled
+    unit_latency: Optional[Dict[str, int]] = None  # latency of single units, by unit
+    bandwidth: int = DEFAULT_BANDWIDTH            # bytes/s the units of an IOC host may read
+    requests: int = DEFAULT_REQUESTS              # ADS requests/s the units of an IOC host may issue
+    report: bool = False                          # print the load of every unit
+
+    def latency_of(self, mc_unit) -> int:
+        return (self.unit_latency or {}).get(str(mc_unit), self.latency)
+
+
+class PollCycle(NamedTuple):
+    """
+    What one poll of a unit reads, per poll class.
+    """
+    hot_requests: int
+    hot_bytes: int
+    cold_requests: int
+    cold_bytes: int
+
+
+class UnitLoad(NamedTuple):
+    """
+    The poll periods picked for one unit and the load they cause.
+    """
+    mc_unit: str
+    moving_period: int   # ms
+    idle_period: int     # ms
+    requests: float      # ADS requests/s while an axis moves
+    bandwidth: float     # bytes/s while an axis moves
+    latency_met: bool
+
+
+def poll_cycle(slots: List[Slot], read_blocks: Optional[ReadBlockOptions] = None) -> PollCycle:
+    """
+    Counts the ADS reads of one poll of a unit.
+
+    Without a read plan the IOC reads every slot on its own; with one it
+    reads the planned blocks, see src.read_blocks.
+
+    :param slots: The memory map of a unit.
+    :param read_blocks: The limits of the read plan, if the IOC uses one.
+    :return: The requests and the bytes on the wire of one poll, per poll class.
+    """
+    if read_blocks is None:
+        reads = [(POLL_CLASSES[slot.kind], slot.length) for slot in slots]
+    else:
+        reads = [(block.poll_class, block.length) for block in plan_read_blocks(slots, read_blocks)]
+    counts = {'hot': [0, 0], 'cold': [0, 0]}
+    for poll_class, length in reads:
+        counts[poll_class][0] += 1
+        counts[poll_class][1] += length + REQUEST_OVERHEAD
+    return PollCycle(*counts['hot'], *counts['cold'])
+
+
+def unit_load(cycle: PollCycle, moving_period: int, idle_period: int) -> Tuple[float, float]:
+    """
+    Estimates the load of a unit while an axis moves, its busiest state: the
+    hot slots are read every moving period, the cold ones every idle period.
+
+    :return: The ADS requests/s and the bytes/s.
+    """
+    requests = cycle.hot_requests * 1000 / moving_period + cycle.cold_requests * 1000 / idle_period
+    bandwidth = cycle.hot_bytes * 1000 / moving_period + cycle.cold_bytes * 1000 / idle_period
+    return requests, bandwidth
+
+
+def _period_within(latency: int) -> int:
+    return max(PERIOD_STEP, latency // PERIOD_STEP * PERIOD_STEP)
+
+
+def _period_above(period: float) -> int:
+    return math.ceil(period / PERIOD_STEP) * PERIOD_STEP
+
+
+def plan_poll_periods(cycles: Dict[str, PollCycle], budget: PollBudget = PollBudget()) -> Dict[str, UnitLoad]:
+    """
+    Picks the poll periods of the units served by one IOC host.
+
+    Every unit is polled as slowly as its latency target allows, which
+    causes the least load meeting the targets. If the units together still
+    exceed the bandwidth or request budget, all their periods are stretched
+    by the same factor until they fit, and the latency targets are missed.
+
+    :param cycles: The poll cycle of every unit, by unit.
+    :param budget: The latency targets and load limits.
+    :return: The periods and load of every unit, by unit.
+    """
+    periods = {mc_unit: (_period_within(budget.latency_of(mc_unit)), _period_within(budget.idle_latency))
+               for mc_unit in cycles}
+    loads = [unit_load(cycles[mc_unit], *periods[mc_unit]) for mc_unit in cycles]
+    scale = max(1.0, sum(requests for requests, _ in loads) / budget.requests,
+                sum(bandwidth for _, bandwidth in loads) / budget.bandwidth)
+    if scale > 1:
+        periods = {mc_unit: (_period_above(moving * scale), _period_above(idle * scale))
+                   for mc_unit, (moving, idle) in periods.items()}
+
+    plan = {}
+    for mc_unit, (moving, idle) in periods.items():
+        requests, bandwidth = unit_load(cycles[mc_unit], moving, idle)
+        latency_met = moving <= budget.latency_of(mc_unit) and idle <= budget.idle_latency
+        plan[mc_unit] = UnitLoad(str(mc_unit), moving, idle, requests, bandwidth, latency_met)
+    return plan
+
+
+def format_poll_load(instrument: str, plan: Dict[str, UnitLoad], budget: PollBudget,
+                     ioc_ip: Optional[str] = None, plc_ip: Optional[str] = None) -> str:
+    """
+    Formats the load of every PLC of an instrument and the total of its IOC host.
+    """
+    lines = []
+    for load in plan.values():
+        note = '' if load.latency_met else ', latency target missed'
+        lines.append(f"{instrument} PLC MCS{load.mc_unit} ({plc_ip}): moving {load.moving_period} ms, "
+                     f"idle {load.idle_period} ms, {load.requests:.0f} requests/s, "
+                     f"{load.bandwidth:.0f} bytes/s{note}\n")
+    lines.append(f"{instrument} IOC {ioc_ip}: {sum(load.requests for load in plan.values()):.0f} "
+                 f"of {budget.requests} requests/s, {sum(load.bandwidth for load in plan.values()):.0f} "
+                 f"of {budget.bandwidth} bytes/s\n")
+    return ''.join(lines)
+
+
+def render_poll_load(instrument: str, plan: Dict[str, UnitLoad], budget: PollBudget,
+                     ioc_ip: Optional[str] = None, plc_ip: Optional[str] = None) -> str:
+    """
+    Renders the poll periods and load of an instrument as JSON.
+
+    :param instrument: The instrument name.
+    :param plan: The plan returned by plan_poll_periods.
+    :param budget: The budget the plan was made for.
+    :param ioc_ip: IP address of the IOC host polling the units.
+    :param plc_ip: IP address of the PLCs.
+    :return: The JSON file content.
+    """
+    limits = budget._asdict()
+    del limits['report']
+    data = {
+        'instrument': str(instrument),
+        'budget': limits,
+        'plcs': {
+            f"MCS{mc_unit}": {
+                'plc_ip': plc_ip,
+                'moving_period': load.moving_period,
+                'idle_period': load.idle_period,
+                'requests_per_s': round(load.requests, 1),
+                'bytes_per_s': round(load.bandwidth, 1),
+                'latency_met': load.latency_met,
+            }
+            for mc_unit, load in plan.items()
+        },
+        'ioc_hosts': {
+            str(ioc_ip): {
+                'plcs': len(plan),
+                'requests_per_s': round(sum(load.requests for load in plan.values()), 1),
+                'bytes_per_s': round(sum(load.bandwidth for load in plan.values()), 1),
+                'latency_met': all(load.latency_met for load in plan.values()),
+            },
+        },
+    }
+    return json.dumps(data, indent=2) + '\n'
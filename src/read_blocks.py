@@ -0,0 +1,119 @@
+import json
+from typing import Dict, List, NamedTuple, Tuple
+
+from src.layout import Slot
+
+# How often the IOC needs each kind of slot: motors and shutters every
+# poll cycle, temperatures, extra devices and the system status rarely
+POLL_CLASSES = {
+    'motor': 'hot',
+    'pneumatic': 'hot',
+    'temp': 'cold',
+    'extra': 'cold',
+    'sensor': 'cold',
+    'pressure': 'cold',
+    'ptp': 'cold',
+    'cabinet': 'cold',
+}
+POLL_CLASS_ORDER = ('hot', 'cold')
+
+# The largest ADS read request planned, in bytes
+DEFAULT_MAX_BLOCK = 1024
+
+# Two slots of a class are read in one request if at most this many bytes
+# lie between them; about the AMS/TCP and ADS headers of another request
+DEFAULT_MAX_GAP = 64
+
+
+class ReadBlockOptions(NamedTuple):
+    """
+    The limits of the ADS read blocks.
+    """
+    max_block: int = DEFAULT_MAX_BLOCK
+    max_gap: int = DEFAULT_MAX_GAP
+
+
+class ReadBlock(NamedTuple):
+    """
+    One contiguous ADS read of the PILS image.
+    """
+    poll_class: str
+    offset: int                # first %MB offset read
+    length: int                # bytes read, gaps included
+    devices: Tuple[int, ...]   # PILS indices of the slots in the block, in memory order
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.length
+
+
+def plan_read_blocks(slots: List[Slot], options: ReadBlockOptions = ReadBlockOptions()) -> List[ReadBlock]:
+    """
+    Plans the fewest contiguous ADS reads that cover the slots of every poll class.
+
+    The slots of a class are taken in memory order and added to the current
+    block while the gap before them is at most max_gap and the block stays
+    within max_block bytes. The gap may hold slots of another class, which
+    are read along. A slot larger than max_block is a block of its own.
+
+    :param slots: The memory map of a unit.
+    :param options: The block limits.
+    :return: The blocks of every class in POLL_CLASS_ORDER, each in memory order.
+    """
+    blocks = []
+    for poll_class in POLL_CLASS_ORDER:
+        offset = end = None
+        devices = []
+        for slot in sorted((slot for slot in slots if POLL_CLASSES[slot.kind] == poll_class),
+                           key=lambda slot: slot.offset):
+            if devices and slot.offset - end <= options.max_gap and slot.end - offset <= options.max_block:
+                end = max(end, slot.end)
+                devices.append(slot.index)
+                continue
+            if devices:
+                blocks.append(ReadBlock(poll_class, offset, end - offset, tuple(devices)))
+            offset, end, devices = slot.offset, slot.end, [slot.index]
+        if devices:
+            blocks.append(ReadBlock(poll_class, offset, end - offset, tuple(devices)))
+    return blocks
+
+
+def blocks_by_class(blocks: List[ReadBlock]) -> Dict[str, List[ReadBlock]]:
+    return {poll_class: [block for block in blocks if block.poll_class == poll_class]
+            for poll_class in POLL_CLASS_ORDER}
+
+
+def format_blocks(blocks: List[ReadBlock]) -> str:
+    """
+    Formats read blocks for an IOC environment variable, e.g. '128:96,240:40'.
+    """
+    return ','.join(f"{block.offset}:{block.length}" for block in blocks)
+
+
+def render_read_blocks(instrument: str, mc_unit, blocks: List[ReadBlock],
+                       options: ReadBlockOptions = ReadBlockOptions()) -> str:
+    """
+    Renders the read plan of a unit as JSON.
+
+    :param instrument: The instrument name.
+    :param mc_unit: The motion control unit.
+    :param blocks: The blocks returned by plan_read_blocks.
+    :param options: The block limits the plan was made with.
+    :return: The JSON file content.
+    """
+    classes = {}
+    for poll_class, class_blocks in blocks_by_class(blocks).items():
+        classes[poll_class] = {
+            'requests': len(class_blocks),
+            'bytes': sum(block.length for block in class_blocks),
+            'blocks': [{'offset': block.offset, 'length': block.length, 'devices': list(block.devices)}
+                       for block in class_blocks],
+        }
+    data = {
+        'instrument': str(instrument),
+        'mc_unit': str(mc_unit),
+        'max_block': options.max_block,
+        'max_gap': options.max_gap,
+        'classes': classes,
+    }
+    return json.dumps(data, indent=2) + '\n'
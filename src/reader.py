@@ -1,5 +1,11 @@
+import fnmatch
+import sys
+
 import pandas as pd
-from typing import List, Tuple
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from src import timing
+from src.cache import SheetCache, file_digest
 
 
 # COL_NAMES = ["axis_description", "fbs_description", "pv_name", "mc_unit", "ptp", "mc_axis_nc", "mc_axis_pn", "pils_name", "pils_unit", "has_temp", "temp_units", "extra_dev", "extra_name", "extra_type", "extra_desc"]
@@ -28,6 +34,114 @@ COLUMN_INFO = [
 COLUMNS_INDEX = [info[0] for info in COLUMN_INFO]
 COL_NAMES = [info[1] for info in COLUMN_INFO]
 
+# Rows between the header and the first device, dropped after the fill-down
+PREAMBLE_ROWS = 5
+
+# Cell texts pandas reads as missing values by default
+NA_STRINGS = frozenset([
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN', '<NA>', 'N/A',
+    'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+])
+
+
+def cell_value(value: Any) -> Any:
+    """
+    Converts an openpyxl cell value the way pandas.read_excel does: missing
+    values become None and integral floats become ints.
+    """
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return None if value in NA_STRINGS else value
+    if isinstance(value, float):
+        if value != value:
+            return None
+        if value.is_integer():
+            return int(value)
+    return value
+
+
+def _is_unset(value: Any) -> bool:
+    # The fill-down treats 0 like a missing value
+    return value is None or value == 0
+
+
+def layout_problem(header: Sequence, width: Optional[int], columns: List[int]) -> Optional[str]:
+    """
+    Tells why a sheet does not have the layout of an instrument sheet.
+
+    An instrument sheet has the instrument name in its third header cell and
+    is wide enough for the columns read.
+
+    :param header: The header cells, empty cells as None.
+    :param width: The number of columns of the sheet, None to check the header only.
+    :param columns: The column indices read.
+    :return: The reason, or None if the sheet has the layout.
+    """
+    if len(header) < 3 or header[2] is None:
+        return "has no instrument name in its third header cell"
+    if width is not None and width <= max(columns):
+        return f"has {width} columns, but column {max(columns)} is read"
+    return None
+
+
+def _header_cells(sheet: pd.DataFrame) -> List[Any]:
+    # pandas names empty header cells 'Unnamed: <column>'
+    return [None if str(name).startswith('Unnamed: ') else name for name in sheet.columns]
+
+
+def process_rows(rows: Iterable[Sequence], columns: List[int],
+                 sheet_name: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+    """
+    Fills in and filters the data rows of a sheet one at a time.
+
+    This is the row by row equivalent of ExcelReader._process_sheet: mc_unit,
+    ptp and pv_root are filled down from the rows above, the preamble rows
+    take part in the fill-down but are dropped, as are rows without an axis,
+    and the nc and pn axes are derived from the actuator type. Missing values
+    are None. Like selecting the columns from a DataFrame, a sheet narrower
+    than the columns read is an error.
+
+    :param rows: The rows below the header, as converted by cell_value.
+    :param columns: The column indices of COL_NAMES in a row.
+    :param sheet_name: The name of the sheet, for the error message.
+    :return: An iterator of dicts with the COL_NAMES keys plus mc_axis_nc and mc_axis_pn.
+    """
+    positions = list(zip(COL_NAMES, columns))
+    width = max(columns) + 1
+    filled = {'mc_unit': None, 'ptp': None, 'pv_root': None}
+
+    widest = 0
+    for row_number, row in enumerate(rows):
+        widest = max(widest, len(row))
+        if len(row) < width:
+            row = tuple(row) + (None,) * (width - len(row))
+        values = {name: row[column] for name, column in positions}
+
+        if not _is_unset(values['mc_unit']) and values['ptp'] is None:
+            values['ptp'] = 'no'
+        for name, last in filled.items():
+            if _is_unset(values[name]):
+                values[name] = last
+            else:
+                filled[name] = values[name]
+
+        if row_number < PREAMBLE_ROWS or _is_unset(values['axis_index']):
+            continue
+
+        actuator_type = values['actuator_type']
+        values['mc_axis_nc'] = values['axis_index']
+        values['mc_axis_pn'] = values['axis_index']
+        if actuator_type == 'Electrical' or actuator_type == 0:
+            values['mc_axis_pn'] = None
+        if actuator_type == 'Pneumatic' or actuator_type == 0:
+            values['mc_axis_nc'] = None
+        yield values
+
+    if widest < width:
+        label = f"Sheet '{sheet_name}'" if sheet_name is not None else "The sheet"
+        raise ValueError(f"{label} has {widest} columns, but column {width - 1} is read.")
+
 
 class ExcelReader:
     """
@@ -37,13 +151,63 @@ class ExcelReader:
         file_path (str): The path to the Excel file to be read.
     """
 
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, cache: Optional[SheetCache] = None, verbose: int = 0):
         """
         Initializes the ExcelReader with the path to an Excel file.
 
+        The workbook itself is opened lazily on first use and then kept open,
+        so several sheets can be read without re-parsing the file.
+
         :param file_path: The path to the Excel file.
+        :param cache: An optional cache of post-processed sheets; on a hit the workbook is not parsed at all.
+        :param verbose: From 1 up, every sheet read is printed.
         """
         self.file_path = file_path
+        self.cache = cache
+        self.verbose = verbose
+        self._excel_file = None
+        self._file_hash = None
+
+    def __enter__(self) -> 'ExcelReader':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    @property
+    def excel_file(self) -> pd.ExcelFile:
+        """
+        The parsed workbook handle, opened once and shared by all reads.
+        """
+        if self._excel_file is None:
+            with timing.stage('open'):
+                self._excel_file = pd.ExcelFile(self.file_path)
+        return self._excel_file
+
+    @property
+    def file_hash(self) -> str:
+        """
+        The content hash of the workbook, computed once.
+        """
+        if self._file_hash is None:
+            with timing.stage('hash'):
+                self._file_hash = file_digest(self.file_path)
+        return self._file_hash
+
+    @property
+    def sheet_names(self) -> List[str]:
+        """
+        The names of all sheets in the workbook, in workbook order.
+        """
+        return self.excel_file.sheet_names
+
+    def close(self) -> None:
+        """
+        Closes the workbook handle if it has been opened.
+        """
+        if self._excel_file is not None:
+            self._excel_file.close()
+            self._excel_file = None
 
     def read_sheet_by_index(self, sheet_index: int, columns: List[int]) -> Tuple[pd.DataFrame, str]:
         """
@@ -53,32 +217,203 @@ class ExcelReader:
         :param columns: A list of column indices to read.
         :return: A pandas DataFrame containing the specified columns from the sheet.
         """
+        if len(columns) != len(COL_NAMES):
+            raise ValueError(f"Number of columns must be {len(COL_NAMES)}")
+
+        if self.cache is not None:
+            key = self.cache.key(self.file_hash, sheet_index, columns, COLUMN_INFO)
+            with timing.stage('cache_load'):
+                cached = self.cache.load(key)
+            if cached is None:
+                timing.count('cache_misses')
+                df, instrument_name = self._read_sheet(sheet_index, columns)
+                with timing.stage('cache_store'):
+                    self.cache.store(key, df, instrument_name)
+            else:
+                timing.count('cache_hits')
+                df, instrument_name = cached
+        else:
+            df, instrument_name = self._read_sheet(sheet_index, columns)
+
+        if self.verbose:
+            print(df.to_string())
+        return df, instrument_name
+
+    def read_sheet_rows(self, sheet_index: int, columns: List[int]) -> Tuple[str, Iterator[Dict[str, Any]]]:
+        """
+        Streams the device rows of a sheet without building a DataFrame.
+
+        Rows are read one at a time from the read-only openpyxl workbook and
+        filled in and filtered as they go, so memory use does not grow with
+        the sheet. The parsed-sheet cache is not used. Workbooks pandas does
+        not read with openpyxl (e.g. .xls) go through the DataFrame instead.
+
+        :param sheet_index: The index of the sheet to read.
+        :param columns: A list of column indices to read.
+        :return: The instrument name and an iterator of row dicts, see process_rows.
+        """
+        if len(columns) != len(COL_NAMES):
+            raise ValueError(f"Number of columns must be {len(COL_NAMES)}")
+
+        sheet_name = self._get_sheet_name_by_index(sheet_index)
+        if sheet_name is None:
+            raise ValueError(f"Sheet index {sheet_index} is out of range.")
+
+        if self.excel_file.engine != 'openpyxl':
+            df, instrument_name = self._read_sheet(sheet_index, columns)
+            rows = (dict(zip(df.columns, (None if pd.isna(value) else value for value in row)))
+                    for row in df.itertuples(index=False, name=None))
+            return instrument_name, rows
+
+        rows = (tuple(cell_value(value) for value in row)
+                for row in self.excel_file.book[sheet_name].iter_rows(values_only=True))
+        header = next(rows, ())
+        self._check_layout(sheet_name, header, None, columns)
+        return header[2], process_rows(rows, columns, sheet_name)
+
+    def instrument_sheets(self, sheet_indices: List[int], columns: List[int]) -> List[int]:
+        """
+        Drops the sheets that do not have the layout of an instrument sheet.
+
+        Every dropped sheet is named on stderr. Only the header and the rows
+        up to the first one wide enough for the columns are read.
+
+        :param sheet_indices: The indices of the sheets to check.
+        :param columns: A list of column indices to read.
+        :return: The indices of the instrument sheets, in the given order.
+        """
+        kept = []
+        for sheet_index in sheet_indices:
+            sheet_name = self._get_sheet_name_by_index(sheet_index)
+            problem = self._layout_problem(sheet_name, columns)
+            if problem is None:
+                kept.append(sheet_index)
+            else:
+                print(f"Skipping sheet '{sheet_name}': it {problem}.", file=sys.stderr)
+        return kept
+
+    def _layout_problem(self, sheet_name: str, columns: List[int]) -> Optional[str]:
+        """
+        Checks the layout of a sheet without parsing all of it, see layout_problem.
+        """
+        if self.excel_file.engine != 'openpyxl':
+            sheet = self.excel_file.parse(sheet_name=sheet_name)
+            return layout_problem(_header_cells(sheet), len(sheet.columns), columns)
+
+        rows = self.excel_file.book[sheet_name].iter_rows(values_only=True)
+        header = tuple(cell_value(value) for value in next(rows, ()))
+        width = len(header)
+        for row in rows:
+            if width > max(columns):
+                break
+            width = max(width, len(row))
+        return layout_problem(header, width, columns)
+
+    def _check_layout(self, sheet_name: str, header: Sequence, width: Optional[int], columns: List[int]) -> None:
+        """
+        Raises a ValueError naming the sheet if it is not an instrument sheet, see layout_problem.
+        """
+        problem = layout_problem(header, width, columns)
+        if problem is not None:
+            raise ValueError(f"Sheet '{sheet_name}' {problem}.")
+
+    def _read_sheet(self, sheet_index: int, columns: List[int]) -> Tuple[pd.DataFrame, str]:
+        """
+        Parses and post-processes a sheet of the workbook.
+        """
+        sheet, instrument_name = self._parse_sheet(sheet_index)
+        self._check_layout(self._get_sheet_name_by_index(sheet_index), _header_cells(sheet), len(sheet.columns),
+                           columns)
+        return self._process_sheet(sheet, columns), instrument_name
+
+    def _parse_sheet(self, sheet_index: int) -> Tuple[pd.DataFrame, str]:
+        """
+        Parses a sheet of the workbook as is.
+
+        :param sheet_index: The index of the sheet to parse.
+        :return: The raw sheet and the instrument name, the third header cell, or None if the header is shorter.
+        """
         # Load the specific sheet
         sheet_name = self._get_sheet_name_by_index(sheet_index)
         if sheet_name is None:
             raise ValueError(f"Sheet index {sheet_index} is out of range.")
 
-        if len(columns) != len(COL_NAMES):
-            raise ValueError(f"Number of columns must be {len(COL_NAMES)}")
+        # Parse the sheet once; the instrument name is the third header cell
+        excel_file = self.excel_file
+        with timing.stage('parse'):
+            sheet = excel_file.parse(sheet_name=sheet_name)
+        timing.count('rows_read', len(sheet))
+        return sheet, sheet.columns[2] if len(sheet.columns) > 2 else None
 
-        # Read instrument name from the sheet
-        df_name = pd.read_excel(self.file_path, sheet_name=sheet_name, nrows=1)
-        instrument_name = df_name.columns[2]
-
-        # Read specified columns from the sheet
-        df = pd.read_excel(self.file_path, sheet_name=sheet_name, usecols=columns)
-        df.columns = COL_NAMES
-
-        df = self._prep_ptp(df)
-        df = self._fill_mc_unit(df)
-        df = self._fill_ptp(df)
-        df = self._fill_pv_root(df)
-        df = self._filter_dataframe(df)
-        df = self._build_nc_pn(df)
-        # df = self._filter_non_axis_rows(df)
-        df.index = range(len(df.index))
-        print(df.to_string())
-        return df, instrument_name
+    def _process_sheet(self, sheet: pd.DataFrame, columns: List[int]) -> pd.DataFrame:
+        """
+        Selects the device columns of a raw sheet and fills in and filters its rows.
+
+        :param sheet: The sheet returned by _parse_sheet.
+        :param columns: A list of column indices to read.
+        :return: The post-processed DataFrame.
+        """
+        with timing.stage('process'):
+            # Select the specified columns from the parsed sheet
+            df = sheet.iloc[:, columns].copy()
+            df.columns = COL_NAMES
+
+            df = self._prep_ptp(df)
+            df = self._fill_mc_unit(df)
+            df = self._fill_ptp(df)
+            df = self._fill_pv_root(df)
+            df = self._filter_dataframe(df)
+            df = self._build_nc_pn(df)
+            # df = self._filter_non_axis_rows(df)
+            df.index = range(len(df.index))
+        timing.count('rows_kept', len(df))
+        return df
+
+    def select_sheets(self, selectors: List[str]) -> List[int]:
+        """
+        Resolves sheet selectors to sheet indices.
+
+        A selector is either a sheet index, a sheet name or a glob pattern
+        matched against the sheet names (e.g. ``"*_motion"``). A pattern
+        skips the sheets that are not instrument sheets, see instrument_sheets.
+        The result is in workbook order and contains every sheet at most once.
+
+        :param selectors: The sheet selectors to resolve.
+        :return: The indices of the selected sheets.
+        """
+        sheets = self.sheet_names
+        selected = set()
+        for selector in selectors:
+            selector = str(selector)
+            if selector.isdigit():
+                sheet_index = int(selector)
+                if not 0 <= sheet_index < len(sheets):
+                    raise ValueError(f"Sheet index {sheet_index} is out of range.")
+                selected.add(sheet_index)
+                continue
+
+            matches = [idx for idx, name in enumerate(sheets) if fnmatch.fnmatchcase(name, selector)]
+            if not matches:
+                raise ValueError(f"No sheet matches '{selector}'.")
+            if selector not in sheets:
+                matches = self.instrument_sheets(matches, COLUMNS_INDEX)
+                if not matches:
+                    raise ValueError(f"No instrument sheet matches '{selector}'.")
+            selected.update(matches)
+
+        return sorted(selected)
+
+    def read_sheets(self, sheet_indices: List[int], columns: List[int]) -> Iterator[Tuple[int, pd.DataFrame, str]]:
+        """
+        Reads several sheets from the already opened workbook.
+
+        :param sheet_indices: The indices of the sheets to read.
+        :param columns: A list of column indices to read.
+        :return: An iterator of (sheet index, DataFrame, instrument name) tuples.
+        """
+        for sheet_index in sheet_indices:
+            df, instrument_name = self.read_sheet_by_index(sheet_index, columns)
+            yield sheet_index, df, instrument_name
 
     def _fill_mc_unit(self, df: pd.DataFrame) -> pd.DataFrame:
         """
@@ -157,7 +492,7 @@ class ExcelReader:
         :param df: The DataFrame to filter.
         :return: The filtered DataFrame.
         """
-        df = df.drop([0, 1, 2, 3, 4])
+        df = df.drop(range(PREAMBLE_ROWS))
         df['axis_index'] = df['axis_index'].replace(0, pd.NA)
         df = df.dropna(subset=['axis_index'])
         return df
@@ -180,9 +515,7 @@ class ExcelReader:
         :param sheet_index: The index of the sheet.
         :return: The name of the sheet.
         """
-        # Load the Excel file to get the sheet names
-        xls = pd.ExcelFile(self.file_path)
-        sheets = xls.sheet_names
+        sheets = self.sheet_names
         if 0 <= sheet_index < len(sheets):
             return sheets[sheet_index]
         else:
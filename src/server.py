@@ -0,0 +1,394 @@
+import asyncio
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from src.cache import SheetCache, file_digest
+from src.device import DeviceCollection
+from src.pipeline import build_collection
+from src.reader import ExcelReader, COLUMNS_INDEX
+from src.version import get_version
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+
+# The output kinds served by /render, and their content types
+CONTENT_TYPES = {
+    'pils': 'application/xml; charset=utf-8',
+    'ioc': 'text/plain; charset=utf-8',
+    'opi': 'application/xml; charset=utf-8',
+}
+
+# Upper bound of the request line and header block, in bytes
+MAX_HEADER_BYTES = 64 * 1024
+
+
+class RequestError(Exception):
+    """
+    An error reported to the client with an HTTP status.
+    """
+
+    def __init__(self, status: HTTPStatus, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class Workbook:
+    """
+    A workbook kept open by the server, with the DeviceCollections of the
+    sheets read so far.
+    """
+
+    def __init__(self, path: str, stat: os.stat_result, cache: Optional[SheetCache] = None) -> None:
+        """
+        Initializes a new instance of the Workbook class.
+
+        :param path: The path of the workbook.
+        :param stat: The stat result the workbook was opened with.
+        :param cache: The parsed-sheet cache shared by all workbooks.
+        """
+        self.reader = ExcelReader(path, cache=cache)
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+        self.file_hash = self.reader.file_hash
+        self.collections: Dict[int, DeviceCollection] = {}
+
+    def collection(self, sheet_index: int) -> DeviceCollection:
+        """
+        Returns the devices of one sheet, reading the sheet on first use.
+        """
+        if sheet_index not in self.collections:
+            df, instrument_name = self.reader.read_sheet_by_index(sheet_index, COLUMNS_INDEX)
+            self.collections[sheet_index] = build_collection(df, instrument_name)
+        return self.collections[sheet_index]
+
+    def close(self) -> None:
+        self.reader.close()
+
+
+class WorkbookStore:
+    """
+    The workbooks below a root directory, opened on first use and kept warm.
+
+    Every access stats the file. A workbook is only hashed again when its
+    mtime or size changed, and only re-parsed when its content did.
+    """
+
+    def __init__(self, root: str, cache: Optional[SheetCache] = None) -> None:
+        """
+        Initializes a new instance of the WorkbookStore class.
+
+        :param root: The directory workbooks are served from.
+        :param cache: The parsed-sheet cache, if any.
+        """
+        self.root = os.path.realpath(root)
+        self.cache = cache
+        self.workbooks: Dict[str, Workbook] = {}
+
+    def resolve(self, name: str) -> str:
+        """
+        Resolves a workbook name to a path inside the root directory.
+        """
+        path = os.path.realpath(os.path.join(self.root, name))
+        if os.path.commonpath([self.root, path]) != self.root:
+            raise RequestError(HTTPStatus.FORBIDDEN, f"Workbook '{name}' is outside the served directory.")
+        return path
+
+    def get(self, name: str) -> Workbook:
+        """
+        Returns an up to date workbook.
+
+        :param name: The path of the workbook, relative to the root directory.
+        :return: The workbook.
+        """
+        path = self.resolve(name)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            raise RequestError(HTTPStatus.NOT_FOUND, f"Workbook '{name}' does not exist.")
+
+        workbook = self.workbooks.get(path)
+        if workbook is not None and workbook.signature != (stat.st_mtime_ns, stat.st_size):
+            if file_digest(path) == workbook.file_hash:
+                workbook.signature = (stat.st_mtime_ns, stat.st_size)
+            else:
+                workbook.close()
+                workbook = None
+
+        if workbook is None:
+            workbook = Workbook(path, stat, self.cache)
+            self.workbooks[path] = workbook
+        return workbook
+
+    def close(self) -> None:
+        for workbook in self.workbooks.values():
+            workbook.close()
+        self.workbooks.clear()
+
+
+def _param(query: Dict, name: str, required: bool = True) -> Optional[str]:
+    values = query.get(name)
+    if not values:
+        if required:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"Missing query parameter '{name}'.")
+        return None
+    return values[-1]
+
+
+def _sheet_index(workbook: Workbook, sheet: str) -> int:
+    sheet_names = workbook.reader.sheet_names
+    if sheet.isdigit() and int(sheet) < len(sheet_names):
+        return int(sheet)
+    if sheet in sheet_names:
+        return sheet_names.index(sheet)
+    raise RequestError(HTTPStatus.NOT_FOUND, f"Workbook has no sheet '{sheet}'.")
+
+
+def _unit(device_collection: DeviceCollection, unit: str):
+    for mc_unit in device_collection.devices_by_unit:
+        if str(mc_unit) == unit:
+            return mc_unit
+    raise RequestError(HTTPStatus.NOT_FOUND, f"Instrument {device_collection.instrument} has no unit {unit}.")
+
+
+class GeneratorApp:
+    """
+    The request handlers of the generator server.
+
+    GET endpoints:
+
+    - ``/health``: the generator version.
+    - ``/sheets?workbook=W``: the sheets of a workbook.
+    - ``/units?workbook=W&sheet=S``: the instrument and motion control units of a sheet.
+    - ``/render?workbook=W&sheet=S&unit=U&kind=K``: one generated file, with K
+      one of pils, ioc (which also needs ioc_ip and plc_ip) or opi.
+
+    Sheets are given by index or name.
+    """
+
+    def __init__(self, store: WorkbookStore) -> None:
+        """
+        Initializes a new instance of the GeneratorApp class.
+
+        :param store: The workbooks served.
+        """
+        self.store = store
+        self.routes = {
+            '/health': self.health,
+            '/sheets': self.sheets,
+            '/units': self.units,
+            '/render': self.render,
+        }
+
+    def handle(self, method: str, target: str) -> Tuple[HTTPStatus, str, bytes]:
+        """
+        Handles one request.
+
+        :param method: The HTTP method.
+        :param target: The request target, path and query.
+        :return: The status, content type and body of the response.
+        """
+        url = urlsplit(target)
+        try:
+            handler = self.routes.get(url.path)
+            if handler is None:
+                raise RequestError(HTTPStatus.NOT_FOUND, f"Unknown endpoint '{url.path}'.")
+            if method not in ('GET', 'HEAD'):
+                raise RequestError(HTTPStatus.METHOD_NOT_ALLOWED, f"Method {method} is not allowed.")
+            result = handler(parse_qs(url.query))
+        except RequestError as e:
+            return e.status, 'application/json', self._json({'error': str(e)})
+        except ValueError as e:
+            return HTTPStatus.UNPROCESSABLE_ENTITY, 'application/json', self._json({'error': str(e)})
+
+        if isinstance(result, tuple):
+            content_type, text = result
+            return HTTPStatus.OK, content_type, text.encode('utf-8')
+        return HTTPStatus.OK, 'application/json', self._json(result)
+
+    @staticmethod
+    def _json(data) -> bytes:
+        return (json.dumps(data, indent=2, default=str) + '\n').encode('utf-8')
+
+    def health(self, query: Dict) -> Dict:
+        return {'status': 'ok', 'version': get_version()}
+
+    def sheets(self, query: Dict) -> Dict:
+        workbook = self.store.get(_param(query, 'workbook'))
+        return {
+            'workbook': _param(query, 'workbook'),
+            'sha256': workbook.file_hash,
+            'sheets': [{'index': idx, 'name': name} for idx, name in enumerate(workbook.reader.sheet_names)],
+        }
+
+    def units(self, query: Dict) -> Dict:
+        workbook = self.store.get(_param(query, 'workbook'))
+        device_collection = workbook.collection(_sheet_index(workbook, _param(query, 'sheet')))
+        return {
+            'instrument': str(device_collection.instrument),
+            'units': [{
+                'mc_unit': str(mc_unit),
+                'devices': len(devices),
+                'files': {
+                    'pils': device_collection.xml_file_name(mc_unit),
+                    'ioc': device_collection.st_cmd_file_name(mc_unit),
+                    'opi': device_collection.opi_file_name(mc_unit),
+                },
+            } for mc_unit, devices in device_collection.devices_by_unit.items()],
+        }
+
+    def render(self, query: Dict) -> Tuple[str, str]:
+        kind = _param(query, 'kind')
+        if kind not in CONTENT_TYPES:
+            raise RequestError(HTTPStatus.BAD_REQUEST, f"Unknown kind '{kind}', use one of {', '.join(CONTENT_TYPES)}.")
+
+        workbook = self.store.get(_param(query, 'workbook'))
+        device_collection = workbook.collection(_sheet_index(workbook, _param(query, 'sheet')))
+        mc_unit = _unit(device_collection, _param(query, 'unit'))
+
+        if kind == 'pils':
+            text = device_collection.render_xml(mc_unit)
+        elif kind == 'ioc':
+            text = device_collection.render_st_cmd(mc_unit, _param(query, 'ioc_ip'), _param(query, 'plc_ip'))
+        else:
+            text = device_collection.render_opi(mc_unit)
+        return CONTENT_TYPES[kind], text
+
+
+class GeneratorServer:
+    """
+    A minimal asyncio HTTP/1.1 server in front of a GeneratorApp.
+
+    Requests are handled one at a time on a single worker thread, so the
+    event loop keeps accepting connections while a workbook is parsed, and
+    the warm workbooks are never touched concurrently.
+    """
+
+    def __init__(self, app: GeneratorApp, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+        """
+        Initializes a new instance of the GeneratorServer class.
+
+        :param app: The request handlers.
+        :param host: The address to listen on.
+        :param port: The port to listen on; 0 picks a free one.
+        """
+        self.app = app
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        """
+        Starts listening; the port actually bound is stored in self.port.
+        """
+        self.server = await asyncio.start_server(self._serve_connection, self.host, self.port,
+                                                 limit=MAX_HEADER_BYTES)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=True)
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+
+                lines = head.decode('latin-1').split('\r\n')
+                parts = lines[0].split(' ')
+                if len(parts) != 3:
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST, 'application/json',
+                                        GeneratorApp._json({'error': 'Malformed request line.'}), False)
+                    break
+                method, target, version = parts
+
+                headers = {}
+                for line in lines[1:]:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+
+                # GET requests carry no body, but skip one if a client sends it anyway
+                length = headers.get('content-length', '0') or '0'
+                if not length.isdigit():
+                    await self._respond(writer, HTTPStatus.BAD_REQUEST, 'application/json',
+                                        GeneratorApp._json({'error': 'Malformed Content-Length.'}), False)
+                    break
+                length = int(length)
+                if length:
+                    await reader.readexactly(length)
+
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection != 'close' and (version == 'HTTP/1.1' or connection == 'keep-alive')
+
+                loop = asyncio.get_running_loop()
+                try:
+                    status, content_type, body = await loop.run_in_executor(self.executor, self.app.handle,
+                                                                            method, target)
+                except Exception as e:
+                    status, content_type, body = (HTTPStatus.INTERNAL_SERVER_ERROR, 'application/json',
+                                                  GeneratorApp._json({'error': f"{type(e).__name__}: {e}"}))
+                if method == 'HEAD':
+                    await self._respond(writer, status, content_type, b'', keep_alive, len(body))
+                else:
+                    await self._respond(writer, status, content_type, body, keep_alive)
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, status: HTTPStatus, content_type: str, body: bytes,
+                       keep_alive: bool, length: Optional[int] = None) -> None:
+        head = (f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f"Content-Length: {len(body) if length is None else length}\r\n"
+                f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n")
+        writer.write(head.encode('latin-1') + body)
+        await writer.drain()
+
+
+def serve(root: str = '.', host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+          cache: Optional[SheetCache] = None) -> None:
+    """
+    Runs the generator server until interrupted.
+
+    :param root: The directory workbooks are served from.
+    :param host: The address to listen on.
+    :param port: The port to listen on.
+    :param cache: The parsed-sheet cache, if any.
+    """
+    store = WorkbookStore(root, cache)
+    server = GeneratorServer(GeneratorApp(store), host, port)
+
+    async def run():
+        await server.start()
+        print(f"Serving workbooks from {store.root} on http://{host}:{server.port}", flush=True)
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+            store.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
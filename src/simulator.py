@@ -0,0 +1,602 @@
+import asyncio
+import math
+import re
+import struct
+import time
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from src.layout import Slot, pils_device_byte_lengths
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 48898
+
+# The address the generated st.cmd of a simulated unit points at
+LOCALHOST = '127.0.0.1'
+
+# AMS/TCP header: reserved and the length of the AMS packet that follows
+AMS_TCP_HEADER = struct.Struct('<HI')
+# AMS header: target and source AMS net id and port, command, state flags,
+# data length, error code and invoke id
+AMS_HEADER = struct.Struct('<6sH6sHHHIII')
+
+ADS_READ_DEVICE_INFO = 1
+ADS_READ = 2
+ADS_WRITE = 3
+ADS_READ_STATE = 4
+
+# State flags of a response to an ADS command
+ADS_RESPONSE_FLAGS = 0x0005
+
+ADSERR_NOERR = 0x000
+ADSERR_DEVICE_SRVNOTSUPP = 0x701
+ADSERR_DEVICE_INVALIDGRP = 0x702
+ADSERR_DEVICE_INVALIDOFFSET = 0x703
+ADSERR_DEVICE_INVALIDSIZE = 0x705
+
+# The index group of the PLC memory, i.e. the %MB offsets of the PILS image
+ADSIGRP_PLC_MEMORY = 0x4020
+ADSSTATE_RUN = 5
+DEVICE_NAME = b'PILS simulator'
+DEVICE_VERSION = (3, 1, 4024)
+
+# The PILS header the IOC reads first: the magic at %MB0 and the offset of
+# the indexer at %MB4. The indexer is a request word followed by 34 bytes
+# of data, below PILS_START_OFFSET.
+PILS_MAGIC = 2015.02
+INDEXER_OFFSET = 64
+INDEXER_DATA_SIZE = 34
+INDEXER_SIZE = 2 + INDEXER_DATA_SIZE
+INDEXER_ACK = 0x8000
+
+# Indexer info types: the device info, the name and the names of aux bits 0..23
+INFO_DEVICE = 0
+INFO_NAME = 4
+INFO_AUX = 16
+DEVICE_INFO = struct.Struct('<HHHHIff')  # type code, size, offset, unit, flags, absmin, absmax
+
+# The state in the top four bits of an extended status word
+STATE_RESET = 0
+STATE_IDLE = 1
+STATE_WARN = 3
+STATE_START = 5
+STATE_BUSY = 6
+STATE_STOP = 7
+STATE_ERROR = 8
+
+# The command in the top three bits of the parameter control word of a 5010
+PARAM_COMMAND_MASK = 0xE000
+PARAM_READ = 0x2000
+PARAM_WRITE = 0x4000
+PARAM_DONE = 0x8000
+
+DEFAULT_VELOCITY = 5.0        # units/s a simulated axis moves
+DEFAULT_SHUTTER_TIME = 1.0    # s a simulated shutter takes to open or close
+
+_DEVICE_ENTRY = re.compile(r"\(nTypCode := 16#(\w+), sName := '([^']*)', nOffset := (\d+)(.*)")
+_UNIT = re.compile(r"nUnit := 16#(\w+)")
+_FLAGS = re.compile(r"nFlags := (\d+)")
+_AUX = re.compile(r"asAUX := \[(.*?)\]", re.IGNORECASE)
+_AUX_NAME = re.compile(r"\('([^']*)'\)")
+
+
+class DeviceInfo(NamedTuple):
+    """
+    One entry of the astDevices table of a unit, as the indexer reports it.
+    """
+    index: int               # PILS device number
+    device_type: str         # PILS type code, e.g. '5010'
+    name: str
+    offset: int              # %MB offset
+    length: int              # size in bytes
+    unit: int = 0            # nUnit, 0 if the device has none
+    flags: int = 0
+    aux: Tuple[str, ...] = ()  # the names of the aux bits, bit 0 first
+
+    @property
+    def end(self) -> int:
+        return self.offset + self.length
+
+
+def _aux_names(text: str) -> Tuple[str, ...]:
+    return tuple(_AUX_NAME.findall(text))
+
+
+def device_infos(slots: List[Slot]) -> List[DeviceInfo]:
+    """
+    Converts the memory map of a unit into its astDevices table.
+
+    :param slots: The slots returned by DeviceCollection.layout.
+    :return: The devices in PILS index order.
+    """
+    devices = []
+    for slot in sorted(slots, key=lambda slot: slot.index):
+        fields = {name.lower(): value for name, value in slot.fields}
+        unit = int(fields['nunit'].split('#')[-1], 16) if 'nunit' in fields else 0
+        devices.append(DeviceInfo(slot.index, slot.device_type, slot.name, slot.offset, slot.length, unit,
+                                  int(fields.get('nflags', 0)), _aux_names(fields.get('asaux', ''))))
+    return devices
+
+
+def parse_device_table(content: str) -> List[DeviceInfo]:
+    """
+    Reads the astDevices table from a generated PILS table.
+
+    :param content: The TcGVL file content.
+    :return: The devices in PILS index order.
+    """
+    devices = []
+    for line in content.splitlines():
+        match = _DEVICE_ENTRY.search(line)
+        if match is None:
+            continue
+        device_type, name, offset, rest = match.groups()
+        device_type = device_type.upper()
+        if device_type not in pils_device_byte_lengths:
+            raise ValueError(f"Device '{name}' has the unknown PILS type code {device_type}")
+        unit = _UNIT.search(rest)
+        flags = _FLAGS.search(rest)
+        aux = _AUX.search(rest)
+        devices.append(DeviceInfo(len(devices) + 1, device_type, name, int(offset),
+                                  pils_device_byte_lengths[device_type], int(unit.group(1), 16) if unit else 0,
+                                  int(flags.group(1)) if flags else 0, _aux_names(aux.group(1)) if aux else ()))
+    return devices
+
+
+def status_word(state: int, aux: int = 0) -> int:
+    return (state << 28) | (aux & 0xFFFFFF)
+
+
+def _aux_bits(device: DeviceInfo, *names: str) -> int:
+    return sum(1 << bit for bit, name in enumerate(device.aux) if name in names)
+
+
+class DeviceModel:
+    """
+    The simulated behaviour of one PILS device, kept in the process image.
+
+    A model only changes the image when the PLC steps it, or when the IOC
+    writes to the device.
+    """
+
+    def __init__(self, device: DeviceInfo, image: bytearray, now: float) -> None:
+        self.device = device
+        self.image = image
+        self.started = now
+
+    def step(self, now: float) -> None:
+        pass
+
+    def written(self, now: float) -> None:
+        pass
+
+    def pack(self, fmt: str, position: int, *values) -> None:
+        struct.pack_into(fmt, self.image, self.device.offset + position, *values)
+
+    def unpack(self, fmt: str, position: int) -> Tuple:
+        return struct.unpack_from(fmt, self.image, self.device.offset + position)
+
+
+class AxisModel(DeviceModel):
+    """
+    A 5010 motor: actual and target LREAL, extended status word, parameter
+    control word and parameter LREAL. The axis moves at a constant velocity
+    once the IOC writes a target and sets the state to START, and stops on
+    STOP. Parameters written are read back.
+    """
+
+    def __init__(self, device: DeviceInfo, image: bytearray, now: float, velocity: float = DEFAULT_VELOCITY) -> None:
+        super().__init__(device, image, now)
+        self.velocity = velocity
+        self.position = 0.0
+        self.target = 0.0
+        self.moving = False
+        self.last_step = now
+        self.parameters: Dict[int, float] = {}
+        self.enabled = _aux_bits(device, 'enabled')
+        self.in_target = _aux_bits(device, 'inTargetPos')
+        self.pack('<ddI', 0, self.position, self.target, status_word(STATE_IDLE, self.enabled | self.in_target))
+
+    def step(self, now: float) -> None:
+        if self.moving:
+            distance = self.target - self.position
+            travel = self.velocity * (now - self.last_step)
+            if abs(distance) <= travel:
+                self.position = self.target
+                self.moving = False
+                self.pack('<dxxxxxxxxI', 0, self.position, status_word(STATE_IDLE, self.enabled | self.in_target))
+            else:
+                self.position += math.copysign(travel, distance)
+                self.pack('<d', 0, self.position)
+        self.last_step = now
+
+    def written(self, now: float) -> None:
+        self.step(now)
+        target, status, control = self.unpack('<dII', 8)
+        state = status >> 28
+        if state == STATE_START:
+            self.target = target
+            self.moving = True
+            self.pack('<I', 16, status_word(STATE_BUSY, self.enabled))
+        elif state == STATE_STOP:
+            self.target = self.position
+            self.moving = False
+            self.pack('<dI', 8, self.position, status_word(STATE_IDLE, self.enabled | self.in_target))
+
+        command = control & PARAM_COMMAND_MASK
+        parameter = control & ~PARAM_COMMAND_MASK
+        if command == PARAM_WRITE:
+            self.parameters[parameter] = self.unpack('<d', 24)[0]
+        if command in (PARAM_READ, PARAM_WRITE):
+            self.pack('<Id', 20, PARAM_DONE | parameter, self.parameters.get(parameter, 0.0))
+
+
+class ShutterModel(DeviceModel):
+    """
+    A 1E04 shutter: actual and target INT and an extended status word. The
+    shutter is BUSY opening or closing for shutter_time after the IOC writes
+    a new target.
+    """
+
+    def __init__(self, device: DeviceInfo, image: bytearray, now: float,
+                 shutter_time: float = DEFAULT_SHUTTER_TIME) -> None:
+        super().__init__(device, image, now)
+        self.shutter_time = shutter_time
+        self.actual = 0
+        self.arrival: Optional[float] = None
+        self.pack('<hhI', 0, 0, 0, self._status())
+
+    def _status(self) -> int:
+        if self.arrival is not None:
+            target = self.unpack('<h', 2)[0]
+            return status_word(STATE_BUSY, _aux_bits(self.device, 'Opening' if target else 'Closing', 'InTheMiddle'))
+        return status_word(STATE_IDLE, _aux_bits(self.device, 'Opened' if self.actual else 'Closed'))
+
+    def step(self, now: float) -> None:
+        if self.arrival is not None and now >= self.arrival:
+            self.actual = self.unpack('<h', 2)[0]
+            self.arrival = None
+            self.pack('<hxxI', 0, self.actual, self._status())
+
+    def written(self, now: float) -> None:
+        self.step(now)
+        target = self.unpack('<h', 2)[0]
+        if target != self.actual and self.arrival is None:
+            self.arrival = now + self.shutter_time
+        self.pack('<I', 4, self._status())
+
+
+class InputModel(DeviceModel):
+    """
+    A device the IOC only reads: a temperature, pressure, PTP or time value
+    that drifts slowly, with an IDLE status word if the type has one.
+    """
+
+    # The format of the value and the position of the status word, by type code
+    FORMATS = {
+        '1201': ('<h', None),
+        '1202': ('<i', None),
+        '1204': ('<q', None),
+        '1302': ('<f', None),
+        '1304': ('<d', None),
+        '1802': (None, 0),
+        '1A04': ('<i', 4),
+        '1A08': ('<q', 8),
+        '1B04': ('<f', 4),
+        '1B08': ('<d', 8),
+    }
+
+    def __init__(self, device: DeviceInfo, image: bytearray, now: float) -> None:
+        super().__init__(device, image, now)
+        self.fmt, status = self.FORMATS.get(device.device_type, (None, None))
+        if status is not None:
+            self.pack('<I', status, status_word(STATE_IDLE))
+        self.step(now)
+
+    def value(self, now: float):
+        if self.device.device_type == '1204':
+            return time.time_ns()
+        wave = math.sin((now - self.started) / 10 + self.device.index)
+        if self.fmt in ('<f', '<d'):
+            return 1e-6 * (2 + wave) if self.device.device_type == '1B08' else 20 + wave
+        return int(50 * wave)
+
+    def step(self, now: float) -> None:
+        if self.fmt is not None:
+            self.pack(self.fmt, 0, self.value(now))
+
+
+def device_model(device: DeviceInfo, image: bytearray, now: float, velocity: float = DEFAULT_VELOCITY,
+                 shutter_time: float = DEFAULT_SHUTTER_TIME) -> DeviceModel:
+    """
+    Creates the simulated behaviour of a device from its PILS type code.
+    """
+    if device.device_type == '5010':
+        return AxisModel(device, image, now, velocity)
+    if device.device_type == '1E04':
+        return ShutterModel(device, image, now, shutter_time)
+    return InputModel(device, image, now)
+
+
+class SimulatedPlc:
+    """
+    The PILS process image of one unit, with the PILS header, the indexer
+    and a model of every device.
+
+    The models are stepped on every access, so a PLC that is not polled
+    costs nothing; the clock can be replaced to step them deterministically.
+    """
+
+    def __init__(self, devices: List[DeviceInfo], plc_name: str = '', velocity: float = DEFAULT_VELOCITY,
+                 shutter_time: float = DEFAULT_SHUTTER_TIME, clock: Callable[[], float] = time.monotonic) -> None:
+        """
+        Initializes a new instance of the SimulatedPlc class.
+
+        :param devices: The astDevices table of the unit.
+        :param plc_name: The name the indexer reports for device 0.
+        :param velocity: The velocity of the simulated axes, in units/s.
+        :param shutter_time: The time the simulated shutters take to move, in s.
+        :param clock: Returns the current time in s.
+        """
+        self.devices = devices
+        self.plc_name = plc_name
+        self.clock = clock
+        self.image = bytearray(max([INDEXER_OFFSET + INDEXER_SIZE] + [device.end for device in devices]))
+        struct.pack_into('<fH', self.image, 0, PILS_MAGIC, INDEXER_OFFSET)
+        now = clock()
+        self.models = [device_model(device, self.image, now, velocity, shutter_time) for device in devices]
+
+    def step(self) -> float:
+        now = self.clock()
+        for model in self.models:
+            model.step(now)
+        return now
+
+    def read(self, offset: int, length: int) -> bytes:
+        """
+        Reads from the process image after stepping the devices.
+        """
+        if offset + length > len(self.image):
+            raise IndexError(f"Read of {length} bytes at %MB{offset} is outside the process image")
+        self.step()
+        return bytes(self.image[offset:offset + length])
+
+    def write(self, offset: int, data: bytes) -> None:
+        """
+        Writes to the process image and lets the devices and the indexer react.
+        """
+        end = offset + len(data)
+        if end > len(self.image):
+            raise IndexError(f"Write of {len(data)} bytes at %MB{offset} is outside the process image")
+        now = self.step()
+        self.image[offset:end] = data
+        for model in self.models:
+            if offset < model.device.end and model.device.offset < end:
+                model.written(now)
+        if offset <= INDEXER_OFFSET < end:
+            self._answer_indexer()
+
+    def _answer_indexer(self) -> None:
+        request = struct.unpack_from('<H', self.image, INDEXER_OFFSET)[0]
+        if request & INDEXER_ACK:
+            return
+        index, info_type = request & 0xFF, request >> 8
+        data = b''
+        if index == 0:
+            device = DeviceInfo(0, '0000', self.plc_name, INDEXER_OFFSET, INDEXER_SIZE)
+        elif index <= len(self.devices):
+            device = self.devices[index - 1]
+        else:
+            device = None
+        if device is not None:
+            if info_type == INFO_DEVICE:
+                data = DEVICE_INFO.pack(int(device.device_type, 16), device.length, device.offset, device.unit,
+                                        device.flags, 0.0, 0.0)
+            elif info_type == INFO_NAME:
+                data = device.name.encode('utf-8')[:INDEXER_DATA_SIZE - 1]
+            elif INFO_AUX <= info_type < INFO_AUX + len(device.aux):
+                data = device.aux[info_type - INFO_AUX].encode('utf-8')[:INDEXER_DATA_SIZE - 1]
+        start = INDEXER_OFFSET + 2
+        self.image[start:start + INDEXER_DATA_SIZE] = data.ljust(INDEXER_DATA_SIZE, b'\0')
+        struct.pack_into('<H', self.image, INDEXER_OFFSET, request | INDEXER_ACK)
+
+
+class AdsStats:
+    """
+    The ADS traffic a simulator served, to measure the polling of an IOC.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.monotonic()
+        self.requests: Dict[str, int] = {}
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.service_time = 0.0
+
+    def count(self, command: str, received: int, sent: int, service_time: float) -> None:
+        self.requests[command] = self.requests.get(command, 0) + 1
+        self.bytes_received += received
+        self.bytes_sent += sent
+        self.service_time += service_time
+
+    def format_table(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        total = sum(self.requests.values())
+        lines = [f"{command:<20}{count:>10}  {count / elapsed:10.1f}/s\n"
+                 for command, count in sorted(self.requests.items())]
+        lines.append(f"{'bytes received':<20}{self.bytes_received:>10}  {self.bytes_received / elapsed:10.1f}/s\n")
+        lines.append(f"{'bytes sent':<20}{self.bytes_sent:>10}  {self.bytes_sent / elapsed:10.1f}/s\n")
+        if total:
+            lines.append(f"{'mean service time':<20}{1e6 * self.service_time / total:>10.1f}  us\n")
+        return ''.join(lines)
+
+
+COMMAND_NAMES = {
+    ADS_READ_DEVICE_INFO: 'read_device_info',
+    ADS_READ: 'read',
+    ADS_WRITE: 'write',
+    ADS_READ_STATE: 'read_state',
+}
+
+
+class AdsHandler:
+    """
+    Answers the AMS packets of an IOC from a simulated PLC.
+
+    Reads and writes of the PLC memory index group go to the process image;
+    the device info and the state report a running PLC. Other commands and
+    index groups are answered with the matching ADS error.
+    """
+
+    def __init__(self, plc: SimulatedPlc, stats: Optional[AdsStats] = None) -> None:
+        """
+        Initializes a new instance of the AdsHandler class.
+
+        :param plc: The simulated PLC.
+        :param stats: Collects the traffic served, if given.
+        """
+        self.plc = plc
+        self.stats = stats
+
+    def handle(self, packet: bytes) -> bytes:
+        """
+        Handles one AMS packet.
+
+        :param packet: The AMS header and the ADS data of a request, without the AMS/TCP header.
+        :return: The response, AMS/TCP header included.
+        """
+        started = time.perf_counter()
+        target, target_port, source, source_port, command, _, length, _, invoke_id = \
+            AMS_HEADER.unpack_from(packet)
+        data = packet[AMS_HEADER.size:AMS_HEADER.size + length]
+
+        if command == ADS_READ_DEVICE_INFO:
+            major, minor, build = DEVICE_VERSION
+            payload = struct.pack('<IBBH16s', ADSERR_NOERR, major, minor, build, DEVICE_NAME)
+        elif command == ADS_READ_STATE:
+            payload = struct.pack('<IHH', ADSERR_NOERR, ADSSTATE_RUN, 0)
+        elif command == ADS_READ:
+            result, content = self._read(data)
+            payload = struct.pack('<II', result, len(content)) + content
+        elif command == ADS_WRITE:
+            payload = struct.pack('<I', self._write(data))
+        else:
+            payload = struct.pack('<I', ADSERR_DEVICE_SRVNOTSUPP)
+
+        header = AMS_HEADER.pack(source, source_port, target, target_port, command, ADS_RESPONSE_FLAGS,
+                                 len(payload), ADSERR_NOERR, invoke_id)
+        response = AMS_TCP_HEADER.pack(0, len(header) + len(payload)) + header + payload
+        if self.stats is not None:
+            self.stats.count(COMMAND_NAMES.get(command, f"command {command}"),
+                             AMS_TCP_HEADER.size + len(packet), len(response), time.perf_counter() - started)
+        return response
+
+    def _read(self, data: bytes) -> Tuple[int, bytes]:
+        if len(data) < 12:
+            return ADSERR_DEVICE_INVALIDSIZE, b''
+        group, offset, length = struct.unpack_from('<III', data)
+        if group != ADSIGRP_PLC_MEMORY:
+            return ADSERR_DEVICE_INVALIDGRP, b''
+        try:
+            return ADSERR_NOERR, self.plc.read(offset, length)
+        except IndexError:
+            return ADSERR_DEVICE_INVALIDOFFSET, b''
+
+    def _write(self, data: bytes) -> int:
+        if len(data) < 12:
+            return ADSERR_DEVICE_INVALIDSIZE
+        group, offset, length = struct.unpack_from('<III', data)
+        if len(data) - 12 != length:
+            return ADSERR_DEVICE_INVALIDSIZE
+        if group != ADSIGRP_PLC_MEMORY:
+            return ADSERR_DEVICE_INVALIDGRP
+        try:
+            self.plc.write(offset, data[12:])
+        except IndexError:
+            return ADSERR_DEVICE_INVALIDOFFSET
+        return ADSERR_NOERR
+
+
+class AdsServer:
+    """
+    A minimal asyncio ADS-over-TCP server in front of an AdsHandler.
+
+    Every connection is served in order, one AMS packet at a time, like a
+    PLC answering one ADS router.
+    """
+
+    def __init__(self, handler: AdsHandler, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT) -> None:
+        """
+        Initializes a new instance of the AdsServer class.
+
+        :param handler: Answers the AMS packets.
+        :param host: The address to listen on.
+        :param port: The port to listen on; 0 picks a free one.
+        """
+        self.handler = handler
+        self.host = host
+        self.port = port
+        self.server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self) -> None:
+        """
+        Starts listening; the port actually bound is stored in self.port.
+        """
+        self.server = await asyncio.start_server(self._serve_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self) -> None:
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    _, length = AMS_TCP_HEADER.unpack(await reader.readexactly(AMS_TCP_HEADER.size))
+                    packet = await reader.readexactly(length)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if length < AMS_HEADER.size:
+                    break
+                writer.write(self.handler.handle(packet))
+                await writer.drain()
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+def simulate(plc: SimulatedPlc, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT,
+             stats: Optional[AdsStats] = None) -> None:
+    """
+    Serves a simulated PLC until interrupted.
+
+    :param plc: The simulated PLC.
+    :param host: The address to listen on.
+    :param port: The port to listen on.
+    :param stats: Collects the traffic served, if given.
+    """
+    server = AdsServer(AdsHandler(plc, stats), host, port)
+
+    async def run():
+        await server.start()
+        print(f"Simulating {plc.plc_name or 'PLC'} with {len(plc.devices)} PILS devices "
+              f"on ads://{host}:{server.port}", flush=True)
+        try:
+            await server.serve_forever()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
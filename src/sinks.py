@@ -0,0 +1,291 @@
+import io
+import os
+import sys
+import tarfile
+import tempfile
+import time
+import zipfile
+from typing import BinaryIO, Dict, Optional, TextIO, Union
+
+from src.incremental import file_mode, write_if_changed
+
+# Archive suffixes understood by open_sink, and the compression each one implies
+TAR_SUFFIXES = {
+    '.tar': '',
+    '.tar.gz': 'gz',
+    '.tgz': 'gz',
+    '.tar.bz2': 'bz2',
+    '.tar.xz': 'xz',
+}
+ZIP_SUFFIX = '.zip'
+
+# Output specification selecting standard output
+STDOUT_SPEC = '-'
+
+
+def _encode(content: Union[str, bytes]) -> bytes:
+    if isinstance(content, str):
+        return content.encode('utf-8')
+    return content
+
+
+class OutputSink:
+    """
+    Where generated files go. File names are relative, '/' separated paths.
+
+    Sinks are context managers: leaving the block normally closes them,
+    leaving it with an exception aborts them, discarding archives that were
+    only partially written.
+    """
+
+    def write(self, name: str, content: Union[str, bytes]) -> bool:
+        """
+        Writes one file.
+
+        :param name: The relative path of the file.
+        :param content: The file content; text is encoded as UTF-8.
+        :return: True if the file was written, False if it was left unchanged.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """
+        Finishes the output, e.g. the index of an archive.
+        """
+
+    def abort(self) -> None:
+        """
+        Gives up on the output after an error.
+        """
+        self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class DirectorySink(OutputSink):
+    """
+    Writes files into a directory, created on demand.
+
+    Every file is written in one go to a temporary file that then replaces
+    the target, and files whose content did not change are left untouched.
+    """
+
+    def __init__(self, path: str = '.') -> None:
+        """
+        Initializes a new instance of the DirectorySink class.
+
+        :param path: The output directory.
+        """
+        self.path = path
+
+    def file_path(self, name: str) -> str:
+        """
+        Returns the path a file name is written to.
+        """
+        return os.path.join(self.path, *name.split('/'))
+
+    def write(self, name: str, content: Union[str, bytes]) -> bool:
+        file_path = self.file_path(name)
+        os.makedirs(os.path.dirname(file_path) or '.', exist_ok=True)
+        return write_if_changed(file_path, content)
+
+
+class MemorySink(OutputSink):
+    """
+    Keeps the files in memory, as a dict of file name to bytes.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes a new instance of the MemorySink class.
+        """
+        self.files: Dict[str, bytes] = {}
+
+    def write(self, name: str, content: Union[str, bytes]) -> bool:
+        data = _encode(content)
+        if self.files.get(name) == data:
+            return False
+        self.files[name] = data
+        return True
+
+
+class StreamSink(OutputSink):
+    """
+    Writes every file to a text stream, standard output by default, each
+    preceded by a '==> name <==' header line.
+    """
+
+    def __init__(self, stream: Optional[TextIO] = None) -> None:
+        """
+        Initializes a new instance of the StreamSink class.
+
+        :param stream: The text stream to write to; defaults to sys.stdout at write time.
+        """
+        self.stream = stream
+        self._count = 0
+
+    def write(self, name: str, content: Union[str, bytes]) -> bool:
+        if isinstance(content, bytes):
+            content = content.decode('utf-8')
+        stream = self.stream or sys.stdout
+        if self._count:
+            stream.write('\n')
+        stream.write(f"==> {name} <==\n{content}")
+        self._count += 1
+        return True
+
+    def close(self) -> None:
+        (self.stream or sys.stdout).flush()
+
+
+class ArchiveSink(OutputSink):
+    """
+    Base class of the sinks that write one archive.
+
+    Given a path, the archive is written to a temporary file next to it and
+    only replaces the path once it is complete. Given a binary file object,
+    e.g. a socket or standard output, it is written to it as it goes.
+    """
+
+    def __init__(self, target: Union[str, BinaryIO]) -> None:
+        """
+        Initializes a new instance of the ArchiveSink class.
+
+        :param target: The path of the archive, or a writable binary file object.
+        """
+        self.path = None
+        self._tmp_path = None
+        if isinstance(target, (str, os.PathLike)):
+            self.path = os.fspath(target)
+            directory = os.path.dirname(self.path) or '.'
+            os.makedirs(directory, exist_ok=True)
+            fd, self._tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(self.path),
+                                                  suffix='.tmp')
+            self.fileobj = os.fdopen(fd, 'wb')
+        else:
+            self.fileobj = target
+        self.mtime = time.time()
+        self._names = set()
+        self._closed = False
+
+    def _check_name(self, name: str) -> None:
+        if name in self._names:
+            raise ValueError(f"File '{name}' was already written to the archive.")
+        self._names.add(name)
+
+    def _finish(self) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._finish()
+        finally:
+            if self._tmp_path is not None:
+                self.fileobj.close()
+        if self._tmp_path is not None:
+            os.chmod(self._tmp_path, file_mode(self.path))
+            os.replace(self._tmp_path, self.path)
+
+    def abort(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._finish()
+        finally:
+            if self._tmp_path is not None:
+                self.fileobj.close()
+                os.unlink(self._tmp_path)
+
+
+class TarSink(ArchiveSink):
+    """
+    Writes the files into a tar archive, optionally compressed.
+    """
+
+    def __init__(self, target: Union[str, BinaryIO], compression: str = '') -> None:
+        """
+        Initializes a new instance of the TarSink class.
+
+        :param target: The path of the archive, or a writable binary file object.
+        :param compression: '' for none, or 'gz', 'bz2' or 'xz'.
+        """
+        super().__init__(target)
+        # Stream mode, so file objects without seek (pipes, sockets) work too
+        self.archive = tarfile.open(fileobj=self.fileobj, mode=f'w|{compression}')
+
+    def write(self, name: str, content: Union[str, bytes]) -> bool:
+        self._check_name(name)
+        data = _encode(content)
+        info = tarfile.TarInfo(name)
+        info.size = len(data)
+        info.mtime = self.mtime
+        info.mode = 0o644
+        self.archive.addfile(info, io.BytesIO(data))
+        return True
+
+    def _finish(self) -> None:
+        self.archive.close()
+
+
+class ZipSink(ArchiveSink):
+    """
+    Writes the files into a deflate compressed zip archive.
+    """
+
+    def __init__(self, target: Union[str, BinaryIO]) -> None:
+        """
+        Initializes a new instance of the ZipSink class.
+
+        :param target: The path of the archive, or a writable binary file object.
+        """
+        super().__init__(target)
+        self.archive = zipfile.ZipFile(self.fileobj, mode='w', compression=zipfile.ZIP_DEFLATED)
+
+    def write(self, name: str, content: Union[str, bytes]) -> bool:
+        self._check_name(name)
+        info = zipfile.ZipInfo(name, date_time=time.localtime(self.mtime)[:6])
+        info.compress_type = zipfile.ZIP_DEFLATED
+        info.external_attr = 0o644 << 16
+        self.archive.writestr(info, _encode(content))
+        return True
+
+    def _finish(self) -> None:
+        self.archive.close()
+
+
+def is_directory_spec(spec: str) -> bool:
+    """
+    Tells whether an output specification selects a directory.
+    """
+    return spec != STDOUT_SPEC and not spec.lower().endswith(tuple(TAR_SUFFIXES) + (ZIP_SUFFIX,))
+
+
+def open_sink(spec: str) -> OutputSink:
+    """
+    Opens the sink an output specification selects: '-' for standard output,
+    a path ending in .zip, .tar, .tar.gz, .tgz, .tar.bz2 or .tar.xz for an
+    archive, any other path for a directory.
+
+    :param spec: The output specification.
+    :return: The sink.
+    """
+    if spec == STDOUT_SPEC:
+        return StreamSink()
+    lowered = spec.lower()
+    if lowered.endswith(ZIP_SUFFIX):
+        return ZipSink(spec)
+    for suffix, compression in TAR_SUFFIXES.items():
+        if lowered.endswith(suffix):
+            return TarSink(spec, compression)
+    return DirectorySink(spec)
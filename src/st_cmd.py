@@ -0,0 +1,130 @@
+from typing import List, Optional, TextIO, Tuple
+
+from src.poll_budget import DEFAULT_POLL_PERIOD
+from src.read_blocks import ReadBlock, blocks_by_class, format_blocks
+from src.template import Template
+
+HEADER = Template('''require essioc
+require calc
+require ethercatmc
+
+iocshLoad("$(essioc_DIR)/common_config.iocsh")
+
+epicsEnvSet("MOTOR_PORT",    "MCU1")
+epicsEnvSet("IPADDR",        "$PLC_IP$")
+epicsEnvSet("IPPORT",        "48898")
+epicsEnvSet("AMSNETIDIOC",   "$IOC_IP$.1.1")
+epicsEnvSet("ASYN_PORT",     "MC_CPU1")
+epicsEnvSet("P",             "$INSTRUMENT$-")
+epicsEnvSet("R",             "MCS$MC_UNIT$:MC-MCU-0$MC_UNIT$:")
+epicsEnvSet("PREC",          "3")
+epicsEnvSet("ECM_NUMAXES",   "$NUM_AXES$")
+epicsEnvSet("ECM_OPTIONS",   "adsPort=852;amsNetIdRemote=$PLC_IP$.1.1;amsNetIdLocal=$(AMSNETIDIOC)")
+
+epicsEnvSet("ECM_MOVINGPOLLPERIOD", "0")
+epicsEnvSet("ECM_IDLEPOLLPERIOD",   "0")
+
+''')
+
+# The ADS read plan of the unit, see src.read_blocks
+READ_BLOCKS = Template('''epicsEnvSet("ECM_READBLOCKS_HOT",  "$HOT_BLOCKS$")
+epicsEnvSet("ECM_READBLOCKS_COLD", "$COLD_BLOCKS$")
+
+''')
+
+CONTROLLER = Template('''iocshLoad("$(ethercatmc_DIR)ethercatmcController.iocsh")
+
+''')
+
+CABINET = Template('''#
+# Cabinet status
+#
+epicsEnvSet("AXIS_NO",         "0")
+epicsEnvSet("R",               "Cabinet")
+epicsEnvSet("DESC",            "Cabinet")
+epicsEnvSet("EGU",             "Cabinet")
+iocshLoad("$(ethercatmc_DIR)ethercatmcCabinet.iocsh")
+
+''')
+
+NC_AXIS = Template('''#
+# AXIS $AXIS_NO$
+#
+epicsEnvSet("AXISCONFIG",      "")
+epicsEnvSet("R",               "$AXIS_NAME$:Mtr")
+epicsEnvSet("AXIS_NO",         "$AXIS_NO$")
+epicsEnvSet("RAWENCSTEP_ADEL", "0")
+epicsEnvSet("RAWENCSTEP_MDEL", "0")
+iocshLoad("$(ethercatmc_DIR)ethercatmcIndexerAxis.iocsh")
+iocshLoad("$(ethercatmc_DIR)ethercatmcAxisdebug.iocsh")
+
+''')
+
+SHUTTER = Template('''#
+# AXIS $AXIS_NO$
+#
+epicsEnvSet("AXISCONFIG",      "")
+epicsEnvSet("R",               "$AXIS_NAME$:Sht")
+epicsEnvSet("AXIS_NO",         "$AXIS_NO$")
+iocshLoad("$(ethercatmc_DIR)ethercatmcShutter.iocsh")
+
+''')
+
+POLLER = Template('''epicsEnvSet("MOVINGPOLLPERIOD", "$MOVING_PERIOD$")
+epicsEnvSet("IDLEPOLLPERIOD",   "$IDLE_PERIOD$")
+ethercatmcStartPoller("$(MOTOR_PORT)", "$(MOVINGPOLLPERIOD)", "$(IDLEPOLLPERIOD)")
+
+iocInit()
+''')
+
+
+def write_st_cmd(file: TextIO, device_collection, mc_unit, ioc_ip, plc_ip,
+                 read_blocks: Optional[List[ReadBlock]] = None,
+                 poll_periods: Tuple[int, int] = (DEFAULT_POLL_PERIOD, DEFAULT_POLL_PERIOD)) -> None:
+    """
+    Streams the IOC st.cmd (iocsh) of one motion control unit to a file handle.
+
+    The st.cmd is stitched together from the precompiled header, cabinet,
+    axis/shutter and poller fragments.
+
+    :param file: The file handle to write to.
+    :param device_collection: The devices of the instrument.
+    :param mc_unit: The motion control unit to render.
+    :param ioc_ip: IP address of the IOC.
+    :param plc_ip: IP address of the PLC.
+    :param read_blocks: The ADS read plan of the unit, set as environment variables if given.
+    :param poll_periods: The moving and idle poll periods of the unit in ms, see src.poll_budget.
+    """
+    devices = device_collection.devices_by_unit[mc_unit]
+
+    HEADER.write(file, PLC_IP=plc_ip, IOC_IP=ioc_ip, INSTRUMENT=device_collection.instrument.upper(),
+                 MC_UNIT=mc_unit, NUM_AXES=len(devices))
+    if read_blocks is not None:
+        by_class = blocks_by_class(read_blocks)
+        READ_BLOCKS.write(file, HOT_BLOCKS=format_blocks(by_class['hot']),
+                          COLD_BLOCKS=format_blocks(by_class['cold']))
+    CONTROLLER.write(file)
+    CABINET.write(file)
+
+    spare_nc_idx = 1
+    spare_pn_idx = 1
+    idx = 1
+    for device in devices:
+        if device.mc_axis_nc is not None:
+            if device.pv_name is not None:
+                axis_name = device.pv_name
+            else:
+                axis_name = device_collection.format_spare_motor(mc_unit, spare_nc_idx)
+                spare_nc_idx += 1
+            NC_AXIS.write(file, AXIS_NO=idx, AXIS_NAME=axis_name)
+            idx += 1
+        elif device.mc_axis_pn is not None:
+            if device.pv_name is not None:
+                axis_name = device.pv_name
+            else:
+                axis_name = device_collection.format_spare_pneumatic(mc_unit, spare_pn_idx)
+                spare_pn_idx += 1
+            SHUTTER.write(file, AXIS_NO=idx, AXIS_NAME=axis_name)
+            idx += 1
+
+    POLLER.write(file, MOVING_PERIOD=poll_periods[0], IDLE_PERIOD=poll_periods[1])
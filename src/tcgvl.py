@@ -0,0 +1,56 @@
+import io
+from typing import Iterable, TextIO
+
+# Everything before the CDATA section of a TwinCAT GVL file
+TCGVL_HEAD = (
+    '<?xml version="1.0" encoding="utf-8"?>\n'
+    '<TcPlcObject Version="1.1.0.1" ProductVersion="3.1.4024.5">\n'
+    '  <GVL Name="GVL_PILS" Id="{ace53d5e-03a7-4e79-9a33-72de579eb8fd}">\n'
+    '    <Declaration><![CDATA['
+)
+
+# Everything after the CDATA section of a TwinCAT GVL file
+TCGVL_TAIL = (
+    ']]></Declaration>\n'
+    '  </GVL>\n'
+    '</TcPlcObject>'
+)
+
+
+def cdata_safe(text: str) -> str:
+    """
+    Splits any ']]>' in the text so it cannot end the CDATA section early.
+    """
+    return text.replace(']]>', ']]]]><![CDATA[>')
+
+
+def write_tcgvl(file: TextIO, declaration_lines: Iterable[str]) -> None:
+    """
+    Streams a GVL file to a text file handle.
+
+    The XML skeleton is fixed, so it is written as is; the declaration lines
+    go into a real CDATA section, one per line and indented by a tab.
+
+    :param file: The file handle to write to.
+    :param declaration_lines: The lines of the GVL declaration, without END_VAR.
+    """
+    file.write(TCGVL_HEAD)
+    separator = ''
+    for line in declaration_lines:
+        file.write(separator)
+        file.write(cdata_safe(line))
+        separator = '\n\t'
+    file.write('\nEND_VAR\n')
+    file.write(TCGVL_TAIL)
+
+
+def render_tcgvl(declaration_lines: Iterable[str]) -> str:
+    """
+    Renders a GVL file to a string.
+
+    :param declaration_lines: The lines of the GVL declaration, without END_VAR.
+    :return: The GVL file content.
+    """
+    buffer = io.StringIO()
+    write_tcgvl(buffer, declaration_lines)
+    return buffer.getvalue()
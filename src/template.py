@@ -0,0 +1,97 @@
+import io
+import re
+from typing import TextIO
+
+# Placeholders look like $NAME$; EPICS macros such as $(NAME) are left alone
+PLACEHOLDER = re.compile(r'\$([A-Z][A-Z0-9_]*)\$')
+
+
+class Template:
+    """
+    A text template with $NAME$ placeholders, tokenised once.
+
+    The text is split into literal segments and placeholder positions when
+    the template is created; rendering only fills in the placeholder slots
+    and joins the precomputed segments.
+    """
+
+    def __init__(self, text: str) -> None:
+        """
+        Initializes a new instance of the Template class.
+
+        :param text: The template text.
+        """
+        self.text = text
+        self.segments = PLACEHOLDER.split(text)
+        # Every odd segment is a placeholder name, stored with the indentation of its line
+        self.fields = [
+            (position, self.segments[position], self._indent(self.segments[position - 1]))
+            for position in range(1, len(self.segments), 2)
+        ]
+
+    @staticmethod
+    def _indent(preceding: str) -> str:
+        """
+        Returns the indentation of a placeholder that starts its line, else ''.
+        """
+        line_start = preceding[preceding.rfind('\n') + 1:]
+        return line_start if not line_start.strip() else ''
+
+    @classmethod
+    def from_file(cls, file_path: str) -> 'Template':
+        """
+        Loads a template from a file.
+
+        :param file_path: The path to the template file.
+        :return: A Template instance.
+        """
+        with open(file_path, 'r') as file:
+            return cls(file.read())
+
+    @property
+    def placeholders(self) -> set:
+        """
+        The names of the placeholders in the template.
+        """
+        return {name for _, name, _ in self.fields}
+
+    def _fill(self, values: dict) -> list:
+        segments = list(self.segments)
+        for position, name, indent in self.fields:
+            value = values[name]
+            if isinstance(value, (list, tuple)):
+                # One line per item, each at the indentation of the placeholder
+                segments[position] = ('\n' + indent).join(value)
+            else:
+                segments[position] = str(value)
+        return segments
+
+    def render(self, **values) -> str:
+        """
+        Renders the template.
+
+        A list value is rendered one item per line; when the placeholder
+        starts its line, every item gets the placeholder's indentation.
+
+        :param values: A value for every placeholder.
+        :return: The rendered text.
+        """
+        return "".join(self._fill(values))
+
+    def write(self, file: TextIO, **values) -> None:
+        """
+        Renders the template straight into a text file handle.
+
+        :param file: The file handle to write to.
+        :param values: A value for every placeholder.
+        """
+        file.writelines(self._fill(values))
+
+
+def render_to_string(write, *args, **kwargs) -> str:
+    """
+    Runs a function that writes to a file handle and returns what it wrote.
+    """
+    buffer = io.StringIO()
+    write(buffer, *args, **kwargs)
+    return buffer.getvalue()
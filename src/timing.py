@@ -0,0 +1,144 @@
+import json
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Optional, Tuple
+
+# The timings being collected, if any. Stages and counters are no-ops
+# while it is None, so the instrumentation costs next to nothing.
+_active: Optional['Timings'] = None
+
+
+class Timings:
+    """
+    Wall time per pipeline stage, plus counters, of one run.
+    """
+
+    def __init__(self) -> None:
+        """
+        Initializes a new instance of the Timings class.
+        """
+        self.seconds: Dict[str, float] = defaultdict(float)
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.counters: Dict[str, int] = defaultdict(int)
+        self.units: Dict[str, Dict[str, int]] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Adds the time spent in the with block to a stage.
+        """
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - started
+            self.calls[name] += 1
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] += n
+
+    def count_unit(self, instrument: str, mc_unit, files: int, size: int) -> None:
+        """
+        Records the files rendered for one motion control unit and their size in bytes.
+        """
+        unit = self.units.setdefault(f"{instrument}/{mc_unit}", {'files': 0, 'bytes': 0})
+        unit['files'] += files
+        unit['bytes'] += size
+
+    def as_dict(self) -> Dict:
+        return {
+            'stages': {name: {'seconds': self.seconds[name], 'calls': self.calls[name]} for name in self.seconds},
+            'counters': dict(self.counters),
+            'units': {name: dict(unit) for name, unit in self.units.items()},
+        }
+
+    def merge(self, data: Dict) -> None:
+        """
+        Adds the timings of another run, e.g. of a worker process, given as returned by as_dict.
+        """
+        for name, stage in data['stages'].items():
+            self.seconds[name] += stage['seconds']
+            self.calls[name] += stage['calls']
+        for name, value in data['counters'].items():
+            self.counters[name] += value
+        for name, unit in data['units'].items():
+            total = self.units.setdefault(name, {'files': 0, 'bytes': 0})
+            total['files'] += unit['files']
+            total['bytes'] += unit['bytes']
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict(), indent=2) + '\n'
+
+    def format_table(self) -> str:
+        """
+        Formats the timings as a plain text summary table.
+        """
+        lines = [f"{'stage':<20} {'calls':>7} {'ms':>10}"]
+        for name, seconds in self.seconds.items():
+            lines.append(f"{name:<20} {self.calls[name]:>7} {seconds * 1000:>10.2f}")
+        if self.counters:
+            lines.append('')
+            lines.extend(f"{name:<20} {value:>18}" for name, value in self.counters.items())
+        if self.units:
+            lines.append('')
+            lines.append(f"{'unit':<20} {'files':>7} {'bytes':>10}")
+            lines.extend(f"{name:<20} {unit['files']:>7} {unit['bytes']:>10}" for name, unit in self.units.items())
+        return '\n'.join(lines) + '\n'
+
+
+def enable() -> Timings:
+    """
+    Starts collecting timings in this process.
+
+    :return: The Timings the stages and counters are added to.
+    """
+    global _active
+    _active = Timings()
+    return _active
+
+
+def disable() -> None:
+    global _active
+    _active = None
+
+
+def active() -> Optional[Timings]:
+    return _active
+
+
+def stage(name: str):
+    """
+    Times a with block as a pipeline stage, if timings are being collected.
+    """
+    if _active is None:
+        return nullcontext()
+    return _active.stage(name)
+
+
+def count(name: str, n: int = 1) -> None:
+    """
+    Increments a counter, if timings are being collected.
+    """
+    if _active is not None:
+        _active.count(name, n)
+
+
+def count_unit(instrument: str, mc_unit, files: int, size: int) -> None:
+    """
+    Records the files rendered for one unit, if timings are being collected.
+    """
+    if _active is not None:
+        _active.count_unit(instrument, mc_unit, files, size)
+
+
+def call_timed(func: Callable, item) -> Tuple:
+    """
+    Calls a function with timings enabled and returns its result along with
+    the timings; the unit of work of a worker process.
+    """
+    timings = enable()
+    try:
+        return func(item), timings.as_dict()
+    finally:
+        disable()
@@ -0,0 +1,72 @@
+import os
+from importlib import metadata
+from typing import Optional
+
+# Environment variable overriding the version stamped into the PILS tables
+VERSION_ENV = 'PILS_GENERATOR_VERSION'
+
+# Distribution name used when the generator is installed as a package
+PACKAGE_NAME = 'pils-epics-generator'
+
+_version = None
+
+
+def set_version(version: str) -> None:
+    """
+    Overrides the version stamped into the generated files.
+
+    The override is also exported to the environment, so worker processes
+    started afterwards use the same version.
+
+    :param version: The version string to use.
+    """
+    global _version
+    _version = version
+    os.environ[VERSION_ENV] = version
+
+
+def get_version() -> str:
+    """
+    Returns the generator version, resolved once on first use.
+
+    The version is taken from the PILS_GENERATOR_VERSION environment
+    variable, else the short git hash of the generator checkout, else the
+    installed package metadata, else 'unknown'.
+
+    :return: The version string.
+    """
+    global _version
+    if _version is None:
+        _version = _resolve_version()
+    return _version
+
+
+def _resolve_version() -> str:
+    version = os.environ.get(VERSION_ENV)
+    if version:
+        return version
+
+    version = _git_version()
+    if version:
+        return version
+
+    try:
+        return metadata.version(PACKAGE_NAME)
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def _git_version() -> Optional[str]:
+    """
+    Returns the short hash of the git checkout the generator runs from, if any.
+    """
+    try:
+        import git
+    except ImportError:
+        return None
+
+    try:
+        repo = git.Repo(os.path.dirname(os.path.abspath(__file__)), search_parent_directories=True)
+        return repo.git.rev_parse("--short", "HEAD")
+    except git.exc.GitError:
+        return None
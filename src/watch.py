@@ -0,0 +1,246 @@
+import os
+import posixpath
+import time
+import zipfile
+from typing import Callable, Dict, List, Optional, Tuple
+from xml.etree import ElementTree
+
+from src.cache import SheetCache
+from src.pipeline import (
+    check_instrument_directories, instrument_directory, read_collection, render_instrument, write_files
+)
+from src.reader import ExcelReader
+from src.sinks import DirectorySink
+
+# Seconds between two stats of the workbook
+DEFAULT_INTERVAL = 0.2
+
+# Workbook parts every sheet depends on: the sheet list and the shared strings table
+SHARED_PARTS = ('xl/workbook.xml', 'xl/_rels/workbook.xml.rels', 'xl/sharedStrings.xml')
+
+_MAIN_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_PACKAGE_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+PartSignatures = Tuple[Tuple, Tuple]
+
+
+def part_signatures(file_path: str) -> Optional[PartSignatures]:
+    """
+    Reads the CRCs of the parts of an xlsx workbook from its zip directory,
+    without decompressing any sheet.
+
+    :param file_path: The path of the workbook.
+    :return: The CRCs of the shared parts and the CRC of every worksheet in
+             sheet order, or None if the file is not a readable xlsx package.
+    """
+    try:
+        with zipfile.ZipFile(file_path) as package:
+            crcs = {info.filename: info.CRC for info in package.infolist()}
+            workbook = ElementTree.fromstring(package.read('xl/workbook.xml'))
+            relationships = ElementTree.fromstring(package.read('xl/_rels/workbook.xml.rels'))
+    except (OSError, KeyError, zipfile.BadZipFile, ElementTree.ParseError):
+        return None
+
+    targets = {}
+    for relationship in relationships.iter(f'{_PACKAGE_REL_NS}Relationship'):
+        target = relationship.get('Target', '')
+        if target.startswith('/'):
+            target = target[1:]
+        else:
+            target = posixpath.normpath(posixpath.join('xl', target))
+        targets[relationship.get('Id')] = target
+
+    sheets = tuple(crcs.get(targets.get(sheet.get(f'{_REL_NS}id')))
+                   for sheet in workbook.iter(f'{_MAIN_NS}sheet'))
+    shared = tuple(crcs.get(part) for part in SHARED_PARTS)
+    return shared, sheets
+
+
+def changed_sheets(previous: Optional[PartSignatures], current: Optional[PartSignatures],
+                   sheet_indices: List[int]) -> List[int]:
+    """
+    Works out which of the watched sheets may have changed between two
+    versions of a workbook.
+
+    Every sheet counts as changed if the shared parts changed, e.g. a new
+    string in the shared strings table, or if either version could not be
+    inspected.
+
+    :param previous: The part signatures of the previous version.
+    :param current: The part signatures of the current version.
+    :param sheet_indices: The watched sheets.
+    :return: The watched sheets that need to be read again.
+    """
+    if previous is None or current is None or previous[0] != current[0] or len(previous[1]) != len(current[1]):
+        return list(sheet_indices)
+    return [sheet_index for sheet_index in sheet_indices
+            if sheet_index >= len(current[1]) or previous[1][sheet_index] != current[1][sheet_index]]
+
+
+def _stat_signature(file_path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+def _rendered_units(device_collection, files: List[Tuple[str, str]], manifest: Dict) -> List:
+    # The units some of whose files were rendered
+    file_names = {file_name for file_name, _ in files}
+    return [mc_unit for mc_unit in device_collection.devices_by_unit
+            if file_names.intersection(manifest['units'][str(mc_unit)]['files'])]
+
+
+class WorkbookWatcher:
+    """
+    Regenerates the outputs of a workbook whenever it is saved.
+
+    The workbook is polled with stat. Once a change has settled, only the
+    sheets whose worksheet part changed are read again, and of those only
+    the motion control units whose devices or options changed are rendered
+    and written.
+    """
+
+    def __init__(self, file_path: str, sheet_indices: List[int], output_dir: str = '.',
+                 per_instrument: bool = False, cache: Optional[SheetCache] = None, incremental: bool = False,
+                 jobs: int = 1, interval: float = DEFAULT_INTERVAL,
+                 log: Optional[Callable[[str], None]] = print, **outputs) -> None:
+        """
+        Initializes a new instance of the WorkbookWatcher class.
+
+        :param file_path: The path of the workbook.
+        :param sheet_indices: The sheets to generate.
+        :param output_dir: The directory the files are written to.
+        :param per_instrument: Write every instrument into its own sub-directory, as batch runs do.
+        :param cache: The parsed-sheet cache, if any.
+        :param incremental: Keep a manifest, and skip the units it shows unchanged on the first run.
+        :param jobs: The number of worker processes the units are spread over.
+        :param interval: The seconds between two polls.
+        :param log: Called with a line describing every regeneration, if given.
+        :param outputs: Keyword arguments passed on to render_unit.
+        """
+        self.file_path = file_path
+        self.sheet_indices = list(sheet_indices)
+        self.sink = DirectorySink(output_dir)
+        self.per_instrument = per_instrument
+        self.cache = cache
+        self.incremental = incremental
+        self.jobs = jobs
+        self.interval = interval
+        self.log = log
+        self.outputs = outputs
+        self.manifests: Dict[int, Dict] = {}
+        self.instruments: Dict[int, str] = {}
+        self.stat_signature = None
+        self.parts = None
+
+    def _directory(self, instrument_name: str) -> str:
+        return instrument_directory(instrument_name) if self.per_instrument else ''
+
+    def generate(self, sheet_indices: Optional[List[int]] = None) -> Dict[int, List]:
+        """
+        Reads sheets and renders the units that changed since the last call.
+
+        :param sheet_indices: The sheets to read, all watched sheets if None.
+        :return: The units rendered, by sheet index.
+        """
+        if sheet_indices is None:
+            sheet_indices = self.sheet_indices
+
+        sheets = []
+        with ExcelReader(self.file_path, cache=self.cache) as excel_reader:
+            for sheet_index in sheet_indices:
+                device_collection = read_collection(excel_reader, sheet_index)
+                directory = self._directory(device_collection.instrument)
+                # Later runs compare with the last generation; the first one with the manifest on disk,
+                # if incremental, or renders every unit
+                previous = self.manifests.get(sheet_index)
+                if previous is None and not self.incremental:
+                    previous = {'units': {}}
+                files, manifest = render_instrument(device_collection, self.sink.file_path(directory or '.'),
+                                                    jobs=self.jobs, incremental=self.incremental,
+                                                    previous_manifest=previous, **self.outputs)
+                sheets.append((sheet_index, device_collection, files, manifest))
+
+        instruments = dict(self.instruments)
+        instruments.update((sheet_index, device_collection.instrument)
+                           for sheet_index, device_collection, _, _ in sheets)
+        if self.per_instrument:
+            check_instrument_directories(sorted(instruments.items()))
+
+        rendered = {}
+        for sheet_index, device_collection, files, manifest in sheets:
+            write_files(self.sink, files, manifest if self.incremental else None,
+                        directory=self._directory(device_collection.instrument))
+            self.manifests[sheet_index] = manifest
+            rendered[sheet_index] = _rendered_units(device_collection, files, manifest)
+        self.instruments = instruments
+        return rendered
+
+    def start(self) -> Dict[int, List]:
+        """
+        Records the current state of the workbook and generates every watched sheet.
+
+        :return: The units rendered, by sheet index.
+        """
+        self.stat_signature = _stat_signature(self.file_path)
+        self.parts = part_signatures(self.file_path)
+        return self._generate_logged(self.sheet_indices)
+
+    def poll(self) -> Optional[Dict[int, List]]:
+        """
+        Checks the workbook once and regenerates what changed.
+
+        A change is only acted upon once the file stopped changing for one
+        interval and is a readable workbook again, so half-written saves are
+        never read.
+
+        :return: The units rendered by sheet index, or None if nothing was read.
+        """
+        signature = _stat_signature(self.file_path)
+        if signature is None or signature == self.stat_signature:
+            return None
+
+        time.sleep(self.interval)
+        if _stat_signature(self.file_path) != signature:
+            return None
+        parts = part_signatures(self.file_path)
+        if parts is None:
+            return None
+
+        sheet_indices = changed_sheets(self.parts, parts, self.sheet_indices)
+        self.stat_signature = signature
+        self.parts = parts
+        if not sheet_indices:
+            return {}
+        return self._generate_logged(sheet_indices)
+
+    def _generate_logged(self, sheet_indices: List[int]) -> Dict[int, List]:
+        started = time.perf_counter()
+        try:
+            rendered = self.generate(sheet_indices)
+        except Exception as e:
+            # A broken save must not end the watch; the next save is tried again
+            if self.log:
+                self.log(f"Could not generate {self.file_path}: {e}")
+            return {}
+
+        if self.log:
+            elapsed = time.perf_counter() - started
+            units = sum(len(units) for units in rendered.values())
+            self.log(f"Regenerated {units} unit(s) of {len(rendered)} sheet(s) in {elapsed:.2f} s")
+        return rendered
+
+    def run(self) -> None:
+        """
+        Generates every watched sheet, then regenerates on every change until interrupted.
+        """
+        self.start()
+        try:
+            while True:
+                time.sleep(self.interval)
+                self.poll()
+        except KeyboardInterrupt:
+            pass
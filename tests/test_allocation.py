@@ -0,0 +1,178 @@
+import copy
+import json
+import os
+
+import pytest
+from src.allocation import (
+    ALLOCATION_FILE_NAME, AllocationOptions, allocate, headroom_ignored, parse_tcgvl, read_allocation_file,
+    unit_allocation
+)
+from src.layout import build_layout
+from src.pipeline import build_collection, generate_outputs
+from src.reader import ExcelReader, COLUMNS_INDEX
+
+
+def data_file_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+@pytest.fixture
+def device_collection():
+    with ExcelReader(data_file_path("multi_sheet_test.xlsx")) as reader:
+        return build_collection(*reader.read_sheet_by_index(0, COLUMNS_INDEX))
+
+
+def new_motor(device_collection, axis):
+    device = copy.copy(device_collection.devices_by_unit[1][0])
+    device.mc_axis_nc = axis
+    device.pils_name = f"NewAxis{axis}"
+    device.has_temp = True
+    return device
+
+
+def assert_valid(slots):
+    assert sorted(slot.index for slot in slots) == list(range(1, len(slots) + 1))
+    by_offset = sorted(slots, key=lambda slot: slot.offset)
+    for previous, slot in zip(by_offset, by_offset[1:]):
+        assert slot.offset % slot.alignment == 0
+        assert slot.offset >= previous.end
+
+
+def test_new_unit_is_laid_out_as_usual(device_collection):
+    slots = build_layout(device_collection.devices_by_unit[1])
+
+    assert allocate(slots, {}) == slots
+
+
+def test_headroom_is_kept_before_the_system_block(device_collection):
+    slots = build_layout(device_collection.devices_by_unit[1])
+
+    allocated = allocate(slots, {}, headroom=64)
+
+    assert [slot.offset for slot in allocated if slot.kind not in ('pressure', 'ptp', 'cabinet')] == \
+        [slot.offset for slot in slots if slot.kind not in ('pressure', 'ptp', 'cabinet')]
+    assert allocated[-1].offset == slots[-1].offset + 64
+
+
+def test_inserted_axis_keeps_the_other_offsets(device_collection):
+    devices = device_collection.devices_by_unit[1]
+    previous = allocate(build_layout(devices), {}, headroom=64)
+
+    allocated = allocate(build_layout(devices[:1] + [new_motor(device_collection, 9)] + devices[1:]),
+                         unit_allocation(previous), headroom=64)
+
+    kept = {slot.variable: (slot.offset, slot.index) for slot in allocated}
+    for slot in previous:
+        assert kept[slot.variable] == (slot.offset, slot.index)
+    motor = next(slot for slot in allocated if slot.variable == 'stMotorM9')
+    assert previous[-1].offset > motor.offset > max(slot.offset for slot in previous if slot.kind == 'sensor')
+    assert {kept['stMotorM9'][1], kept['stMotorM9Temp'][1]} == {18, 19}
+    assert_valid(allocated)
+
+
+def test_removed_device_keeps_indices_contiguous(device_collection):
+    devices = device_collection.devices_by_unit[1]
+    previous = build_layout(devices)
+
+    allocated = allocate(build_layout(devices[:1] + devices[2:]), unit_allocation(previous))
+
+    kept = {slot.variable: slot for slot in previous}
+    assert all(slot.offset == kept[slot.variable].offset for slot in allocated)
+    assert_valid(allocated)
+
+
+def test_changed_type_is_placed_again(device_collection):
+    slots = build_layout(device_collection.devices_by_unit[1])
+    previous = unit_allocation(slots)
+    previous['stCabinetStatus'] = previous['stCabinetStatus']._replace(device_type='1A04')
+
+    allocated = allocate(slots, previous)
+
+    # Its old place is free again, but it goes into the first free space it fits
+    assert allocated[-1].offset == 196
+    assert allocated[:-1] == slots[:-1]
+    assert_valid(allocated)
+
+
+def test_allocation_is_read_back_from_pils_table(device_collection):
+    assert parse_tcgvl(device_collection.render_xml(1)) == unit_allocation(device_collection.layout(1))
+
+
+@pytest.mark.parametrize("keep_allocation_file", [True, False])
+def test_regeneration_keeps_offsets(device_collection, tmp_path, keep_allocation_file):
+    # Given
+    allocation = AllocationOptions(headroom=64)
+    generate_outputs(device_collection, output_dir=str(tmp_path), pils=True, allocation=allocation)
+    before = json.loads((tmp_path / ALLOCATION_FILE_NAME).read_text())['instruments']['YMIR']['units']['1']
+    if not keep_allocation_file:
+        os.remove(tmp_path / ALLOCATION_FILE_NAME)
+    devices = device_collection.devices_by_unit[1]
+    devices.insert(2, new_motor(device_collection, 9))
+
+    # When
+    generate_outputs(device_collection, output_dir=str(tmp_path), pils=True, allocation=allocation)
+
+    # Then
+    after = json.loads((tmp_path / ALLOCATION_FILE_NAME).read_text())['instruments']['YMIR']['units']['1']
+    assert all(after[variable] == placement for variable, placement in before.items())
+    assert set(after) - set(before) == {'stMotorM9', 'stMotorM9Temp'}
+    tcgvl = (tmp_path / "mc_unit_1.TcGVL").read_text()
+    assert "stMotorM1 AT %MB128: ST_5010;" in tcgvl
+    assert "astDevices: ARRAY [1..19] OF ST_DeviceInfo" in tcgvl
+
+
+def test_headroom_is_kept_before_a_system_block_placed_anew(device_collection):
+    slots = build_layout(device_collection.devices_by_unit[1])
+    previous = {variable: placement for variable, placement in unit_allocation(slots).items()
+                if not variable.startswith(('stPressure', 'stPTP', 'stSystem', 'stCabinet'))}
+
+    allocated = allocate(slots, previous, headroom=64)
+
+    assert allocated[:-7] == slots[:-7]
+    assert [slot.offset for slot in allocated[-7:]] == [slot.offset + 64 for slot in slots[-7:]]
+    assert not headroom_ignored(allocated, previous, 64)
+    assert_valid(allocated)
+
+
+def test_headroom_of_a_kept_system_block_is_reported(device_collection, tmp_path, capsys):
+    generate_outputs(device_collection, output_dir=str(tmp_path), pils=True)
+
+    generate_outputs(device_collection, output_dir=str(tmp_path), pils=True,
+                     allocation=AllocationOptions(headroom=64))
+
+    assert "YMIR unit 1: headroom ignored, the system block keeps its previous offset %MB264" in \
+        capsys.readouterr().err
+    assert "stCabinetStatus AT %MB320: ST_1802;" in (tmp_path / "mc_unit_1.TcGVL").read_text()
+
+
+def test_allocation_file_is_updated(device_collection, tmp_path):
+    # Given
+    path = tmp_path / "shared-allocation.json"
+    allocation = AllocationOptions(allocation_file=str(path))
+    generate_outputs(device_collection, output_dir=str(tmp_path / "first"), pils=True, allocation=allocation)
+    data = json.loads(path.read_text())
+    data['instruments']['OTHER'] = {'units': {}}
+    path.write_text(json.dumps(data))
+    before = data['instruments']['YMIR']['units']['1']
+    device_collection.devices_by_unit[1].insert(0, new_motor(device_collection, 9))
+
+    # When
+    generate_outputs(device_collection, output_dir=str(tmp_path / "second"), pils=True, allocation=allocation)
+
+    # Then
+    instruments = json.loads(path.read_text())['instruments']
+    assert sorted(instruments) == ['OTHER', 'YMIR']
+    after = instruments['YMIR']['units']['1']
+    assert all(after[variable] == placement for variable, placement in before.items())
+    assert 'stMotorM9' in after
+
+
+def test_allocation_file_of_another_version_is_rejected(tmp_path):
+    path = tmp_path / ALLOCATION_FILE_NAME
+    path.write_text(json.dumps({'version': 0, 'instruments': {}}))
+
+    with pytest.raises(ValueError, match="is not a version 1 allocation file"):
+        read_allocation_file(str(path))
+    path.write_text("not json")
+    with pytest.raises(ValueError, match="is not a version 1 allocation file"):
+        read_allocation_file(str(path))
@@ -0,0 +1,52 @@
+import time
+
+from bench.run_bench import STAGES, run_once, summarise
+from bench.workbook import WorkbookShape, write_workbook
+from src.pipeline import build_collection
+from src.reader import ExcelReader, COLUMNS_INDEX
+
+
+def test_synthetic_workbook_matches_shape(tmp_path):
+    shape = WorkbookShape(sheets=2, units=3, axes=5, pneumatics=2, sensors=1, temp_every=2, extra_every=2,
+                          spare_every=3)
+    path = str(tmp_path / "bench.xlsx")
+
+    instruments = write_workbook(path, shape)
+
+    assert instruments == ['BENCH1', 'BENCH2']
+    with ExcelReader(path) as reader:
+        df, instrument_name = reader.read_sheet_by_index(1, COLUMNS_INDEX)
+    collection = build_collection(df, instrument_name)
+    assert instrument_name == 'BENCH2'
+    assert len(df) == shape.devices_per_sheet
+    assert {mc_unit: len(devices) for mc_unit, devices in collection.devices_by_unit.items()} == {1: 8, 2: 8, 3: 8}
+    assert [device.ptp for device in collection.devices_by_unit[2]] == [False] * 8
+    assert sum(device.pv_name is None for device in collection.devices_by_unit[1]) == 2
+    assert sum(device.has_extra for device in collection.devices_by_unit[1]) == 3
+    assert 'stMotorM4Extra AT %MB' in collection.render_xml(3)
+
+
+def test_run_once_times_every_stage(tmp_path):
+    path = str(tmp_path / "bench.xlsx")
+    write_workbook(path, WorkbookShape(units=2, axes=3))
+
+    runs = [run_once(path), run_once(path)]
+
+    assert set(runs[0]['seconds']) == set(STAGES)
+    assert runs[0]['counts']['units'] == 2
+    assert set(summarise(runs)) == set(STAGES) | {'total'}
+
+
+def test_stages_add_up_to_the_run(tmp_path):
+    path = str(tmp_path / "bench.xlsx")
+    write_workbook(path, WorkbookShape(units=2, axes=3))
+
+    started = time.perf_counter()
+    run = run_once(path)
+    elapsed = time.perf_counter() - started
+
+    assert sum(run['seconds'].values()) <= elapsed
+    with ExcelReader(path) as reader:
+        collection = build_collection(*reader.read_sheet_by_index(0, COLUMNS_INDEX))
+    assert run['counts']['xml_bytes'] == sum(len(collection.render_xml(mc_unit).encode('utf-8'))
+                                             for mc_unit in collection.devices_by_unit)
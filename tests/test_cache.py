@@ -0,0 +1,83 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+from src.cache import SheetCache
+from src.reader import ExcelReader, COLUMNS_INDEX
+
+
+def data_file_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return SheetCache(str(tmp_path / "cache"))
+
+
+def test_cached_sheet_is_identical(cache):
+    # Given
+    expected, expected_name = ExcelReader(data_file_path("multi_sheet_test.xlsx")).read_sheet_by_index(
+        0, COLUMNS_INDEX)
+    ExcelReader(data_file_path("multi_sheet_test.xlsx"), cache=cache).read_sheet_by_index(0, COLUMNS_INDEX)
+
+    # When
+    reader = ExcelReader(data_file_path("multi_sheet_test.xlsx"), cache=cache)
+    df, instrument_name = reader.read_sheet_by_index(0, COLUMNS_INDEX)
+
+    # Then
+    assert reader._excel_file is None  # served from the cache without parsing the workbook
+    assert instrument_name == expected_name
+    pd.testing.assert_frame_equal(df, expected)
+    assert [type(value) for value in df['pv_name']] == [type(value) for value in expected['pv_name']]
+
+
+def test_cache_key_follows_workbook_content(cache, tmp_path):
+    workbook = str(tmp_path / "workbook.xlsx")
+    shutil.copy(data_file_path("multi_sheet_test.xlsx"), workbook)
+    key = cache.key(ExcelReader(workbook).file_hash, 0, COLUMNS_INDEX, [])
+
+    with open(workbook, 'ab') as file:
+        file.write(b'\0')
+
+    assert cache.key(ExcelReader(workbook).file_hash, 0, COLUMNS_INDEX, []) != key
+    assert cache.key(ExcelReader(workbook).file_hash, 1, COLUMNS_INDEX, []) != key
+
+
+def test_cache_evicts_least_recently_used(cache):
+    df = pd.DataFrame({'pv_name': ['a', 0], 'mc_unit': [1, 2]})
+    cache.store('first', df, 'YMIR')
+    entry_size = os.path.getsize(os.path.join(cache.cache_dir, 'first.parquet'))
+    cache.max_bytes = 2 * entry_size
+    os.utime(os.path.join(cache.cache_dir, 'first.parquet'), (0, 0))
+    cache.store('second', df, 'YMIR')
+
+    cache.store('third', df, 'YMIR')
+
+    assert cache.load('first') is None
+    assert cache.load('second') is not None
+    assert cache.load('third') is not None
+
+
+@pytest.mark.parametrize("metadata", [None, {b'other': b'{}'}, {b'pils_generator': b'{}'}])
+def test_foreign_parquet_file_is_a_miss(cache, metadata):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(cache.cache_dir, exist_ok=True)
+    table = pa.table({'pv_name': ['a']}).replace_schema_metadata(metadata)
+    pq.write_table(table, os.path.join(cache.cache_dir, 'foreign.parquet'))
+
+    assert cache.load('foreign') is None
+
+
+def test_entry_evicted_while_loading_is_a_miss(cache, monkeypatch):
+    cache.store('entry', pd.DataFrame({'pv_name': ['a', 0]}), 'YMIR')
+
+    def evicted(path):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(os, 'utime', evicted)
+
+    assert cache.load('entry') is None
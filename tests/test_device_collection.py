@@ -1,7 +1,7 @@
 import pandas as pd
 import os
-from src.reader import ExcelReader
-from src.device import Device, DeviceCollection
+from src.reader import ExcelReader, COLUMNS_INDEX as SHEET_COLUMNS_INDEX
+from src.device import Device, DeviceCollection, normalise_dataframe
 
 import pytest
 
@@ -157,3 +157,78 @@ def test_write_xml(reader):
     device_collection.from_dataframe(df)
 
     device_collection.to_xml()
+
+
+@pytest.fixture
+def multi_sheet_dataframe():
+    reader = ExcelReader(data_file_path("multi_sheet_test.xlsx"))
+    df, _ = reader.read_sheet_by_index(0, SHEET_COLUMNS_INDEX)
+    reader.close()
+    return df
+
+
+def test_from_dataframe_matches_row_factory(multi_sheet_dataframe):
+    # Given
+    expected = [Device.from_dataframe_row(row).to_dict() for _, row in multi_sheet_dataframe.iterrows()]
+
+    # When
+    device_collection = DeviceCollection("YMIR")
+    device_collection.from_dataframe(multi_sheet_dataframe)
+    devices = [device.to_dict() for devices in device_collection.devices_by_unit.values() for device in devices]
+
+    # Then
+    assert devices == expected
+    assert [device['device_type'] for device in devices] == ['5010', '5010', '5010', '1E04', '1E04', '1302',
+                                                              '5010', '5010']
+
+
+def test_normalise_dataframe_defaults(multi_sheet_dataframe):
+    normalised = normalise_dataframe(multi_sheet_dataframe)
+    spare, slit, rotation, shutter = (normalised.iloc[idx] for idx in range(4))
+
+    assert spare['pv_name'] is None
+    assert spare['has_temp'] == False
+    assert spare['temp_units'] == 'c'
+    assert spare['ptp'] == True
+    assert spare['mc_axis_pn'] is None
+    assert slit['has_temp'] == True
+    assert rotation['extra_type'] == '1201'
+    assert shutter['pils_unit'] == 'mm'
+    assert shutter['mc_axis_pn'] == 1
+
+
+def test_normalise_dataframe_undefined_device_type(multi_sheet_dataframe):
+    df = multi_sheet_dataframe.copy()
+    df.loc[5, ['extra_type', 'has_temp']] = pd.NA
+
+    with pytest.raises(ValueError):
+        normalise_dataframe(df)
+
+
+def test_device_has_no_instance_dict(multi_sheet_dataframe):
+    device = Device.from_dataframe_row(multi_sheet_dataframe.iloc[0])
+
+    assert not hasattr(device, '__dict__')
+    with pytest.raises(AttributeError):
+        device.unknown = 1
+
+
+def test_device_table(multi_sheet_dataframe):
+    # Given
+    device_collection = DeviceCollection("YMIR")
+    device_collection.from_dataframe(multi_sheet_dataframe)
+
+    # When
+    table = device_collection.device_table(1)
+
+    # Then
+    assert len(table) == 6
+    assert list(table['type_code']) == [0x5010, 0x5010, 0x5010, 0x1E04, 0x1E04, 0x1302]
+    assert list(table['mc_axis_nc']) == [1, 2, 3, -1, -1, -1]
+    assert list(table['mc_axis_pn']) == [-1, -1, -1, 1, 2, -1]
+    assert list(table['temp_unit_code']) == [0, 0x0009, 0x0008, 0x0009, 0, 0x0009]
+    assert list(table['extra_type_code']) == [0, 0, 0x1201, 0, 0, 0x1302]
+    assert list(table['is_spare']) == [True, False, False, False, True, False]
+    assert list(table.is_motor) == [True, True, True, False, False, False]
+    assert list(table.is_pneumatic) == [False, False, False, True, True, False]
+    assert table.pils_names[0] == 'SpareM1'
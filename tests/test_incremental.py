@@ -0,0 +1,93 @@
+import json
+import os
+
+import pytest
+from src.incremental import MANIFEST_FILE_NAME, write_if_changed
+from src.pipeline import build_collection, generate_outputs, render_instrument
+from src.reader import ExcelReader, COLUMNS_INDEX
+
+OUTPUTS = dict(pils=True, ioc=True, opi=True, ioc_ip='10.0.0.1', plc_ip='10.0.0.2')
+
+
+def data_file_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+@pytest.fixture
+def sheet():
+    reader = ExcelReader(data_file_path("multi_sheet_test.xlsx"))
+    df, instrument_name = reader.read_sheet_by_index(0, COLUMNS_INDEX)
+    reader.close()
+    return df, instrument_name
+
+
+def test_write_if_changed(tmp_path):
+    file_path = str(tmp_path / "file.txt")
+
+    assert write_if_changed(file_path, "a")
+    assert not write_if_changed(file_path, "a")
+    assert write_if_changed(file_path, "b")
+    assert open(file_path).read() == "b"
+    assert os.listdir(tmp_path) == ["file.txt"]
+
+
+def test_first_run_renders_everything_and_writes_manifest(sheet, tmp_path):
+    generate_outputs(build_collection(*sheet), output_dir=str(tmp_path), incremental=True, **OUTPUTS)
+
+    manifest = json.load(open(tmp_path / MANIFEST_FILE_NAME))
+    assert sorted(manifest['units']) == ['1', '2']
+    assert manifest['units']['2']['files'] == ['mc_unit_2.TcGVL', 'st.ymir-mcs2.iocsh', 'IOC-YMIR-MCS2.mid']
+    assert len(os.listdir(tmp_path)) == 7
+
+
+def test_unchanged_units_are_skipped(sheet, tmp_path):
+    # Given
+    generate_outputs(build_collection(*sheet), output_dir=str(tmp_path), incremental=True, **OUTPUTS)
+    df, instrument_name = sheet
+    df = df.copy()
+    df.loc[df['mc_unit'] == 2, 'pils_name'] = 'Renamed'
+
+    # When
+    unchanged, _ = render_instrument(build_collection(*sheet), str(tmp_path), incremental=True, **OUTPUTS)
+    changed, _ = render_instrument(build_collection(df, instrument_name), str(tmp_path), incremental=True,
+                                   **OUTPUTS)
+
+    # Then
+    assert unchanged == []
+    assert [file_name for file_name, _ in changed] == ['mc_unit_2.TcGVL', 'st.ymir-mcs2.iocsh',
+                                                       'IOC-YMIR-MCS2.mid']
+
+
+def test_missing_files_and_new_options_are_regenerated(sheet, tmp_path):
+    generate_outputs(build_collection(*sheet), output_dir=str(tmp_path), incremental=True, **OUTPUTS)
+    os.remove(tmp_path / "mc_unit_1.TcGVL")
+
+    missing, _ = render_instrument(build_collection(*sheet), str(tmp_path), incremental=True, **OUTPUTS)
+    new_ip, _ = render_instrument(build_collection(*sheet), str(tmp_path), incremental=True,
+                                  **dict(OUTPUTS, plc_ip='10.0.0.3'))
+
+    assert [file_name for file_name, _ in missing] == ['mc_unit_1.TcGVL', 'st.ymir-mcs1.iocsh', 'IOC-YMIR-MCS1.mid']
+    assert len(new_ip) == 6
+
+
+def test_unchanged_files_are_not_rewritten(sheet, tmp_path):
+    generate_outputs(build_collection(*sheet), output_dir=str(tmp_path), **OUTPUTS)
+    file_path = tmp_path / "mc_unit_1.TcGVL"
+    os.utime(file_path, (0, 0))
+
+    generate_outputs(build_collection(*sheet), output_dir=str(tmp_path), **OUTPUTS)
+
+    assert os.stat(file_path).st_mtime == 0
+
+
+def test_written_files_follow_umask(tmp_path):
+    umask = os.umask(0o022)
+    try:
+        write_if_changed(str(tmp_path / "new.txt"), 'a')
+    finally:
+        os.umask(umask)
+    assert (tmp_path / "new.txt").stat().st_mode & 0o777 == 0o644
+
+    os.chmod(tmp_path / "new.txt", 0o664)
+    write_if_changed(str(tmp_path / "new.txt"), 'b')
+    assert (tmp_path / "new.txt").stat().st_mode & 0o777 == 0o664
@@ -0,0 +1,129 @@
+import os
+import re
+
+import pytest
+from src.device import DeviceCollection
+from src.allocation import allocate
+from src.layout import (
+    align_mb, build_layout, device_shape, image_size, layout_shapes, order_indices, pack_layout, render_definition,
+    render_description, shape_pattern, system_entries, pils_device_byte_lengths, LayoutOptions, PILS_START_OFFSET
+)
+from src.reader import ExcelReader, COLUMNS_INDEX
+
+
+def data_file_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+@pytest.fixture
+def device_collection():
+    reader = ExcelReader(data_file_path("multi_sheet_test.xlsx"))
+    df, instrument_name = reader.read_sheet_by_index(0, COLUMNS_INDEX)
+    reader.close()
+    collection = DeviceCollection(instrument_name)
+    collection.from_dataframe(df)
+    return collection
+
+
+def test_layout_of_unit(device_collection):
+    slots = device_collection.layout(1)
+
+    assert [(slot.device_type, slot.offset) for slot in slots] == [
+        ('5010', 128), ('5010', 160), ('1302', 192), ('5010', 200), ('1302', 232), ('1201', 236),
+        ('1E04', 240), ('1302', 248), ('1E04', 252), ('1302', 260), ('1B08', 264),
+        ('1A04', 280), ('1A04', 288), ('1201', 296), ('1A04', 300), ('1204', 312), ('1802', 320),
+    ]
+    assert [slot.index for slot in slots] == list(range(1, 18))
+    assert [slot.kind for slot in slots[:6]] == ['motor', 'motor', 'temp', 'motor', 'temp', 'extra']
+
+
+def test_layout_slots_are_aligned_and_disjoint(device_collection):
+    for mc_unit in device_collection.devices_by_unit:
+        slots = device_collection.layout(mc_unit)
+        assert slots[0].offset == PILS_START_OFFSET
+        for previous, slot in zip(slots, slots[1:]):
+            assert slot.offset % slot.alignment == 0
+            assert slot.offset >= previous.end
+
+
+def test_layout_without_pneumatics_or_ptp(device_collection):
+    slots = device_collection.layout(2)
+
+    assert [slot.kind for slot in slots] == ['motor', 'motor', 'cabinet']
+
+
+def test_definition_and_description_share_offsets(device_collection):
+    slots = build_layout(device_collection.devices_by_unit[1])
+
+    definition = "\n".join(render_definition(slots))
+    description = render_description(slots)
+
+    assert description[1] == "astDevices: ARRAY [1..17] OF ST_DeviceInfo :=["
+    assert description[-1].endswith(")];")
+    for slot, entry in zip(slots, description[2:]):
+        assert f"{slot.variable} AT %MB{slot.offset}: ST_{slot.device_type};" in definition
+        assert f"nOffset := {slot.offset}" in entry
+    assert "fbPneumaticP2: FB_1E04_Pneumatic := (nPILSDeviceNumber := 9);" in definition
+
+
+@pytest.mark.parametrize("shape", [('5010', '1302', '1A04'), ('1E04', '1302'), ('1302',), ('1A04', '1201', '1204')])
+def test_shape_pattern_matches_aligning_every_slot(shape):
+    for base in range(100, 117):
+        offset = base
+        expected = []
+        for device_type in shape:
+            offset = align_mb(offset, device_type)
+            expected.append(offset)
+            offset += pils_device_byte_lengths[device_type]
+
+        pattern = shape_pattern(shape, base)
+
+        assert [base + slot.offset for slot in pattern.slots] == expected
+        assert base + pattern.size == offset
+
+
+def test_layout_shapes_matches_build_layout(device_collection):
+    devices = device_collection.devices_by_unit[1]
+    slots = build_layout(devices)
+    shapes = [device_shape(device) for device in devices]
+    shapes.append(tuple(entry[1] for entry in system_entries(True, devices[0].ptp)))
+
+    offsets = layout_shapes(shapes)
+
+    assert [offset for shape_offsets in offsets for offset in shape_offsets] == [slot.offset for slot in slots]
+
+
+def test_packed_layout_has_no_padding(device_collection):
+    slots = build_layout(device_collection.devices_by_unit[1])
+
+    packed = pack_layout(slots)
+
+    assert image_size(packed) == sum(slot.length for slot in slots) == 184
+    assert image_size(slots) == 196
+    assert [slot.index for slot in packed] == [slot.index for slot in slots]
+    by_offset = sorted(packed, key=lambda slot: slot.offset)
+    assert by_offset[0].offset == PILS_START_OFFSET
+    for previous, slot in zip(by_offset, by_offset[1:]):
+        assert slot.offset % slot.alignment == 0
+        assert slot.offset == previous.end
+
+
+def test_indices_can_follow_memory_order(device_collection):
+    packed = pack_layout(build_layout(device_collection.devices_by_unit[1]))
+
+    ordered = order_indices(packed, 'memory')
+
+    assert [slot.offset for slot in sorted(ordered, key=lambda slot: slot.index)] == \
+        sorted(slot.offset for slot in packed)
+    assert allocate(ordered, {}) == ordered
+
+
+def test_packed_pils_table_lists_devices_in_index_order(device_collection):
+    device_collection.layout_options = LayoutOptions(pack=True)
+    slots = device_collection.layout(1)
+
+    description = render_description(slots)
+
+    assert [int(re.search(r"nOffset := (\d+)", line).group(1)) for line in description[2:]] == \
+        [slot.offset for slot in sorted(slots, key=lambda slot: slot.index)]
+    assert slots[2].kind == 'temp' and f"nOffset := {slots[2].offset}" in description[2 + 2]
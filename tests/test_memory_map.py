@@ -0,0 +1,104 @@
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from src.layout import Slot
+from src.memory_map import MEMORY_MAP_DTYPE, RECORDS_HEADER, memory_map_records, read_records
+from src.pipeline import build_collection, generate_outputs
+from src.reader import ExcelReader, COLUMNS_INDEX
+from src.sinks import MemorySink
+
+
+def data_file_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+@pytest.fixture
+def device_collection():
+    with ExcelReader(data_file_path("multi_sheet_test.xlsx")) as reader:
+        return build_collection(*reader.read_sheet_by_index(0, COLUMNS_INDEX))
+
+
+def test_records_match_layout(device_collection):
+    slots = device_collection.layout(1)
+
+    records = device_collection.memory_map(1)
+
+    assert len(records) == len(slots)
+    assert list(records['index']) == [slot.index for slot in slots]
+    assert list(records['offset']) == [slot.offset for slot in slots]
+    assert list(records['length']) == [slot.length for slot in slots]
+    assert [f"{code:04X}" for code in records['type_code']] == [slot.device_type for slot in slots]
+    assert records[0]['unit_code'] == 0xFD04
+    assert records[2]['kind'] == b'temp' and records[2]['unit_code'] == 0x0009
+    assert records[-1]['name'] == b'Cabinet#0' and records[-1]['unit_code'] == 0
+    assert set(records['mc_unit']) == {1}
+
+
+def test_records_file_is_indexed_by_pils_index(device_collection, tmp_path):
+    device_collection.to_memory_map('records', output_dir=str(tmp_path))
+    path = str(tmp_path / "mc_unit_1.pilsmap")
+
+    records = read_records(path)
+
+    assert os.path.getsize(path) == RECORDS_HEADER.size + len(records) * MEMORY_MAP_DTYPE.itemsize
+    for slot in device_collection.layout(1):
+        assert records[slot.index - 1]['offset'] == slot.offset
+        assert records[slot.index - 1]['variable'] == slot.variable.encode()
+
+
+def test_records_file_rejects_other_files(tmp_path):
+    path = tmp_path / "mc_unit_1.pilsmap"
+    path.write_bytes(b'<?xml version="1.0"?>')
+
+    with pytest.raises(ValueError):
+        read_records(str(path))
+
+
+@pytest.mark.parametrize("memory_map_format, read", [
+    ('parquet', lambda content: pq.read_table(pa.BufferReader(content))),
+    ('arrow', lambda content: pa.ipc.open_file(pa.BufferReader(content)).read_all()),
+])
+def test_table_formats_hold_the_records(device_collection, memory_map_format, read):
+    records = device_collection.memory_map(1)
+
+    table = read(device_collection.render_memory_map(1, memory_map_format))
+
+    assert table.column_names == list(MEMORY_MAP_DTYPE.names)
+    assert table.column('offset').to_pylist() == records['offset'].tolist()
+    assert table.column('name').to_pylist() == [name.decode() for name in records['name']]
+
+
+def test_too_long_name_is_rejected():
+    slot = Slot('extra', '1201', 'stExtra', 'x' * 41, 128, 2, 2, 1)
+
+    with pytest.raises(ValueError):
+        memory_map_records([slot], 1)
+
+
+@pytest.mark.parametrize("name, expected", [(float('nan'), b'nan'), (42, b'42'), (12.5, b'12.5')])
+def test_names_are_converted_like_the_pils_table(name, expected):
+    slot = Slot('extra', '1201', 'stExtra', name, 128, 2, 2, 1)
+
+    assert memory_map_records([slot], 1)[0]['name'] == expected
+
+
+def test_missing_pils_name_is_exported(device_collection):
+    device_collection.devices_by_unit[1][1].pils_name = float('nan')
+
+    records = device_collection.memory_map(1)
+
+    assert b'nan' in list(records['name'])
+    assert "sName := 'nan'" in device_collection.render_xml(1)
+
+
+def test_memory_maps_are_generated_with_the_other_outputs(device_collection):
+    sink = MemorySink()
+
+    generate_outputs(device_collection, pils=True, memory_maps=['records', 'parquet'], sink=sink)
+
+    assert sorted(sink.files) == [
+        'mc_unit_1.TcGVL', 'mc_unit_1.parquet', 'mc_unit_1.pilsmap',
+        'mc_unit_2.TcGVL', 'mc_unit_2.parquet', 'mc_unit_2.pilsmap',
+    ]
@@ -0,0 +1,49 @@
+import os
+
+import pytest
+from src.device import DeviceCollection
+from src.opi import opi_template
+from src.reader import ExcelReader, COLUMNS_INDEX
+
+
+def data_file_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+def read_collection(sheet_index):
+    reader = ExcelReader(data_file_path("multi_sheet_test.xlsx"))
+    df, instrument_name = reader.read_sheet_by_index(sheet_index, COLUMNS_INDEX)
+    reader.close()
+    collection = DeviceCollection(instrument_name)
+    collection.from_dataframe(df)
+    return collection
+
+
+def test_template_is_loaded_once():
+    assert opi_template() is opi_template()
+    assert opi_template().placeholders == {'MACROS', 'NUM_DEVS', 'MCU_NAME'}
+
+
+def test_render_opi():
+    opi = read_collection(0).render_opi(1)
+
+    assert '<path>motor-3.opi</path>' in opi
+    assert '<text>YMIR-MCS1</text>' in opi
+    assert ('          <include_parent_macros>true</include_parent_macros>\n'
+            '            <PREFIX>YMIR-MCS1:MC-MCU-01:</PREFIX>\n'
+            '            <P>YMIR-</P>\n'
+            '            <M1>MC-Spare-01:Mtr</M1>\n'
+            '            <M2>ColSl1:MC-SlYp-01:Mtr</M2>\n'
+            '            <M3>Smpl:MC-RotZ-01:Mtr</M3>\n'
+            '            <R1>MC-Spare-01:Mtr-</R1>\n') in opi
+    assert '$' not in opi.replace('$(pv_name)', '').replace('$(pv_value)', '')
+
+
+def test_opi_prefix_follows_instrument(tmp_path):
+    collection = read_collection(1)
+
+    collection.to_opi(output_dir=str(tmp_path))
+
+    opi = open(tmp_path / "IOC-TEST-MCS1.mid").read()
+    assert '<P>TEST-</P>' in opi
+    assert 'YMIR' not in opi
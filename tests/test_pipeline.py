@@ -0,0 +1,78 @@
+import os
+
+import pytest
+from src.layout import LayoutOptions
+from src.pipeline import build_collection, generate_sheets, parallel_map, render_collection
+from src.reader import ExcelReader, COLUMNS_INDEX
+
+
+def data_file_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+@pytest.fixture
+def reader():
+    reader = ExcelReader(data_file_path("multi_sheet_test.xlsx"))
+    yield reader
+    reader.close()
+
+
+def test_generate_all_sheets(reader, tmp_path):
+    # When
+    instruments = generate_sheets(reader, [0, 1], output_dir=str(tmp_path), pils=True, ioc=True, opi=True,
+                                  ioc_ip='10.0.0.1', plc_ip='10.0.0.2')
+
+    # Then
+    assert instruments == ['YMIR', 'TEST']
+    assert sorted(os.listdir(tmp_path / "ymir")) == [
+        'IOC-YMIR-MCS1.mid', 'IOC-YMIR-MCS2.mid', 'mc_unit_1.TcGVL', 'mc_unit_2.TcGVL',
+        'st.ymir-mcs1.iocsh', 'st.ymir-mcs2.iocsh',
+    ]
+    assert sorted(os.listdir(tmp_path / "test")) == ['IOC-TEST-MCS1.mid', 'mc_unit_1.TcGVL', 'st.test-mcs1.iocsh']
+
+
+def test_generate_selected_outputs_only(reader, tmp_path):
+    generate_sheets(reader, [1], output_dir=str(tmp_path), pils=True)
+
+    assert os.listdir(tmp_path) == ['test']
+    assert os.listdir(tmp_path / "test") == ['mc_unit_1.TcGVL']
+
+
+def test_duplicate_instrument_is_rejected(reader, tmp_path):
+    with pytest.raises(ValueError):
+        generate_sheets(reader, [0, 0], output_dir=str(tmp_path))
+
+
+def read_tree(path):
+    return {
+        os.path.relpath(os.path.join(root, name), path): open(os.path.join(root, name), 'rb').read()
+        for root, _, names in os.walk(path) for name in names
+    }
+
+
+@pytest.mark.parametrize("sheet_indices", [[0], [0, 1]])
+def test_parallel_output_is_identical(reader, tmp_path, sheet_indices):
+    # Given
+    outputs = dict(pils=True, ioc=True, opi=True, ioc_ip='10.0.0.1', plc_ip='10.0.0.2')
+
+    # When
+    generate_sheets(reader, sheet_indices, output_dir=str(tmp_path / "serial"), jobs=1, **outputs)
+    generate_sheets(reader, sheet_indices, output_dir=str(tmp_path / "parallel"), jobs=2, **outputs)
+
+    # Then
+    serial = read_tree(tmp_path / "serial")
+    assert serial
+    assert read_tree(tmp_path / "parallel") == serial
+
+
+def test_parallel_map_keeps_order():
+    assert parallel_map(abs, [-3, 2, -1], jobs=2) == [3, 2, 1]
+
+
+def test_parallel_units_see_the_collection_state(reader):
+    device_collection = build_collection(*reader.read_sheet_by_index(0, COLUMNS_INDEX))
+    device_collection.layout_options = LayoutOptions(pack=True)
+
+    serial = render_collection(device_collection, jobs=1, pils=True)
+
+    assert render_collection(device_collection, jobs=2, pils=True) == serial
@@ -0,0 +1,85 @@
+import json
+import os
+
+import pytest
+from src.layout import Slot
+from src.pipeline import build_collection, generate_outputs
+from src.poll_budget import (
+    POLL_LOAD_FILE_NAME, REQUEST_OVERHEAD, PollBudget, PollCycle, plan_poll_periods, poll_cycle, unit_load
+)
+from src.read_blocks import ReadBlockOptions
+from src.reader import ExcelReader, COLUMNS_INDEX
+from src.sinks import MemorySink
+
+
+def data_file_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+@pytest.fixture
+def device_collection():
+    with ExcelReader(data_file_path("multi_sheet_test.xlsx")) as reader:
+        return build_collection(*reader.read_sheet_by_index(0, COLUMNS_INDEX))
+
+
+def slot(kind, offset, length, index):
+    return Slot(kind, '1201', f"st{index}", f"Device{index}", offset, length, 2, index)
+
+
+def test_cycle_counts_slots_or_blocks():
+    slots = [slot('motor', 128, 32, 1), slot('motor', 160, 32, 2), slot('temp', 192, 4, 3)]
+
+    assert poll_cycle(slots) == PollCycle(2, 64 + 2 * REQUEST_OVERHEAD, 1, 4 + REQUEST_OVERHEAD)
+    assert poll_cycle(slots, ReadBlockOptions()) == PollCycle(1, 64 + REQUEST_OVERHEAD, 1, 4 + REQUEST_OVERHEAD)
+
+
+def test_load_while_moving():
+    cycle = PollCycle(hot_requests=4, hot_bytes=400, cold_requests=2, cold_bytes=100)
+
+    assert unit_load(cycle, 100, 1000) == (42, 4100)
+
+
+def test_latency_targets_are_met_within_budget():
+    cycles = {'1': PollCycle(4, 400, 2, 100), '2': PollCycle(1, 100, 1, 100)}
+
+    plan = plan_poll_periods(cycles, PollBudget(latency=205, idle_latency=1000, unit_latency={'2': 50}))
+
+    assert [(load.moving_period, load.idle_period) for load in plan.values()] == [(200, 1000), (50, 1000)]
+    assert all(load.latency_met for load in plan.values())
+
+
+def test_periods_are_stretched_to_fit_the_budget():
+    cycles = {'1': PollCycle(10, 1000, 0, 0), '2': PollCycle(10, 1000, 0, 0)}
+
+    plan = plan_poll_periods(cycles, PollBudget(latency=100, requests=100))
+
+    assert [load.moving_period for load in plan.values()] == [200, 200]
+    assert sum(load.requests for load in plan.values()) <= 100
+    assert not any(load.latency_met for load in plan.values())
+
+
+def test_default_budget_keeps_the_st_cmd(device_collection):
+    expected = device_collection.render_st_cmd(1, '10.0.0.1', '10.0.0.2')
+    sink = MemorySink()
+
+    generate_outputs(device_collection, ioc=True, ioc_ip='10.0.0.1', plc_ip='10.0.0.2',
+                     poll_budget=PollBudget(), sink=sink)
+
+    assert sink.files['st.ymir-mcs1.iocsh'].decode() == expected
+
+
+def test_periods_are_set_in_the_st_cmd_and_reported(device_collection):
+    sink = MemorySink()
+
+    generate_outputs(device_collection, ioc=True, ioc_ip='10.0.0.1', plc_ip='10.0.0.2',
+                     poll_budget=PollBudget(latency=100, idle_latency=500, unit_latency={'2': 50}), sink=sink)
+
+    assert 'epicsEnvSet("MOVINGPOLLPERIOD", "100")\nepicsEnvSet("IDLEPOLLPERIOD",   "500")' in \
+        sink.files['st.ymir-mcs1.iocsh'].decode()
+    assert 'epicsEnvSet("MOVINGPOLLPERIOD", "50")' in sink.files['st.ymir-mcs2.iocsh'].decode()
+    report = json.loads(sink.files[POLL_LOAD_FILE_NAME])
+    plcs = report['plcs']
+    assert sorted(plcs) == ['MCS1', 'MCS2']
+    host = report['ioc_hosts']['10.0.0.1']
+    assert host['requests_per_s'] == pytest.approx(sum(plc['requests_per_s'] for plc in plcs.values()), abs=0.2)
+    assert host['latency_met']
@@ -0,0 +1,71 @@
+import json
+import os
+
+import pytest
+from src.layout import Slot
+from src.pipeline import build_collection, generate_outputs
+from src.read_blocks import ReadBlock, ReadBlockOptions, format_blocks, plan_read_blocks
+from src.reader import ExcelReader, COLUMNS_INDEX
+from src.sinks import MemorySink
+
+
+def data_file_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+@pytest.fixture
+def device_collection():
+    with ExcelReader(data_file_path("multi_sheet_test.xlsx")) as reader:
+        return build_collection(*reader.read_sheet_by_index(0, COLUMNS_INDEX))
+
+
+def slot(kind, offset, length, index):
+    return Slot(kind, '1201', f"st{index}", f"Device{index}", offset, length, 2, index)
+
+
+def test_blocks_cover_every_slot_once(device_collection):
+    slots = device_collection.layout(1)
+
+    for options in (ReadBlockOptions(), ReadBlockOptions(max_gap=0), ReadBlockOptions(max_block=32, max_gap=8)):
+        blocks = plan_read_blocks(slots, options)
+
+        assert sorted(index for block in blocks for index in block.devices) == [slot.index for slot in slots]
+        for block in blocks:
+            block_slots = [slot for slot in slots if slot.index in block.devices]
+            assert block.offset == min(slot.offset for slot in block_slots)
+            assert block.end == max(slot.end for slot in block_slots)
+            assert block.length <= max(options.max_block, max(slot.length for slot in block_slots))
+
+
+def test_gaps_up_to_the_threshold_are_merged():
+    slots = [slot('motor', 128, 32, 1), slot('temp', 160, 4, 2), slot('motor', 168, 32, 3),
+             slot('motor', 300, 32, 4)]
+
+    assert plan_read_blocks(slots, ReadBlockOptions(max_gap=8)) == [
+        ReadBlock('hot', 128, 72, (1, 3)),
+        ReadBlock('hot', 300, 32, (4,)),
+        ReadBlock('cold', 160, 4, (2,)),
+    ]
+    assert len(plan_read_blocks(slots, ReadBlockOptions(max_gap=4))) == 4
+
+
+def test_blocks_are_split_at_the_maximum_size():
+    slots = [slot('motor', 128 + 32 * i, 32, i + 1) for i in range(5)]
+
+    blocks = plan_read_blocks(slots, ReadBlockOptions(max_block=64))
+
+    assert [(block.offset, block.length) for block in blocks] == [(128, 64), (192, 64), (256, 32)]
+    assert format_blocks(blocks) == '128:64,192:64,256:32'
+
+
+def test_plan_is_written_next_to_the_st_cmd(device_collection):
+    sink = MemorySink()
+
+    generate_outputs(device_collection, ioc=True, ioc_ip='10.0.0.1', plc_ip='10.0.0.2',
+                     read_blocks=ReadBlockOptions(max_gap=0), sink=sink)
+
+    plan = json.loads(sink.files['st.ymir-mcs1.blocks.json'])
+    hot = ','.join(f"{block['offset']}:{block['length']}" for block in plan['classes']['hot']['blocks'])
+    assert plan['classes']['hot']['requests'] == 4
+    assert f'epicsEnvSet("ECM_READBLOCKS_HOT",  "{hot}")' in sink.files['st.ymir-mcs1.iocsh'].decode()
+    assert 'ECM_READBLOCKS' not in device_collection.render_st_cmd(1, '10.0.0.1', '10.0.0.2')
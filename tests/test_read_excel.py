@@ -1,7 +1,8 @@
 import os
 
+import openpyxl
 import pytest
-from src.reader import ExcelReader
+from src.reader import ExcelReader, COLUMNS_INDEX, COL_NAMES
 
 
 def data_file_path(filename):
@@ -54,3 +55,88 @@ def test_dataframe_filtered(reader):
 
 
 
+@pytest.fixture
+def multi_sheet_reader():
+    reader = ExcelReader(data_file_path("multi_sheet_test.xlsx"))
+    yield reader
+    reader.close()
+
+
+def test_sheet_names(multi_sheet_reader):
+    assert multi_sheet_reader.sheet_names == ["ymir_motion", "test_motion"]
+
+
+def test_workbook_is_parsed_once(multi_sheet_reader):
+    # Given
+    excel_file = multi_sheet_reader.excel_file
+
+    # When
+    ymir, ymir_name = multi_sheet_reader.read_sheet_by_index(0, COLUMNS_INDEX)
+    test, test_name = multi_sheet_reader.read_sheet_by_index(1, COLUMNS_INDEX)
+
+    # Then
+    assert multi_sheet_reader.excel_file is excel_file
+    assert ymir_name == 'YMIR'
+    assert test_name == 'TEST'
+    assert len(ymir) == 8
+    assert len(test) == 2
+    assert list(ymir.columns[:len(COL_NAMES)]) == COL_NAMES
+
+
+def test_close_reopens_lazily(multi_sheet_reader):
+    excel_file = multi_sheet_reader.excel_file
+    multi_sheet_reader.close()
+
+    _, instrument_name = multi_sheet_reader.read_sheet_by_index(0, COLUMNS_INDEX)
+
+    assert instrument_name == 'YMIR'
+    assert multi_sheet_reader.excel_file is not excel_file
+
+
+def test_sheet_index_out_of_range(multi_sheet_reader):
+    with pytest.raises(ValueError):
+        multi_sheet_reader.read_sheet_by_index(2, COLUMNS_INDEX)
+
+
+@pytest.mark.parametrize("selectors, expected", [
+    (["0"], [0]),
+    (["test_motion"], [1]),
+    (["*_motion"], [0, 1]),
+    (["1", "ymir*"], [0, 1]),
+])
+def test_select_sheets(multi_sheet_reader, selectors, expected):
+    assert multi_sheet_reader.select_sheets(selectors) == expected
+
+
+def test_select_sheets_no_match(multi_sheet_reader):
+    with pytest.raises(ValueError):
+        multi_sheet_reader.select_sheets(["nope*"])
+
+
+@pytest.fixture
+def workbook_with_notes(tmp_path):
+    workbook = openpyxl.load_workbook(data_file_path("multi_sheet_test.xlsx"))
+    workbook.create_sheet("Notes").append(["Remember to update the unit numbers"])
+    workbook.create_sheet("narrow_motion").append([None, "Instrument", "NARROW"])
+    path = tmp_path / "with_notes.xlsx"
+    workbook.save(path)
+    return str(path)
+
+
+def test_instrument_sheets_skip_other_sheets(workbook_with_notes, capsys):
+    with ExcelReader(workbook_with_notes) as reader:
+        assert reader.instrument_sheets([0, 1, 2, 3], COLUMNS_INDEX) == [0, 1]
+        assert reader.select_sheets(["*"]) == [0, 1]
+
+    err = capsys.readouterr().err
+    assert "Skipping sheet 'Notes': it has no instrument name" in err
+    assert "Skipping sheet 'narrow_motion': it has 3 columns" in err
+
+
+@pytest.mark.parametrize("sheet_index, sheet_name", [(2, "Notes"), (3, "narrow_motion")])
+def test_non_instrument_sheet_is_named(workbook_with_notes, sheet_index, sheet_name):
+    with ExcelReader(workbook_with_notes) as reader:
+        with pytest.raises(ValueError, match=f"Sheet '{sheet_name}'"):
+            reader.read_sheet_by_index(sheet_index, COLUMNS_INDEX)
+        with pytest.raises(ValueError, match=f"Sheet '{sheet_name}'"):
+            list(reader.read_sheet_rows(sheet_index, COLUMNS_INDEX)[1])
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import os
+import shutil
+from http import HTTPStatus
+
+import openpyxl
+import pytest
+from src.server import GeneratorApp, GeneratorServer, WorkbookStore
+
+WORKBOOK = "multi_sheet_test.xlsx"
+
+
+def data_file_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+@pytest.fixture
+def app(tmp_path):
+    shutil.copy(data_file_path(WORKBOOK), tmp_path / WORKBOOK)
+    store = WorkbookStore(str(tmp_path))
+    yield GeneratorApp(store)
+    store.close()
+
+
+def get_json(app, target):
+    status, content_type, body = app.handle('GET', target)
+    assert content_type == 'application/json'
+    return status, json.loads(body)
+
+
+def test_units(app):
+    status, units = get_json(app, f"/units?workbook={WORKBOOK}&sheet=ymir_motion")
+
+    assert status == HTTPStatus.OK
+    assert units['instrument'] == 'YMIR'
+    assert [unit['mc_unit'] for unit in units['units']] == ['1', '2']
+    assert units['units'][1]['files']['pils'] == 'mc_unit_2.TcGVL'
+
+
+def test_render_matches_device_collection(app):
+    status, content_type, body = app.handle(
+        'GET', f"/render?workbook={WORKBOOK}&sheet=1&unit=1&kind=ioc&ioc_ip=10.0.0.1&plc_ip=10.0.0.2")
+
+    workbook = app.store.get(WORKBOOK)
+    assert status == HTTPStatus.OK
+    assert content_type.startswith('text/plain')
+    assert body.decode('utf-8') == workbook.collection(1).render_st_cmd(1, '10.0.0.1', '10.0.0.2')
+
+
+@pytest.mark.parametrize("target, expected_status", [
+    ("/render?workbook=../secret.xlsx&sheet=0&unit=1&kind=pils", HTTPStatus.FORBIDDEN),
+    ("/render?workbook=missing.xlsx&sheet=0&unit=1&kind=pils", HTTPStatus.NOT_FOUND),
+    (f"/render?workbook={WORKBOOK}&sheet=7&unit=1&kind=pils", HTTPStatus.NOT_FOUND),
+    (f"/render?workbook={WORKBOOK}&sheet=0&unit=9&kind=pils", HTTPStatus.NOT_FOUND),
+    (f"/render?workbook={WORKBOOK}&sheet=0&unit=1&kind=pdf", HTTPStatus.BAD_REQUEST),
+    (f"/render?workbook={WORKBOOK}&sheet=0&unit=1&kind=ioc", HTTPStatus.BAD_REQUEST),
+    ("/nowhere", HTTPStatus.NOT_FOUND),
+])
+def test_errors(app, target, expected_status):
+    status, error = get_json(app, target)
+
+    assert status == expected_status
+    assert error['error']
+
+
+def test_workbook_is_kept_warm_until_its_content_changes(app, tmp_path):
+    workbook = app.store.get(WORKBOOK)
+    collection = workbook.collection(1)
+
+    # Touching the file re-hashes it, but keeps the parsed sheets
+    stat = os.stat(tmp_path / WORKBOOK)
+    os.utime(tmp_path / WORKBOOK, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert app.store.get(WORKBOOK) is workbook
+    assert workbook.collection(1) is collection
+
+    # Changing the content re-parses it
+    book = openpyxl.load_workbook(tmp_path / WORKBOOK)
+    book["test_motion"].cell(row=1, column=3).value = "OTHER"
+    book.save(tmp_path / WORKBOOK)
+    status, units = get_json(app, f"/units?workbook={WORKBOOK}&sheet=1")
+    assert units['instrument'] == 'OTHER'
+    assert app.store.get(WORKBOOK) is not workbook
+
+
+def test_server_keeps_connections_alive(app):
+    async def exchange():
+        server = GeneratorServer(app, port=0)
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_connection(server.host, server.port)
+            responses = []
+            for target in ("/health", f"/sheets?workbook={WORKBOOK}"):
+                writer.write(f"GET {target} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode('latin-1'))
+                await writer.drain()
+                head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1')
+                length = int(head.split('Content-Length: ')[1].split('\r\n')[0])
+                responses.append((head.split('\r\n')[0], json.loads(await reader.readexactly(length))))
+            writer.close()
+            await writer.wait_closed()
+            return responses
+        finally:
+            await server.close()
+
+    responses = asyncio.run(exchange())
+
+    assert [status for status, _ in responses] == ['HTTP/1.1 200 OK'] * 2
+    assert responses[0][1]['status'] == 'ok'
+    assert [sheet['name'] for sheet in responses[1][1]['sheets']] == ['ymir_motion', 'test_motion']
+
+
+@pytest.mark.parametrize("content_length", ["abc", "-5"])
+def test_server_rejects_malformed_content_length(app, content_length):
+    async def exchange():
+        server = GeneratorServer(app, port=0)
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_connection(server.host, server.port)
+            writer.write(f"GET /health HTTP/1.1\r\nContent-Length: {content_length}\r\n\r\n".encode('latin-1'))
+            await writer.drain()
+            response = await reader.read()
+            writer.close()
+            await writer.wait_closed()
+            return response.decode('latin-1')
+        finally:
+            await server.close()
+
+    head, body = asyncio.run(exchange()).split('\r\n\r\n', 1)
+
+    assert head.startswith('HTTP/1.1 400 Bad Request')
+    assert json.loads(body) == {'error': 'Malformed Content-Length.'}
@@ -0,0 +1,157 @@
+import asyncio
+import os
+import struct
+
+import pytest
+from src.pipeline import build_collection
+from src.reader import ExcelReader, COLUMNS_INDEX
+from src.simulator import (
+    ADS_READ, ADS_READ_DEVICE_INFO, ADS_READ_STATE, ADS_WRITE, ADSERR_DEVICE_INVALIDGRP,
+    ADSERR_DEVICE_INVALIDOFFSET, ADSIGRP_PLC_MEMORY, AMS_HEADER, AMS_TCP_HEADER, INDEXER_ACK, INDEXER_OFFSET,
+    INFO_AUX, INFO_NAME, PILS_MAGIC, STATE_BUSY, STATE_IDLE, STATE_START, AdsHandler, AdsServer, SimulatedPlc,
+    device_infos, parse_device_table
+)
+
+
+def data_file_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def device_collection():
+    with ExcelReader(data_file_path("multi_sheet_test.xlsx")) as reader:
+        return build_collection(*reader.read_sheet_by_index(0, COLUMNS_INDEX))
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+@pytest.fixture
+def plc(device_collection, clock):
+    return SimulatedPlc(device_infos(device_collection.layout(1)), 'ymir-mcs1', velocity=2.0,
+                        shutter_time=1.0, clock=clock)
+
+
+def request(command, data=b'', invoke_id=7):
+    header = AMS_HEADER.pack(b'\x7f\0\0\x01\x01\x01', 852, b'\x7f\0\0\x01\x01\x01', 30000, command, 0x0004,
+                             len(data), 0, invoke_id)
+    return header + data
+
+
+def payload(response):
+    _, length = AMS_TCP_HEADER.unpack_from(response)
+    assert len(response) == AMS_TCP_HEADER.size + length
+    header = AMS_HEADER.unpack_from(response, AMS_TCP_HEADER.size)
+    return header, response[AMS_TCP_HEADER.size + AMS_HEADER.size:]
+
+
+def ads_read(handler, offset, length, group=ADSIGRP_PLC_MEMORY):
+    _, data = payload(handler.handle(request(ADS_READ, struct.pack('<III', group, offset, length))))
+    result, size = struct.unpack_from('<II', data)
+    return result, data[8:8 + size]
+
+
+def ads_write(handler, offset, content):
+    data = struct.pack('<III', ADSIGRP_PLC_MEMORY, offset, len(content)) + content
+    _, response = payload(handler.handle(request(ADS_WRITE, data)))
+    return struct.unpack('<I', response)[0]
+
+
+def test_device_table_is_read_back_from_pils_table(device_collection):
+    assert parse_device_table(device_collection.render_xml(1)) == device_infos(device_collection.layout(1))
+
+
+def test_indexer_describes_the_devices(plc):
+    handler = AdsHandler(plc)
+    assert struct.unpack('<fH', ads_read(handler, 0, 6)[1]) == (pytest.approx(PILS_MAGIC), INDEXER_OFFSET)
+
+    assert ads_write(handler, INDEXER_OFFSET, struct.pack('<H', 2)) == 0
+    _, answer = ads_read(handler, INDEXER_OFFSET, 22)
+    assert struct.unpack_from('<HHHHH', answer) == (2 | INDEXER_ACK, 0x5010, 32, 160, 0xFD04)
+
+    ads_write(handler, INDEXER_OFFSET, struct.pack('<H', 7 | INFO_NAME << 8))
+    assert ads_read(handler, INDEXER_OFFSET + 2, 34)[1].rstrip(b'\0') == b'HeavyShutter'
+    ads_write(handler, INDEXER_OFFSET, struct.pack('<H', 2 | (INFO_AUX + 23) << 8))
+    assert ads_read(handler, INDEXER_OFFSET + 2, 34)[1].rstrip(b'\0') == b'enabled'
+
+
+def test_axis_moves_to_its_target(plc, clock):
+    handler = AdsHandler(plc)
+    motor = 160
+
+    ads_write(handler, motor + 8, struct.pack('<dI', 3.0, STATE_START << 28))
+    clock.now = 1.0
+    position, _, status = struct.unpack('<ddI', ads_read(handler, motor, 20)[1])
+    assert position == pytest.approx(2.0)
+    assert status >> 28 == STATE_BUSY
+
+    clock.now = 2.0
+    position, _, status = struct.unpack('<ddI', ads_read(handler, motor, 20)[1])
+    assert position == 3.0
+    assert status >> 28 == STATE_IDLE and status & (1 << 20)
+
+
+def test_axis_parameters_are_read_back(plc):
+    handler = AdsHandler(plc)
+
+    ads_write(handler, 160 + 20, struct.pack('<Id', 0x4000 | 66, 12.5))
+    ads_write(handler, 160 + 20, struct.pack('<I', 0x2000 | 66))
+
+    assert struct.unpack('<Id', ads_read(handler, 160 + 20, 12)[1]) == (0x8000 | 66, 12.5)
+
+
+def test_shutter_opens_after_the_shutter_time(plc, clock):
+    handler = AdsHandler(plc)
+    shutter = 240
+
+    ads_write(handler, shutter + 2, struct.pack('<h', 1))
+    clock.now = 0.5
+    actual, _, status = struct.unpack('<hhI', ads_read(handler, shutter, 8)[1])
+    assert (actual, status >> 28) == (0, STATE_BUSY) and status & (1 << 2)
+
+    clock.now = 1.0
+    actual, _, status = struct.unpack('<hhI', ads_read(handler, shutter, 8)[1])
+    assert (actual, status >> 28) == (1, STATE_IDLE) and status & (1 << 3)
+
+
+def test_errors(plc):
+    handler = AdsHandler(plc)
+
+    assert ads_read(handler, 0, 4, group=0xF003)[0] == ADSERR_DEVICE_INVALIDGRP
+    assert ads_read(handler, len(plc.image) - 2, 4)[0] == ADSERR_DEVICE_INVALIDOFFSET
+
+
+def test_server_answers_over_tcp(plc):
+    async def exchange():
+        server = AdsServer(AdsHandler(plc), port=0)
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_connection(server.host, server.port)
+            responses = []
+            for invoke_id, command in enumerate((ADS_READ_DEVICE_INFO, ADS_READ_STATE), start=1):
+                packet = request(command, invoke_id=invoke_id)
+                writer.write(AMS_TCP_HEADER.pack(0, len(packet)) + packet)
+                await writer.drain()
+                _, length = AMS_TCP_HEADER.unpack(await reader.readexactly(AMS_TCP_HEADER.size))
+                responses.append(payload(AMS_TCP_HEADER.pack(0, length) + await reader.readexactly(length)))
+            writer.close()
+            await writer.wait_closed()
+            return responses
+        finally:
+            await server.close()
+
+    (info_header, info), (state_header, state) = asyncio.run(exchange())
+
+    assert info_header[8] == 1 and state_header[8] == 2
+    assert info[8:].rstrip(b'\0') == b'PILS simulator'
+    assert struct.unpack('<IHH', state) == (0, 5, 0)
@@ -0,0 +1,114 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+from src.pipeline import build_collection, generate_outputs, generate_sheets
+from src.reader import ExcelReader, COLUMNS_INDEX
+from src.sinks import DirectorySink, MemorySink, StreamSink, TarSink, ZipSink, open_sink
+
+OUTPUTS = dict(pils=True, ioc=True, opi=True, ioc_ip='10.0.0.1', plc_ip='10.0.0.2')
+
+
+def data_file_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+@pytest.fixture
+def reader():
+    with ExcelReader(data_file_path("multi_sheet_test.xlsx")) as excel_reader:
+        yield excel_reader
+
+
+def test_memory_sink_matches_directory(reader, tmp_path):
+    df, instrument_name = reader.read_sheet_by_index(0, COLUMNS_INDEX)
+    collection = build_collection(df, instrument_name)
+
+    generate_outputs(collection, output_dir=str(tmp_path), **OUTPUTS)
+    sink = MemorySink()
+    generate_outputs(collection, sink=sink, **OUTPUTS)
+
+    assert sorted(sink.files) == sorted(os.listdir(tmp_path))
+    for name, data in sink.files.items():
+        assert (tmp_path / name).read_bytes() == data
+
+
+def test_device_collection_writes_to_sink(reader):
+    df, instrument_name = reader.read_sheet_by_index(1, COLUMNS_INDEX)
+    collection = build_collection(df, instrument_name)
+
+    sink = MemorySink()
+    collection.to_xml(sink=sink)
+    collection.to_st_cmd('10.0.0.1', '10.0.0.2', sink=sink)
+    collection.to_opi(sink=sink)
+
+    assert sorted(sink.files) == ['IOC-TEST-MCS1.mid', 'mc_unit_1.TcGVL', 'st.test-mcs1.iocsh']
+    assert sink.files['st.test-mcs1.iocsh'].decode('utf-8') == collection.render_st_cmd(1, '10.0.0.1', '10.0.0.2')
+
+
+@pytest.mark.parametrize("archive_name", ["out.zip", "out.tar", "out.tar.gz", "out.tgz"])
+def test_archive_holds_every_instrument(reader, tmp_path, archive_name):
+    memory = MemorySink()
+    generate_sheets(reader, [0, 1], sink=memory, **OUTPUTS)
+
+    archive_path = str(tmp_path / archive_name)
+    with open_sink(archive_path) as sink:
+        generate_sheets(reader, [0, 1], sink=sink, **OUTPUTS)
+
+    if archive_name.endswith('.zip'):
+        with zipfile.ZipFile(archive_path) as archive:
+            files = {name: archive.read(name) for name in archive.namelist()}
+    else:
+        with tarfile.open(archive_path) as archive:
+            files = {member.name: archive.extractfile(member).read() for member in archive.getmembers()}
+    assert files == memory.files
+    assert 'ymir/mc_unit_2.TcGVL' in files
+    assert 'test/st.test-mcs1.iocsh' in files
+    assert os.listdir(tmp_path) == [archive_name]
+
+
+def test_archive_is_discarded_on_error(tmp_path):
+    with pytest.raises(RuntimeError):
+        with ZipSink(str(tmp_path / "out.zip")) as sink:
+            sink.write('a.txt', 'a')
+            raise RuntimeError()
+
+    assert os.listdir(tmp_path) == []
+
+
+def test_archive_rejects_duplicate_names():
+    with TarSink(io.BytesIO()) as sink:
+        sink.write('a.txt', 'a')
+        with pytest.raises(ValueError):
+            sink.write('a.txt', 'b')
+
+
+def test_stream_sink():
+    stream = io.StringIO()
+    with StreamSink(stream) as sink:
+        sink.write('a.txt', 'first\n')
+        sink.write('b.txt', b'second\n')
+
+    assert stream.getvalue() == "==> a.txt <==\nfirst\n\n==> b.txt <==\nsecond\n"
+
+
+def test_directory_sink_skips_unchanged_files(tmp_path):
+    sink = DirectorySink(str(tmp_path))
+
+    assert sink.write('unit/a.txt', 'a')
+    assert not sink.write('unit/a.txt', 'a')
+    assert (tmp_path / "unit" / "a.txt").read_text() == 'a'
+
+
+def test_incremental_needs_a_directory(reader):
+    with pytest.raises(ValueError):
+        generate_sheets(reader, [1], sink=MemorySink(), incremental=True, **OUTPUTS)
+
+
+@pytest.mark.parametrize("spec, sink_class", [("-", StreamSink), ("out", DirectorySink),
+                                               ("out.ZIP", ZipSink), ("out.tar.xz", TarSink)])
+def test_open_sink(tmp_path, spec, sink_class):
+    sink = open_sink(spec if spec == "-" else str(tmp_path / spec))
+    assert isinstance(sink, sink_class)
+    sink.abort()
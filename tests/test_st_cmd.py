@@ -0,0 +1,47 @@
+import os
+
+import pytest
+from src.device import DeviceCollection
+from src.reader import ExcelReader, COLUMNS_INDEX
+
+
+def data_file_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+@pytest.fixture
+def device_collection():
+    reader = ExcelReader(data_file_path("multi_sheet_test.xlsx"))
+    df, instrument_name = reader.read_sheet_by_index(0, COLUMNS_INDEX)
+    reader.close()
+    collection = DeviceCollection(instrument_name)
+    collection.from_dataframe(df)
+    return collection
+
+
+def test_return_it_returns_all_units(device_collection, tmp_path):
+    # When
+    st_cmds = device_collection.to_st_cmd('10.0.0.1', '10.0.0.2', return_it=True, output_dir=str(tmp_path))
+
+    # Then
+    assert sorted(st_cmds) == [1, 2]
+    assert os.listdir(tmp_path) == []
+    assert 'epicsEnvSet("R",             "MCS2:MC-MCU-02:")' in st_cmds[2]
+
+
+def test_written_files_match_rendered(device_collection, tmp_path):
+    device_collection.to_st_cmd('10.0.0.1', '10.0.0.2', output_dir=str(tmp_path))
+
+    for mc_unit, st_cmd in device_collection.render_st_cmds('10.0.0.1', '10.0.0.2').items():
+        assert open(tmp_path / device_collection.st_cmd_file_name(mc_unit)).read() == st_cmd
+
+
+def test_st_cmd_axes(device_collection):
+    st_cmd = device_collection.render_st_cmd(1, '10.0.0.1', '10.0.0.2')
+
+    assert 'epicsEnvSet("ECM_NUMAXES",   "6")' in st_cmd
+    assert 'epicsEnvSet("AMSNETIDIOC",   "10.0.0.1.1.1")' in st_cmd
+    assert '# AXIS 5\n#\nepicsEnvSet("AXISCONFIG",      "")\nepicsEnvSet("R",               "MC-Spare-01:Sht")' in st_cmd
+    assert 'epicsEnvSet("R",               "MC-Spare-01:Mtr")' in st_cmd
+    assert '# AXIS 6' not in st_cmd
+    assert st_cmd.endswith('\n\niocInit()\n')
@@ -0,0 +1,99 @@
+import math
+import os
+import re
+
+import pandas as pd
+import pytest
+from bench.workbook import WorkbookShape, write_workbook
+from src.device import normalise_dataframe, normalise_record
+from src.pipeline import generate_sheets
+from src.reader import ExcelReader, COLUMNS_INDEX, cell_value
+
+
+def data_file_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+def same_values(left, right):
+    return all(a == b or (isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b))
+               for a, b in zip(left, right)) and len(left) == len(right)
+
+
+def assert_same_records(path, sheet_index):
+    with ExcelReader(path) as reader:
+        df, instrument_name = reader.read_sheet_by_index(sheet_index, COLUMNS_INDEX)
+        expected = list(normalise_dataframe(df).itertuples(index=False, name=None))
+        streamed_name, rows = reader.read_sheet_rows(sheet_index, COLUMNS_INDEX)
+        records = [normalise_record(row) for row in rows]
+
+    assert streamed_name == instrument_name
+    assert len(records) == len(expected)
+    for record, row in zip(records, expected):
+        assert same_values(record, row), (record, row)
+
+
+@pytest.mark.parametrize("sheet_index", [0, 1])
+def test_streamed_rows_match_dataframe(sheet_index):
+    assert_same_records(data_file_path("multi_sheet_test.xlsx"), sheet_index)
+
+
+def test_streamed_rows_match_dataframe_on_synthetic_workbook(tmp_path):
+    path = str(tmp_path / "bench.xlsx")
+    write_workbook(path, WorkbookShape(sheets=2, units=3, axes=5, pneumatics=2, sensors=1, spare_every=3))
+
+    assert_same_records(path, 0)
+    assert_same_records(path, 1)
+
+
+@pytest.mark.parametrize("value, expected", [
+    (None, None), ('', None), ('NA', None), ('n/a', None), (float('nan'), None),
+    (3.0, 3), (2.5, 2.5), ('Shutter', 'Shutter'), (7, 7),
+])
+def test_cell_value_follows_read_excel(value, expected):
+    result = cell_value(value)
+
+    assert result == expected
+    assert type(result) is type(expected)
+
+
+def test_sheet_without_the_read_columns_is_rejected():
+    with ExcelReader(data_file_path("no_motor_test.xlsx")) as reader:
+        _, rows = reader.read_sheet_rows(0, COLUMNS_INDEX)
+        with pytest.raises(ValueError):
+            list(rows)
+
+
+def read_tree(path):
+    return {
+        os.path.relpath(os.path.join(root, name), path): open(os.path.join(root, name), 'rb').read()
+        for root, _, names in os.walk(path) for name in names
+    }
+
+
+def test_streamed_output_is_identical(tmp_path):
+    outputs = dict(pils=True, ioc=True, opi=True, ioc_ip='10.0.0.1', plc_ip='10.0.0.2')
+
+    with ExcelReader(data_file_path("multi_sheet_test.xlsx")) as reader:
+        generate_sheets(reader, [0, 1], output_dir=str(tmp_path / "frame"), **outputs)
+        generate_sheets(reader, [0, 1], output_dir=str(tmp_path / "stream"), stream=True, **outputs)
+
+    frame = read_tree(tmp_path / "frame")
+    assert frame
+    assert read_tree(tmp_path / "stream") == frame
+
+
+@pytest.mark.parametrize("missing, message", [
+    (('mc_unit',), "has no MC unit"),
+    (('mc_axis_nc', 'mc_axis_pn', 'extra_type', 'has_temp'), "has no axis, extra device type or temperature sensor"),
+])
+def test_incomplete_row_is_named(missing, message):
+    with ExcelReader(data_file_path("multi_sheet_test.xlsx")) as reader:
+        _, rows = reader.read_sheet_rows(0, COLUMNS_INDEX)
+        row = next(rows)
+    row.update(dict.fromkeys(missing))
+    expected = re.escape(f"Row '{row['axis_description']}' {message}")
+
+    with pytest.raises(ValueError, match=expected):
+        normalise_record(row)
+    with pytest.raises(ValueError, match=expected):
+        normalise_dataframe(pd.DataFrame([row]))
@@ -0,0 +1,46 @@
+import io
+import xml.dom.minidom
+from xml.etree.ElementTree import Element, SubElement, tostring, fromstring
+
+from src.tcgvl import render_tcgvl, write_tcgvl
+
+DECLARATION = [
+    'VAR_GLOBAL',
+    "sPLCName: STRING[34] := 'ymir-mcs1';\n",
+    "stMotorM1 AT %MB128: ST_5010;",
+    "",
+    "stCabinetStatus AT %MB160: ST_1802;\n",
+    "astDevices: ARRAY [1..2] OF ST_DeviceInfo :=[",
+    "(nTypCode := 16#1802, sName := 'Cabinet#0', nOffset := 160, asAux := [('24VPSFailed')])];",
+]
+
+
+def minidom_tcgvl(declaration_lines):
+    """The ElementTree/minidom round-trip the streaming writer replaces."""
+    root = Element('TcPlcObject', {'Version': '1.1.0.1', 'ProductVersion': '3.1.4024.5'})
+    gvl = SubElement(root, 'GVL', {'Name': 'GVL_PILS', 'Id': '{ace53d5e-03a7-4e79-9a33-72de579eb8fd}'})
+    declaration = SubElement(gvl, 'Declaration')
+    declaration.text = "<![CDATA[" + "\n\t".join(declaration_lines) + "\nEND_VAR\n]]>"
+    pretty = xml.dom.minidom.parseString(tostring(root, encoding='UTF-8')).toprettyxml(indent="  ")
+    pretty = pretty.replace('<?xml version="1.0" ?>', '<?xml version="1.0" encoding="utf-8"?>')
+    return pretty.replace("&lt;", "<").replace("&gt;", ">").strip()
+
+
+def test_output_matches_minidom_round_trip():
+    assert render_tcgvl(DECLARATION) == minidom_tcgvl(DECLARATION)
+
+
+def test_write_streams_to_file_handle():
+    buffer = io.StringIO()
+
+    write_tcgvl(buffer, iter(DECLARATION))
+
+    assert buffer.getvalue() == render_tcgvl(DECLARATION)
+
+
+def test_declaration_is_real_cdata():
+    lines = ['VAR_GLOBAL', "sName := 'A&B \"x\" ]]> y';"]
+
+    root = fromstring(render_tcgvl(lines).encode('utf-8'))
+
+    assert root.find('GVL/Declaration').text == "\n\t".join(lines) + "\nEND_VAR\n"
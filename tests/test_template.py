@@ -0,0 +1,34 @@
+import io
+
+from src.template import Template
+
+
+def test_render_fills_placeholders():
+    template = Template('epicsEnvSet("R", "MCS$MC_UNIT$:MC-MCU-0$MC_UNIT$:") $NAME$')
+
+    assert template.placeholders == {'MC_UNIT', 'NAME'}
+    assert template.render(MC_UNIT=2, NAME='x') == 'epicsEnvSet("R", "MCS2:MC-MCU-02:") x'
+
+
+def test_epics_macros_are_not_placeholders():
+    text = 'ethercatmcStartPoller("$(MOTOR_PORT)", "$(MOVINGPOLLPERIOD)", "$(IDLEPOLLPERIOD)")\n'
+    template = Template(text)
+
+    assert template.placeholders == set()
+    assert template.render() == text
+
+
+def test_write_streams_segments():
+    buffer = io.StringIO()
+
+    Template('<M$IDX$>$NAME$</M$IDX$>').write(buffer, IDX=1, NAME='Mtr')
+
+    assert buffer.getvalue() == '<M1>Mtr</M1>'
+
+
+def test_list_values_keep_line_indentation():
+    template = Template('<macros>\n    $MACROS$\n</macros> $COUNT$')
+
+    rendered = template.render(MACROS=['<M1>a</M1>', '<M2>b</M2>'], COUNT=2)
+
+    assert rendered == '<macros>\n    <M1>a</M1>\n    <M2>b</M2>\n</macros> 2'
@@ -0,0 +1,69 @@
+import json
+import os
+
+import pytest
+from src import timing
+from src.pipeline import generate_sheets
+from src.reader import ExcelReader, COLUMNS_INDEX
+from src.sinks import MemorySink
+
+OUTPUTS = dict(pils=True, ioc=True, opi=True, ioc_ip='10.0.0.1', plc_ip='10.0.0.2')
+
+
+def data_file_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+@pytest.fixture
+def timings():
+    yield timing.enable()
+    timing.disable()
+
+
+def test_stages_are_noops_when_disabled():
+    timing.disable()
+
+    with timing.stage('parse'):
+        timing.count('rows_read', 3)
+
+    assert timing.active() is None
+
+
+def test_stage_and_counters(timings):
+    with timing.stage('parse'):
+        pass
+    with timing.stage('parse'):
+        timing.count('rows_read', 3)
+    timing.count_unit('YMIR', 1, 2, 100)
+
+    data = timings.as_dict()
+    assert data['stages']['parse']['calls'] == 2
+    assert data['counters'] == {'rows_read': 3}
+    assert data['units'] == {'YMIR/1': {'files': 2, 'bytes': 100}}
+    assert json.loads(timings.to_json()) == data
+    assert 'YMIR/1' in timings.format_table()
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_pipeline_is_instrumented(timings, jobs):
+    sink = MemorySink()
+    with ExcelReader(data_file_path("multi_sheet_test.xlsx")) as reader:
+        generate_sheets(reader, [0, 1], jobs=jobs, sink=sink, **OUTPUTS)
+
+    assert {'parse', 'process', 'normalise', 'build_devices', 'render_pils', 'render_ioc', 'render_opi',
+            'write'} <= set(timings.seconds)
+    assert timings.counters['devices_built'] == 10
+    assert timings.counters['files_written'] == 9
+    assert timings.counters['bytes_written'] == sum(len(data) for data in sink.files.values())
+    assert sorted(timings.units) == ['TEST/1', 'YMIR/1', 'YMIR/2']
+    assert timings.units['TEST/1']['files'] == 3
+
+
+def test_sheets_are_only_printed_when_verbose(capsys):
+    with ExcelReader(data_file_path("multi_sheet_test.xlsx")) as reader:
+        reader.read_sheet_by_index(1, COLUMNS_INDEX)
+    assert capsys.readouterr().out == ''
+
+    with ExcelReader(data_file_path("multi_sheet_test.xlsx"), verbose=1) as reader:
+        reader.read_sheet_by_index(1, COLUMNS_INDEX)
+    assert 'BeamScanZ' in capsys.readouterr().out
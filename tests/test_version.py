@@ -0,0 +1,47 @@
+import pytest
+from src import version
+
+
+@pytest.fixture(autouse=True)
+def reset_version(monkeypatch):
+    monkeypatch.setattr(version, "_version", None)
+    monkeypatch.delenv(version.VERSION_ENV, raising=False)
+    yield
+    monkeypatch.setattr(version, "_version", None)
+
+
+def test_version_from_environment(monkeypatch):
+    monkeypatch.setenv(version.VERSION_ENV, "v1.2.3")
+
+    assert version.get_version() == "v1.2.3"
+
+
+def test_version_is_resolved_once(monkeypatch):
+    calls = []
+    monkeypatch.setattr(version, "_git_version", lambda: calls.append(1) or "abc1234")
+
+    assert version.get_version() == "abc1234"
+    assert version.get_version() == "abc1234"
+    assert len(calls) == 1
+
+
+def test_set_version_overrides_and_exports(monkeypatch):
+    monkeypatch.setattr(version, "_git_version", lambda: "abc1234")
+
+    version.set_version("release-7")
+
+    assert version.get_version() == "release-7"
+    assert version.os.environ[version.VERSION_ENV] == "release-7"
+
+
+def test_version_without_git(monkeypatch):
+    monkeypatch.setattr(version, "_git_version", lambda: None)
+    monkeypatch.setattr(version, "PACKAGE_NAME", "pils-epics-generator-not-installed")
+
+    assert version.get_version() == "unknown"
+
+
+def test_device_import_does_not_resolve_version():
+    import src.device  # noqa: F401
+
+    assert version._version is None
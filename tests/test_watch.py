@@ -0,0 +1,113 @@
+import os
+
+import openpyxl
+import pytest
+from src.watch import WorkbookWatcher, changed_sheets, part_signatures
+
+OUTPUTS = dict(pils=True, ioc=True, opi=False, ioc_ip='10.0.0.1', plc_ip='10.0.0.2')
+
+
+def data_file_path(filename):
+    return os.path.join(os.path.dirname(__file__), filename)
+
+
+def save_workbook(path, edit=None):
+    book = openpyxl.load_workbook(path)
+    if edit is not None:
+        edit(book)
+    book.save(path)
+    # Make sure the change is seen even on file systems with coarse timestamps
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    path = str(tmp_path / "motion.xlsx")
+    with open(data_file_path("multi_sheet_test.xlsx"), 'rb') as source, open(path, 'wb') as target:
+        target.write(source.read())
+    # Store the fixture the way every later save will, so only edited parts change
+    save_workbook(path)
+    return path
+
+
+def renumber_spare(book):
+    book["ymir_motion"].cell(row=16, column=9).value = 3
+
+
+def test_part_signatures(workbook):
+    shared, sheets = part_signatures(workbook)
+
+    assert len(sheets) == 2
+    assert None not in sheets
+    assert part_signatures(data_file_path("test_read_excel.py")) is None
+
+
+def test_only_edited_sheet_changes(workbook):
+    before = part_signatures(workbook)
+    save_workbook(workbook, renumber_spare)
+    after = part_signatures(workbook)
+
+    assert changed_sheets(before, after, [0, 1]) == [0]
+    assert changed_sheets(before, before, [0, 1]) == []
+    assert changed_sheets(None, after, [0, 1]) == [0, 1]
+    assert changed_sheets((('other',), before[1]), after, [1]) == [1]
+
+
+def test_watcher_regenerates_changed_units(workbook, tmp_path):
+    output_dir = tmp_path / "out"
+    watcher = WorkbookWatcher(workbook, [0, 1], output_dir=str(output_dir), per_instrument=True,
+                              interval=0, log=None, **OUTPUTS)
+
+    assert watcher.start() == {0: [1, 2], 1: [1]}
+    assert sorted(os.listdir(output_dir / "ymir")) == [
+        'mc_unit_1.TcGVL', 'mc_unit_2.TcGVL', 'st.ymir-mcs1.iocsh', 'st.ymir-mcs2.iocsh',
+    ]
+    unit_1 = (output_dir / "ymir" / "mc_unit_1.TcGVL").stat().st_mtime_ns
+    assert watcher.poll() is None
+
+    save_workbook(workbook, renumber_spare)
+
+    assert watcher.poll() == {0: [2]}
+    assert "nOffset" in (output_dir / "ymir" / "mc_unit_2.TcGVL").read_text()
+    assert "stMotorM3" in (output_dir / "ymir" / "mc_unit_2.TcGVL").read_text()
+    assert (output_dir / "ymir" / "mc_unit_1.TcGVL").stat().st_mtime_ns == unit_1
+    assert watcher.poll() is None
+
+
+def test_watcher_survives_broken_save(workbook, tmp_path):
+    watcher = WorkbookWatcher(workbook, [1], output_dir=str(tmp_path), interval=0, log=None, **OUTPUTS)
+    watcher.start()
+
+    with open(workbook, 'wb') as file:
+        file.write(b'not a workbook')
+
+    assert watcher.poll() is None
+    assert os.path.exists(tmp_path / "mc_unit_1.TcGVL")
+
+
+def test_watcher_rejects_duplicate_instrument(workbook, tmp_path):
+    logged = []
+    watcher = WorkbookWatcher(workbook, [0, 1], output_dir=str(tmp_path), per_instrument=True,
+                              interval=0, log=logged.append, **OUTPUTS)
+    watcher.start()
+    ymir = (tmp_path / "ymir" / "mc_unit_1.TcGVL").read_text()
+
+    save_workbook(workbook, lambda book: setattr(book["test_motion"].cell(row=1, column=3), 'value', 'YMIR'))
+
+    assert watcher.poll() == {}
+    assert "both describe instrument 'YMIR'" in logged[-1]
+    assert (tmp_path / "ymir" / "mc_unit_1.TcGVL").read_text() == ymir
+
+
+def test_watcher_logs_any_error(workbook, tmp_path, monkeypatch):
+    logged = []
+    watcher = WorkbookWatcher(workbook, [1], output_dir=str(tmp_path), interval=0, log=logged.append, **OUTPUTS)
+
+    def unsupported(*args, **kwargs):
+        raise NotImplementedError("Device type Hexapod not supported")
+
+    monkeypatch.setattr('src.watch.render_instrument', unsupported)
+
+    assert watcher.start() == {}
+    assert logged == [f"Could not generate {workbook}: Device type Hexapod not supported"]